@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+"""Time how fast a scrape file can be read and decoded."""
+import argparse
+import time
+
+from folditdb import scrape
+
+parser = argparse.ArgumentParser()
+parser.add_argument('scrape_file')
+args = parser.parse_args()
+
+print('Decoding with %s' % ('orjson' if scrape.orjson else 'json'))
+
+n_records = n_bytes = 0
+start = time.perf_counter()
+for json_bytes in scrape.iter_lines(args.scrape_file):
+    scrape.loads(json_bytes)
+    n_records += 1
+    n_bytes += len(json_bytes) + 1
+elapsed = time.perf_counter() - start
+
+print('%d records in %.1fs: %.0f records/s, %.1f MB/s' % (
+    n_records, elapsed, n_records/elapsed, n_bytes/elapsed/1e6))
@@ -1,12 +1,12 @@
 import logging
 from os import environ, remove
 
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 import pytest
 
 from folditdb import log, tables
+from folditdb.db import get_engine
 from folditdb.tables import Base
 from folditdb.irdata import IRData
 
@@ -56,8 +56,10 @@ def solution():
     return tables.Solution.from_irdata(IRData(_solution_data))
 
 @pytest.fixture
-def session():
-    DB = create_engine(environ['MYSQL_FOLDIT_TEST_DB'])
+def session(tmpdir):
+    # Tests run against a SQLite DB unless a test DB is given
+    url = environ.get('MYSQL_FOLDIT_TEST_DB') or 'sqlite:///%s' % tmpdir.join('test.db')
+    DB = get_engine(url)
     Base.metadata.create_all(DB)
     Session = sessionmaker()
     Session.configure(bind=DB)
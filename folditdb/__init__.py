@@ -1,2 +1,9 @@
-from folditdb.load import load_top_solutions_from_file
 from folditdb import log
+
+
+def __getattr__(name):
+    # folditdb.load imports SQLAlchemy, so it is only imported when it is used
+    if name == 'load_top_solutions_from_file':
+        from folditdb.load import load_top_solutions_from_file
+        return load_top_solutions_from_file
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
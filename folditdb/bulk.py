@@ -0,0 +1,253 @@
+"""Set-based loading of IRData records.
+
+The default loader in folditdb.load merges every model object into the
+session, and each merge issues a SELECT by primary key before the write.
+The bulk loader instead collects plain rows from many IRData records
+and writes each table with a single executemany statement per batch.
+
+Rows that may already be in the DB (puzzles, histories, teams) are
+written with INSERT IGNORE on MySQL and INSERT OR IGNORE on SQLite.
+The first history row for an id is kept, and a record whose history
+rows differ from it keeps its HISTORY string in the history_string
+table; see folditdb.history.
+Players are upserted, so the last name and team seen for a player id
+wins, as it does with session.merge(). Action names are resolved to
+action type ids as the action rows are written. The new solutions and
+actions are added to the summary tables in folditdb.summary.
+
+> rows = [rows_from_irdata(irdata) for irdata in irdatas]
+> write_rows(session, rows)
+> session.commit()
+"""
+from collections import OrderedDict
+
+from sqlalchemy.dialects import mysql
+
+from folditdb.cache import action_type_ids
+from folditdb.history import stored_histories, new_history_rows, history_string_row
+from folditdb.irdata import PDL
+from folditdb.query import stage_invalidations, solution_tags
+from folditdb.summary import add_to_summaries
+from folditdb.tables import (Solution, Puzzle, Team, Player, History,
+    HistoryString, ActionType, Action, player_solutions)
+
+# Tables in the order they must be written to satisfy foreign keys
+TABLES = OrderedDict([
+    ('puzzle', Puzzle.__table__),
+    ('history', History.__table__),
+    ('history_string', HistoryString.__table__),
+    ('team', Team.__table__),
+    ('player', Player.__table__),
+    ('solution', Solution.__table__),
+    ('player_solutions', player_solutions),
+    ('action_type', ActionType.__table__),
+    ('action', Action.__table__),
+])
+
+# Primary keys of tables whose rows are shared between solutions
+SHARED_KEYS = dict(
+    puzzle='id',
+    history='id',
+    history_string='hash',
+    team='name',
+    player='id',
+)
+
+
+def rows_from_irdata(irdata):
+    """Build the rows for each table touched by a single IRData record.
+
+    Returns a dict mapping table names to lists of rows. The rows are
+    the same ones that folditdb.load.load_from_irdata would write.
+    """
+    rows = {name: [] for name in TABLES}
+
+    solution = Solution.row_from_irdata(irdata)
+    rows['puzzle'].append(Puzzle.row_from_irdata(irdata))
+    rows['history'] = History.rows_from_irdata(irdata)
+    if not irdata.history_rebuildable:
+        rows['history_string'].append(HistoryString.row_from_irdata(irdata))
+    rows['solution'].append(solution)
+
+    pdls = PDL.from_irdata(irdata)
+
+    for pdl in pdls:
+        rows['team'].append(Team.row_from_pdl(pdl))
+        rows['player'].append(Player.row_from_pdl(pdl))
+
+        link = dict(player_id=pdl.player_id, solution_id=solution['id'])
+        if link not in rows['player_solutions']:
+            rows['player_solutions'].append(link)
+
+    if irdata.solution_type == 'top':
+        for pdl in pdls:
+            rows['action'].extend(Action.rows_from_pdl(pdl))
+
+    return rows
+
+
+def solution_id(rows):
+    """The id of the solution described by a record's rows."""
+    return rows['solution'][0]['id']
+
+
+def loaded_solution_ids(session, solution_ids, cache=None):
+    """Return the subset of solution ids that are already in the DB.
+
+    Only the ids that a folditdb.cache.KeyCache cannot answer for
+    are queried.
+    """
+    loaded = set()
+    if cache is not None:
+        loaded = {sid for sid in solution_ids if cache.known('solution', sid)}
+        solution_ids = [] if cache.complete else [sid for sid in solution_ids
+                                                  if sid not in loaded]
+
+    if solution_ids:
+        query = session.query(Solution.id).filter(Solution.id.in_(solution_ids))
+        for (sid, ) in query:
+            loaded.add(sid)
+            if cache is not None:
+                cache.add('solution', sid)
+
+    return loaded
+
+
+def write_rows(session, records, cache=None):
+    """Write the rows for many records with one statement per table.
+
+    Records are dicts of rows as returned by rows_from_irdata. The
+    session is not committed. Shared rows whose keys are in the cache
+    are not written.
+
+    Returns a dict of the number of rows written to each table.
+    """
+    dialect = session.bind.dialect.name
+    if cache is not None:
+        cache.track(session)
+
+    histories = history_rows(session, records, cache)
+    written, written_rows = {}, {}
+    for name, table in TABLES.items():
+        if name in histories:
+            table_rows = histories[name]
+        else:
+            table_rows = [row for rows in records for row in rows[name]]
+
+        if name in SHARED_KEYS:
+            key = SHARED_KEYS[name]
+            unique = OrderedDict()
+            for row in table_rows:
+                unique[row[key]] = row
+            if cache is not None:
+                for k in [k for k in unique if cache.known(name, k)]:
+                    del unique[k]
+                for k in unique:
+                    cache.stage(name, k)
+            table_rows = list(unique.values())
+        elif cache is not None and name == 'solution':
+            for row in table_rows:
+                cache.stage(name, row['id'])
+
+        if not table_rows:
+            continue
+
+        if name == 'action':
+            table_rows = with_action_type_ids(session, table_rows)
+
+        if name == 'player':
+            statement = upsert(table, dialect)
+        elif name in SHARED_KEYS:
+            statement = insert_ignore(table, dialect)
+        else:
+            statement = table.insert()
+
+        session.execute(statement, table_rows)
+        written[name] = len(table_rows)
+        written_rows[name] = table_rows
+
+    add_to_summaries(session, written_rows.get('solution', []), written_rows.get('action', []))
+
+    # Cached query results for these puzzles, players and teams are stale
+    # once the session commits
+    for rows in records:
+        stage_invalidations(session, solution_tags(
+            rows['solution'][0]['puzzle_id'], [row['id'] for row in rows['player']],
+            [row['name'] for row in rows['team']]))
+
+    return written
+
+
+def history_rows(session, records, cache=None):
+    """The history and history_string rows to write for many records.
+
+    History rows with stored ids are left out, and of the rows for the
+    same new id the first wins, as in folditdb.load.load_from_irdata.
+    A record whose history rows differ from the ones that win gets a
+    history_string row, so its HISTORY string is kept in full.
+    """
+    history_ids = [row['id'] for rows in records for row in rows['history']]
+    if cache is not None and cache.complete:
+        history_ids = [history_id for history_id in history_ids
+                       if cache.known('history', history_id)]
+    known = stored_histories(session, history_ids)
+
+    histories = dict(history=[], history_string=[])
+    for rows in records:
+        new_rows, conflict = new_history_rows(rows['history'], known)
+        histories['history'].extend(new_rows)
+        histories['history_string'].extend(rows['history_string'])
+        if conflict and not rows['history_string']:
+            histories['history_string'].append(history_string_row(rows['history']))
+    return histories
+
+
+def with_action_type_ids(session, action_rows):
+    """Replace the action names in action rows with action type ids."""
+    type_ids = action_type_ids(session, [row['action_name'] for row in action_rows])
+    return [dict(action_type_id=type_ids[row['action_name']], action_n=row['action_n'],
+                 player_id=row['player_id'], puzzle_id=row['puzzle_id'])
+            for row in action_rows]
+
+
+def insert_ignore(table, dialect):
+    """An INSERT statement that skips rows with existing primary keys."""
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    raise ValueError('bulk loading is not supported for dialect "%s"' % dialect)
+
+
+def upsert(table, dialect):
+    """An INSERT statement that overwrites rows with existing primary keys."""
+    if dialect == 'mysql':
+        statement = mysql.insert(table)
+        updates = {column.name: statement.inserted[column.name]
+                   for column in table.columns if not column.primary_key}
+        return statement.on_duplicate_key_update(**updates)
+    elif dialect == 'sqlite':
+        return table.insert().prefix_with('OR REPLACE')
+    raise ValueError('bulk loading is not supported for dialect "%s"' % dialect)
+
+
+def pack_rows(rows):
+    """Convert a record's rows to tuples for cheap transfer between processes.
+
+    Each table's rows become a pair of the column names and a list of
+    value tuples in that column order.
+    """
+    packed = {}
+    for name, table_rows in rows.items():
+        if table_rows:
+            columns = tuple(table_rows[0])
+            packed[name] = (columns, [tuple(row[c] for c in columns) for row in table_rows])
+    return packed
+
+
+def unpack_rows(packed):
+    """Convert rows packed with pack_rows back to dicts."""
+    rows = {name: [] for name in TABLES}
+    for name, (columns, values) in packed.items():
+        rows[name] = [dict(zip(columns, row)) for row in values]
+    return rows
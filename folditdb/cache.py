@@ -0,0 +1,289 @@
+"""In-memory cache of primary keys that are already in the DB.
+
+Most records in a scrape file share their puzzle, team, players and
+histories with records loaded earlier in the same run. A KeyCache
+remembers those keys so the loaders can skip the query that checks
+whether a solution exists and the session.merge() calls for rows that
+are already in the DB.
+
+> cache = KeyCache()
+> cache.seed(session)
+> cache.track(session)
+> load_top_solutions_from_file('scrape.json', session, cache=cache)
+
+Keys written in the current transaction are staged and only become
+known once the session commits, so a rollback never leaves the cache
+claiming rows that are not in the DB. The loaders call track() on
+each session that writes rows through the cache.
+
+By default every key is remembered. Integer keys are kept in a bitmap
+that costs one bit per possible id, so all solution ids in the archive
+fit in a few hundred MB. Pass max_size to keep only the most recently
+used keys of each kind instead.
+
+The cache assumes this process is the only writer. After seed(), a
+solution id that is not in an unbounded cache is taken to be missing
+from the DB without querying it.
+
+Action names are interned in the same way by an ActionTypeCache, which
+the loaders keep for each session. See action_type_ids. Seeding a
+KeyCache also seeds the action types for the session.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from weakref import WeakKeyDictionary, WeakSet
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from folditdb.tables import Solution, Puzzle, Team, Player, History, HistoryString, ActionType
+
+# Kinds of keys and the columns they are read from when seeding
+KINDS = OrderedDict([
+    ('solution', Solution.id),
+    ('puzzle', Puzzle.id),
+    ('team', Team.name),
+    ('player', Player.id),
+    ('history', History.id),
+    ('history_string', HistoryString.hash),
+])
+
+INTEGER_KINDS = {'solution', 'puzzle', 'player'}
+
+
+class IntSet:
+    """A set of non-negative integers stored as a bitmap."""
+    def __init__(self):
+        self._bits = bytearray()
+        self._len = 0
+
+    def add(self, n):
+        if n < 0:
+            raise ValueError('IntSet only holds non-negative integers: %s' % n)
+        byte, bit = divmod(n, 8)
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(max(byte + 1 - len(self._bits), len(self._bits))))
+        if not self._bits[byte] & (1 << bit):
+            self._bits[byte] |= 1 << bit
+            self._len += 1
+
+    def __contains__(self, n):
+        byte, bit = divmod(n, 8)
+        return 0 <= byte < len(self._bits) and bool(self._bits[byte] & (1 << bit))
+
+    def __len__(self):
+        return self._len
+
+
+class LRUSet:
+    """A set that forgets its least recently used members past max_size."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def __contains__(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class TransactionCache(ABC):
+    """Base class for caches of rows written through a session.
+
+    Entries for rows written in the current transaction are staged, and
+    only enter the cache when the outermost transaction commits. Staged
+    entries are discarded when their transaction or savepoint rolls back.
+    Subclasses say what committing and discarding an entry means.
+    """
+    def __init__(self):
+        self._staged = []
+        self._savepoints = WeakKeyDictionary()
+        self._sessions = WeakSet()
+
+    @abstractmethod
+    def _commit_entry(self, entry):
+        pass
+
+    @abstractmethod
+    def _discard_entry(self, entry):
+        pass
+
+    def commit(self):
+        for entry in self._staged:
+            self._commit_entry(entry)
+        self.rollback()
+
+    def rollback(self, savepoint=0):
+        for entry in self._staged[savepoint:]:
+            self._discard_entry(entry)
+        del self._staged[savepoint:]
+
+    def track(self, session):
+        """Commit and roll back staged entries along with the session."""
+        if session in self._sessions:
+            return
+        self._sessions.add(session)
+        event.listen(session, 'after_transaction_create', self._after_transaction_create)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_soft_rollback', self._after_soft_rollback)
+        event.listen(session, 'after_transaction_end', self._after_transaction_end)
+
+    def _after_transaction_create(self, session, transaction):
+        if transaction.nested:
+            self._savepoints[transaction] = len(self._staged)
+
+    def _after_commit(self, session):
+        # Releasing a savepoint also fires after_commit
+        if not session.transaction.nested:
+            self.commit()
+
+    def _after_soft_rollback(self, session, previous_transaction):
+        if previous_transaction.nested:
+            self.rollback(self._savepoints.get(previous_transaction, 0))
+
+    def _after_transaction_end(self, session, transaction):
+        # Anything still staged when the outermost transaction ends
+        # was rolled back or discarded with the session
+        if transaction.parent is None:
+            self.rollback()
+
+
+class KeyCache(TransactionCache):
+    def __init__(self, max_size=None):
+        super().__init__()
+        self.max_size = max_size
+        self.complete = False
+        self._known = {kind: self._new_set(kind) for kind in KINDS}
+        self._staged_keys = set()
+
+    def _new_set(self, kind):
+        if self.max_size is not None:
+            return LRUSet(self.max_size)
+        elif kind in INTEGER_KINDS:
+            return IntSet()
+        return set()
+
+    def known(self, kind, key):
+        """True if the key is in the DB or was written in this transaction."""
+        return (kind, key) in self._staged_keys or key in self._known[kind]
+
+    def add(self, kind, key):
+        """Remember a key that is known to be committed to the DB."""
+        if kind in INTEGER_KINDS and key < 0:
+            return
+        self._known[kind].add(key)
+
+    def stage(self, kind, key):
+        """Remember a key that was written in the current transaction."""
+        if (kind, key) not in self._staged_keys:
+            self._staged.append((kind, key))
+            self._staged_keys.add((kind, key))
+
+    def seed(self, session):
+        """Remember every key in the DB.
+
+        An unbounded cache is complete after seeding: solution ids
+        that are not in the cache are not in the DB.
+        """
+        for kind, column in KINDS.items():
+            for (key, ) in session.query(column):
+                self.add(kind, key)
+        self.complete = self.max_size is None
+        action_type_cache(session).seed(session)
+
+    def _commit_entry(self, entry):
+        self.add(*entry)
+
+    def _discard_entry(self, entry):
+        self._staged_keys.discard(entry)
+
+
+class ActionTypeCache(TransactionCache):
+    """Ids for action names, inserting names that are new to the DB.
+
+    There are only a few hundred action names, so every id that has
+    been looked up or inserted is remembered. After seed(), names that
+    are not in the cache are inserted without querying the DB.
+    """
+    def __init__(self):
+        super().__init__()
+        self.complete = False
+        self._ids = {}
+        self._staged_ids = {}
+
+    def seed(self, session):
+        """Remember every action type in the DB."""
+        self._ids.update(session.query(ActionType.name, ActionType.id))
+        self.complete = True
+
+    def ids(self, session, action_names):
+        """A dict mapping each action name to its id.
+
+        New names are inserted in the order they are given, without
+        committing the session.
+        """
+        self.track(session)
+        missing = [name for name in OrderedDict.fromkeys(action_names)
+                   if name not in self._ids and name not in self._staged_ids]
+        if missing and not self.complete:
+            # Action types in the DB but not in the cache were committed
+            # by an earlier session
+            self._ids.update(session.query(ActionType.name, ActionType.id)
+                                    .filter(ActionType.name.in_(missing)))
+            missing = [name for name in missing if name not in self._ids]
+
+        # New names are rare enough to insert one at a time
+        insert = ActionType.__table__.insert()
+        for name in missing:
+            self._staged_ids[name] = self._insert(session, insert, name)
+            self._staged.append(name)
+
+        return {name: self._ids[name] if name in self._ids else self._staged_ids[name]
+                for name in action_names}
+
+    def _insert(self, session, insert, name):
+        """Insert an action name and return its id.
+
+        Another session on the same DB, such as another writer in
+        folditdb.shard, may have inserted the name first. Its id is then
+        read with a locking read, which sees rows committed after this
+        transaction began.
+        """
+        savepoint = session.begin_nested()
+        try:
+            result = session.execute(insert, dict(name=name))
+        except IntegrityError:
+            savepoint.rollback()
+            return (session.query(ActionType.id).filter(ActionType.name == name)
+                           .with_for_update(read=True).scalar())
+        savepoint.commit()
+        return result.inserted_primary_key[0]
+
+    def _commit_entry(self, name):
+        self._ids[name] = self._staged_ids.pop(name)
+
+    def _discard_entry(self, name):
+        self._staged_ids.pop(name, None)
+
+
+def action_type_cache(session):
+    """The ActionTypeCache kept for a session."""
+    cache = session.info.get('action_type_cache')
+    if cache is None:
+        cache = session.info['action_type_cache'] = ActionTypeCache()
+    return cache
+
+
+def action_type_ids(session, action_names):
+    """Ids for action names, from the ActionTypeCache kept for the session."""
+    return action_type_cache(session).ids(session, action_names)
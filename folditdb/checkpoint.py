@@ -0,0 +1,39 @@
+"""Checkpoints for resuming loads of scrape files.
+
+After each batch of records from a scrape file, the loaders save the
+position reached in the file in the checkpoint table, in the same
+transaction as the batch. A load that is resumed seeks straight to the
+position of the last committed batch instead of reading every line from
+the start and finding each solution already in the DB.
+
+> load_top_solutions_from_file('scrape.json', session, resume=True)
+"""
+import hashlib
+import os
+
+from folditdb import bulk
+from folditdb.tables import Checkpoint
+
+
+def checkpoint_hash(scrape_filepath):
+    scrape_filepath = os.path.abspath(scrape_filepath)
+    return hashlib.sha256(scrape_filepath.encode('utf-8')).hexdigest()
+
+
+def load_checkpoint(session, scrape_filepath):
+    """The (offset, line) reached in a scrape file, or (0, 0) if there is none."""
+    checkpoint = (session.query(Checkpoint.offset, Checkpoint.line)
+                         .filter(Checkpoint.hash == checkpoint_hash(scrape_filepath))
+                         .first())
+    if checkpoint is None:
+        return 0, 0
+    return tuple(checkpoint)
+
+
+def save_checkpoint(session, scrape_filepath, offset, line):
+    """Save the position reached in a scrape file. The session is not committed."""
+    row = dict(hash=checkpoint_hash(scrape_filepath),
+               scrape_file=os.path.abspath(scrape_filepath),
+               offset=offset, line=line)
+    statement = bulk.upsert(Checkpoint.__table__, session.bind.dialect.name)
+    session.execute(statement, [row])
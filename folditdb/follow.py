@@ -0,0 +1,257 @@
+"""Follow scrape files as they grow, like tail -F.
+
+The scrape job appends to its scrape files continuously. Instead of
+loading each file again from the start, follow keeps reading new lines
+as they are written and loads them in micro-batches:
+
+> follow(['scrape.json'], session, bulk_size=1000, max_delay=1.0)
+
+The lines read from each file are committed once bulk_size records are
+waiting, or max_delay seconds after the oldest of them was read,
+whichever comes first, so records wait at most max_delay plus the
+POLL_INTERVAL between reads of idle files. A line is only read once its
+newline has been written. A file with a large backlog, such as one
+followed for the first time, is read bulk_size lines at a time rather
+than all at once.
+
+The position reached in each file is saved in the checkpoint table
+with every commit, and following starts from it, so a restarted
+follower picks up where the last one stopped. See folditdb.checkpoint.
+
+A file that is renamed away and replaced, as by logrotate, is read to
+its end and then the new file is followed from its start. A file that
+is truncated in place is followed from its start. A file that does not
+exist yet is waited for. If a file was rotated while nothing was
+following it, the saved position is only used when it is within the
+new file and at the start of a line; otherwise the file is read from
+the start and the solutions already loaded are logged as duplicates.
+"""
+import logging
+import os
+import threading
+import time
+
+from folditdb import bulk, scrape
+from folditdb.checkpoint import load_checkpoint
+from folditdb.irdata import IRData
+from folditdb.load import write_bulk_batch, _log_error
+from folditdb.stats import NULL_STATS
+
+logger = logging.getLogger(__name__)
+
+# Records committed at a time
+BULK_SIZE = 1000
+
+# Seconds a record waits before it is committed
+MAX_DELAY = 1.0
+
+# Seconds to wait for new lines when the files are idle
+POLL_INTERVAL = 0.1
+
+
+class FileTail:
+    """Read the complete lines appended to a file since the last read.
+
+    offset and line are the position through the end of the last line
+    read, as in scrape.ScrapeReader.
+    """
+    def __init__(self, filepath, offset=0, line=0, chunk_size=scrape.CHUNK_SIZE):
+        if scrape.is_compressed(filepath):
+            raise ValueError('compressed scrape files cannot be followed: %s' % filepath)
+        self.filepath = filepath
+        self.offset = offset
+        self.line = line
+        self.chunk_size = chunk_size
+        self._file = None
+        self._identity = None
+        self._remainder = b''
+
+    def read_lines(self, final=False, max_lines=None):
+        """A list of (line, offset, json_bytes) for the lines written since the last read.
+
+        At most max_lines lines are returned, and the rest are kept for
+        the next read. An unfinished last line is kept for the next
+        read, unless final is True.
+        """
+        if self._file is None and not self._open():
+            return []
+
+        lines = []
+        while max_lines is None or len(lines) < max_lines:
+            if b'\n' in self._remainder:
+                # Lines left over from the last read
+                chunk = b''
+            else:
+                chunk = self._file.read(self.chunk_size)
+                if not chunk:
+                    break
+            parts = (self._remainder + chunk).split(b'\n')
+            self._remainder = parts.pop()
+            if max_lines is not None and len(lines) + len(parts) > max_lines:
+                n = max_lines - len(lines)
+                self._remainder = b'\n'.join(parts[n:] + [self._remainder])
+                parts = parts[:n]
+            for json_bytes in parts:
+                self.offset += len(json_bytes) + 1
+                self.line += 1
+                lines.append((self.line, self.offset, json_bytes))
+
+        if final and self._remainder and b'\n' not in self._remainder:
+            self.offset += len(self._remainder)
+            self.line += 1
+            lines.append((self.line, self.offset, self._remainder))
+            self._remainder = b''
+        return lines
+
+    def rotated(self):
+        """True if the file has been replaced or truncated since it was opened."""
+        if self._file is None:
+            return False
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            # Renamed away, and not replaced yet
+            return False
+        if (stat.st_dev, stat.st_ino) != self._identity:
+            return True
+        return stat.st_size < self.offset + len(self._remainder)
+
+    def reopen(self):
+        """Follow the file now at the path from its start."""
+        self.close()
+        self.offset = self.line = 0
+        self._remainder = b''
+        self._open()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        try:
+            scrape_file = open(self.filepath, 'rb')
+        except FileNotFoundError:
+            return False
+        stat = os.fstat(scrape_file.fileno())
+        if self.offset and not _at_line_start(scrape_file, self.offset, stat.st_size):
+            logger.error('%s: checkpoint at byte %d does not fit the file, reading it from '
+                         'the start', self.filepath, self.offset)
+            self.offset = self.line = 0
+        scrape_file.seek(self.offset)
+        self._file = scrape_file
+        self._identity = (stat.st_dev, stat.st_ino)
+        return True
+
+
+def _at_line_start(scrape_file, offset, size):
+    if offset > size:
+        return False
+    scrape_file.seek(offset - 1)
+    return scrape_file.read(1) == b'\n'
+
+
+class Follower:
+    """Micro-batch the new lines in scrape files into a session.
+
+    Each call to poll reads up to bulk_size of the lines written to
+    each file since the last call, and commits the batches that are due.
+    """
+    def __init__(self, scrape_filepaths, session, bulk_size=BULK_SIZE, max_delay=MAX_DELAY,
+                 cache=None, stats=None, claimed=None):
+        self.session = session
+        self.bulk_size = bulk_size
+        self.max_delay = max_delay
+        self.cache = cache
+        self.stats = NULL_STATS if stats is None else stats
+        self.claimed = claimed
+        self.clock = time.monotonic
+        self.tails = [FileTail(filepath, *load_checkpoint(session, filepath))
+                      for filepath in scrape_filepaths]
+        # Do not hold the transaction the checkpoints were read in while idle
+        session.rollback()
+        # For each file, records read but not committed, the checkpoint
+        # to commit with them, and when the first was read
+        self._batches = {tail.filepath: [] for tail in self.tails}
+        self._positions = {}
+        self._since = {}
+
+    def poll(self):
+        """Read new lines, commit the batches that are due, and return the lines read."""
+        n_lines = 0
+        for tail in self.tails:
+            lines = tail.read_lines(max_lines=self.bulk_size)
+            if tail.rotated():
+                # Finish the old file before following the new one
+                lines += tail.read_lines(final=True)
+                self._add(tail, lines)
+                self._commit(tail)
+                n_lines += len(lines)
+                tail.reopen()
+                lines = tail.read_lines(max_lines=self.bulk_size)
+            self._add(tail, lines)
+            n_lines += len(lines)
+
+            since = self._since.get(tail.filepath)
+            if since is not None and self.clock() - since >= self.max_delay:
+                self._commit(tail)
+        return n_lines
+
+    def flush(self):
+        """Commit every record read so far."""
+        for tail in self.tails:
+            self._commit(tail)
+
+    def close(self):
+        self.flush()
+        for tail in self.tails:
+            tail.close()
+
+    def _add(self, tail, lines):
+        batch = self._batches[tail.filepath]
+        for line, offset, json_bytes in lines:
+            self.stats.read()
+            self._positions[tail.filepath] = (offset, line)
+            self._since.setdefault(tail.filepath, self.clock())
+            try:
+                start = self.stats.clock()
+                irdata = IRData.from_json(json_bytes)
+                irdata.decode()
+                start = self.stats.add_time('parse', start)
+                batch.append((line, bulk.rows_from_irdata(irdata)))
+                self.stats.add_time('build', start)
+            except Exception as err:
+                _log_error(tail.filepath, line, err, self.stats)
+                continue
+
+            if len(batch) == self.bulk_size:
+                self._commit(tail)
+                batch = self._batches[tail.filepath]
+
+    def _commit(self, tail):
+        """Commit the records read from a file, if any lines were read since the last commit."""
+        position = self._positions.pop(tail.filepath, None)
+        if position is None:
+            return
+        batch, self._batches[tail.filepath] = self._batches[tail.filepath], []
+        del self._since[tail.filepath]
+        write_bulk_batch(batch, self.session, tail.filepath, self.cache, self.stats,
+                         position, self.claimed)
+
+
+def follow(scrape_filepaths, session, bulk_size=BULK_SIZE, max_delay=MAX_DELAY, cache=None,
+           stats=None, claimed=None, stop=None, poll_interval=POLL_INTERVAL):
+    """Load the lines written to scrape files until stop is set.
+
+    stop is a threading.Event. Everything read is committed before
+    returning, including when following is interrupted.
+    """
+    if stop is None:
+        stop = threading.Event()
+    follower = Follower(scrape_filepaths, session, bulk_size, max_delay, cache, stats, claimed)
+    try:
+        while not stop.is_set():
+            if not follower.poll():
+                stop.wait(poll_interval)
+    finally:
+        follower.close()
@@ -0,0 +1,112 @@
+"""Rebuild HISTORY strings from the history table.
+
+Solutions store the id of the last version in their history, and each
+row of the history table points to the version before it. A solution's
+HISTORY string is rebuilt by following the parents back to the start of
+the lineage, in one recursive query:
+
+> history_string(session, solution)
+
+HISTORY strings that cannot be rebuilt from the history table are
+stored in the history_string table, and are returned from there.
+
+The first row written for a history id is kept. A later HISTORY string
+that gives the id a different parent or move count cannot be rebuilt
+from the stored rows, so it is stored in full; see new_history_rows.
+"""
+from sqlalchemy import select, literal
+
+from folditdb.irdata import format_history, hash_history
+from folditdb.tables import History, HistoryString
+
+# Parents followed before a lineage is assumed to loop back on itself
+MAX_LINEAGE_LENGTH = 100000
+
+# History ids looked up in one query
+LOOKUP_SIZE = 500
+
+
+class HistoryRebuildError(Exception):
+    pass
+
+
+def lineage(session, history_id):
+    """The ids and move counts in the lineage of a history id, oldest first."""
+    history = History.__table__
+    chain = (select([history.c.id, history.c.parent_id, history.c.moves,
+                     literal(0).label('depth')])
+             .where(history.c.id == history_id)
+             .cte('chain', recursive=True))
+    parent = history.alias('parent')
+    chain = chain.union_all(
+        select([parent.c.id, parent.c.parent_id, parent.c.moves, chain.c.depth + 1])
+        .where(parent.c.id == chain.c.parent_id)
+        .where(chain.c.depth < MAX_LINEAGE_LENGTH)
+    )
+    rows = session.execute(select([chain.c.id, chain.c.moves]).order_by(chain.c.depth.desc()))
+    return [tuple(row) for row in rows]
+
+
+def stored_histories(session, history_ids):
+    """A dict of the (parent_id, moves) of the stored history rows with these ids."""
+    history_ids = sorted(set(history_ids))
+    stored = {}
+    for i in range(0, len(history_ids), LOOKUP_SIZE):
+        query = (session.query(History.id, History.parent_id, History.moves)
+                 .filter(History.id.in_(history_ids[i:i + LOOKUP_SIZE])))
+        for history_id, parent_id, moves in query:
+            stored[history_id] = (parent_id, moves)
+    return stored
+
+
+def new_history_rows(history_rows, known):
+    """The history rows with new ids, and whether the rest differ from the known rows.
+
+    known maps history ids to (parent_id, moves) and the new rows are
+    added to it, so the first row for an id wins. When any row differs
+    from the known row for its id, the HISTORY string the rows came from
+    cannot be rebuilt and must be stored in the history_string table.
+    """
+    new_rows, conflict = [], False
+    for row in history_rows:
+        value = (row['parent_id'], row['moves'])
+        if row['id'] not in known:
+            known[row['id']] = value
+            new_rows.append(row)
+        elif known[row['id']] != value:
+            conflict = True
+    return new_rows, conflict
+
+
+def history_string_row(history_rows):
+    """The history_string row for the HISTORY string that history rows format to."""
+    string = format_history([row['id'] for row in history_rows],
+                            [row['moves'] for row in history_rows])
+    return dict(hash=hash_history(string), history_string=string)
+
+
+def rebuild_history_string(session, history_id):
+    """Rebuild the HISTORY string that ends with a history id."""
+    pairs = lineage(session, history_id)
+    if not pairs:
+        raise HistoryRebuildError('history not found: history_id="%s"' % history_id)
+    ids, moves = zip(*pairs)
+    if None in moves:
+        raise HistoryRebuildError('history has no moves: history_id="%s"' % history_id)
+    return format_history(ids, moves)
+
+
+def history_string(session, solution):
+    """The HISTORY string for a solution, checked against its history_hash."""
+    stored = session.query(HistoryString.history_string).filter_by(
+        hash=solution.history_hash).scalar()
+    if stored is not None:
+        return stored
+
+    rebuilt = rebuild_history_string(session, solution.history_id)
+    if solution.history_hash is None:
+        return rebuilt
+    if hash_history(rebuilt) != solution.history_hash:
+        msg = 'rebuilt history does not match history_hash: solution_id=%s'
+        raise HistoryRebuildError(msg % solution.id)
+    return rebuilt
@@ -1,10 +1,12 @@
-import json
 import logging
 import hashlib
 import re
+import sys
+from array import array
 from datetime import datetime
 
 from folditdb import tables
+from folditdb import scrape
 
 
 class IRDataCreationError(Exception):
@@ -20,6 +22,46 @@ class PDLPropertyError(Exception):
     pass
 
 
+class ParsedHistory:
+    """The history ids and move counts in a HISTORY string.
+
+    HISTORY strings are comma separated "id:moves" pairs. They are split
+    once, into a list of ids and an array of move counts. If any move
+    count cannot be parsed, moves is None.
+
+    > history = ParsedHistory('V1:10,V2:5,V3:8')
+    > history.ids == ['V1', 'V2', 'V3']
+    > sum(history.moves) == 23
+    """
+    __slots__ = ('ids', 'moves', 'last_pair_valid')
+
+    def __init__(self, history_string):
+        ids = []
+        moves = array('i')
+        for pair in history_string.split(','):
+            fields = pair.split(':')
+            ids.append(fields[0])
+            if moves is not None:
+                try:
+                    moves.append(int(fields[1]))
+                except (IndexError, ValueError, OverflowError):
+                    moves = None
+
+        self.ids = ids
+        self.moves = moves
+        self.last_pair_valid = (len(fields) == 2)
+
+
+def format_history(ids, moves):
+    """Join history ids and move counts into a HISTORY string."""
+    return ','.join('%s:%d' % pair for pair in zip(ids, moves))
+
+
+def hash_history(history_string):
+    """The sha256 hex digest of a HISTORY string, as stored in history_hash."""
+    return hashlib.sha256(history_string.encode('utf-8')).hexdigest()
+
+
 class IRData:
     """IRData objects facilite the transfer of IRData to model objects.
 
@@ -44,9 +86,15 @@ class IRData:
     > irdata = IRData.from_json(json_str)
     > irdata.history_id == 'V3'
 
+    IRData objects created from json decode it the first time a property
+    is accessed, so a line of bad json raises an IRDataCreationError
+    then rather than when the object is created.
+
     Properties such as history_id in the above example are computed
-    once and cached. If a property cannot be computed, an IRDataPropertyError
-    is raised, and an error is printed to the module logger.
+    once and cached in slots. All of the history properties are derived
+    from a single parse of the HISTORY string. If a property cannot be
+    computed, an IRDataPropertyError is raised, and an error is printed
+    to the module logger.
 
     The reason for using IRData objects is to facilitate the translation
     of the same json data into multiple model objects without redundantly
@@ -57,24 +105,35 @@ class IRData:
     > puzzle   = Puzzle.from_irdata(irdata)
     > solution = Solution.from_irdata(irdata)
     """
+    __slots__ = ('_json', '_decoded', '_filename', '_solution_type',
+                 '_solution_id', '_puzzle_id', '_history', '_history_hash',
+                 '_score', '_timestamp', '_pdl_strings')
+
     def __init__(self, data):
         """Create an IRData object from a dict of strings."""
-        self._data = data
-        self._cache = {}
+        self._json = None
+        self._decoded = data
+        self._filename = None
+        self._solution_type = None
+        self._solution_id = None
+        self._puzzle_id = None
+        self._history = None
+        self._history_hash = None
+        self._score = None
+        self._timestamp = None
+        self._pdl_strings = None
 
     @classmethod
     def from_json(cls, json_str):
-        """Create an IRData object from a json string."""
-        try:
-            data = json.loads(json_str)
-        except json.JSONDecodeError as err:
-            raise IRDataCreationError('bad JSON: %s' % err)
-        return cls(data)
+        """Create an IRData object from a json string or bytes."""
+        irdata = cls(None)
+        irdata._json = json_str
+        return irdata
 
     @classmethod
     def from_file(cls, json_filepath):
         """Create an IRData object from a json file."""
-        with open(json_filepath) as json_file:
+        with open(json_filepath, 'rb') as json_file:
             json_str = json_file.read()
             return cls.from_json(json_str)
 
@@ -83,10 +142,24 @@ class IRData:
         """Create IRData objects for each line of json in a scrape file.
 
         A scrape file is the output of the foldit-go command 'scrape'.
+        See folditdb.scrape for how scrape files are read.
         """
-        with open(scrape_filepath) as scrape_file:
-            for json_str in scrape_file:
-                yield cls.from_json(json_str)
+        for json_bytes in scrape.iter_lines(scrape_filepath):
+            yield cls.from_json(json_bytes)
+
+    @property
+    def _data(self):
+        if self._decoded is None:
+            try:
+                self._decoded = scrape.loads(self._json)
+            except (scrape.JSONDecodeError, UnicodeDecodeError) as err:
+                raise IRDataCreationError('bad JSON: %s' % err)
+            self._json = None
+        return self._decoded
+
+    def decode(self):
+        """Decode the json now instead of when a property is first read."""
+        self._data
 
     # Begin defining IRData properties -----------------------------------------
 
@@ -96,20 +169,21 @@ class IRData:
 
         Filenames contain information about ranking for top solutions.
         """
-        if 'filename' in self._cache:
-            return self._cache['filename']
+        if self._filename is not None:
+            return self._filename
 
         filename = self._data.get('FILEPATH')
         if filename is None:
             raise IRDataPropertyError('solution has no FILEPATH')
 
-        return self._cache.setdefault('filename', filename)
+        self._filename = filename
+        return filename
 
     @property
     def solution_type(self):
         """Solutions can be "top" or "regular"."""
-        if 'solution_type' in self._cache:
-            return self._cache['solution_type']
+        if self._solution_type is not None:
+            return self._solution_type
 
         if '/top/' in self.filename:
             solution_type = 'top'
@@ -119,12 +193,13 @@ class IRData:
             msg = 'cannot determine solution type from filename: filename="%s"'
             raise IRDataPropertyError(msg % self.filename)
 
-        return self._cache.setdefault('solution_type', solution_type)
+        self._solution_type = solution_type
+        return solution_type
 
     @property
     def solution_id(self):
-        if 'solution_id' in self._cache:
-            return self._cache['solution_id']
+        if self._solution_id is not None:
+            return self._solution_id
 
         sid_str = self._data.get('SID')
         if sid_str is None:
@@ -137,12 +212,13 @@ class IRData:
             msg = 'SID is not an int: SID="%s"'
             raise IRDataPropertyError(msg % sid_str)
 
-        return self._cache.setdefault('solution_id', solution_id)
+        self._solution_id = solution_id
+        return solution_id
 
     @property
     def puzzle_id(self):
-        if 'puzzle_id' in self._cache:
-            return self._cache['puzzle_id']
+        if self._puzzle_id is not None:
+            return self._puzzle_id
 
         pid_str = self._data.get('PID')
         if pid_str is None:
@@ -155,63 +231,75 @@ class IRData:
             msg = 'PID is not an int: PID="%s"'
             raise IRDataPropertyError(msg % pid_str)
 
-        return self._cache.setdefault('puzzle_id', puzzle_id)
+        self._puzzle_id = puzzle_id
+        return puzzle_id
 
     @property
     def history_string(self):
-        if 'history_string' in self._cache:
-            return self._cache['history_string']
-
         history_string = self._data.get('HISTORY')
         if history_string is None:
             msg = 'solution has no HISTORY: filename="%s"'
             raise IRDataPropertyError(msg % self.filename)
+        return history_string
 
-        return self._cache.setdefault('history_string', history_string)
+    @property
+    def history(self):
+        """The HISTORY string parsed into ids and moves."""
+        if self._history is not None:
+            return self._history
+
+        history_string = self.history_string
+        if not isinstance(history_string, str):
+            msg = 'unable to parse history: history_string="%s"'
+            raise IRDataPropertyError(msg % history_string)
+
+        self._history = ParsedHistory(history_string)
+        return self._history
 
     @property
-    def history_id(self):
-        if 'history_id' in self._cache:
-            return self._cache['history_id']
+    def history_ids(self):
+        return self.history.ids
 
-        # Does not fail if history_string is a string
-        last_move_in_history = self.history_string.split(',')[-1]
-        try:
-            history_id, _ = last_move_in_history.split(':')
-        except ValueError:
+    @property
+    def history_id(self):
+        if not self.history.last_pair_valid:
             msg = 'unable to parse history: history_string="%s"'
             raise IRDataPropertyError(msg % self.history_string)
-
-        return self._cache.setdefault('history_id', history_id)
+        return self.history.ids[-1]
 
     @property
     def history_hash(self):
-        if 'history_hash' in self._cache:
-            return self._cache['history_hash']
+        if self._history_hash is not None:
+            return self._history_hash
 
-        history_hash = hashlib.sha256(self.history_string.encode('utf-8')).hexdigest()
-        return self._cache.setdefault('history_hash', history_hash)
+        history_hash = hash_history(self.history_string)
+        self._history_hash = history_hash
+        return history_hash
 
     @property
-    def total_moves(self):
-        if 'total_moves' in self._cache:
-            return self._cache['total_moves']
+    def history_rebuildable(self):
+        """Whether the HISTORY string can be rebuilt from history rows.
 
-        try:
-            moves = [int(pair.split(':')[1])
-                     for pair in self.history_string.split(',')]
-        except (IndexError, ValueError, TypeError):
+        Strings with unparsed move counts, repeated ids or any other
+        formatting are stored in full in the history_string table.
+        """
+        history = self.history
+        if history.moves is None or len(set(history.ids)) != len(history.ids):
+            return False
+        return format_history(history.ids, history.moves) == self.history_string
+
+    @property
+    def total_moves(self):
+        moves = self.history.moves
+        if moves is None:
             msg = 'unable to parse moves from history: history_string="%s"'
             raise IRDataPropertyError(msg % self.history_string)
-        else:
-            total_moves = sum(moves)
-
-        return self._cache.setdefault('total_moves', total_moves)
+        return sum(moves)
 
     @property
     def score(self):
-        if 'score' in self._cache:
-            return self._cache['score']
+        if self._score is not None:
+            return self._score
 
         score_str = self._data.get('SCORE')
         if score_str is None:
@@ -224,12 +312,13 @@ class IRData:
             msg = 'SCORE is not a float: score_str="%s"'
             raise IRDataPropertyError(msg % score_str)
 
-        return self._cache.setdefault('score', score)
+        self._score = score
+        return score
 
     @property
     def timestamp(self):
-        if 'timestamp' in self._cache:
-            return self._cache['timestamp']
+        if self._timestamp is not None:
+            return self._timestamp
 
         timestamp_str = self._data.get('TIMESTAMP')
         if timestamp_str is None:
@@ -238,15 +327,16 @@ class IRData:
         try:
             timestamp_int = int(timestamp_str)
         except ValueError:
-            raise IRdataPropertyError('timestamp not an int: timestamp_str="%s"' % timestamp_str)
+            raise IRDataPropertyError('timestamp not an int: timestamp_str="%s"' % timestamp_str)
 
         timestamp = datetime.fromtimestamp(timestamp_int)
-        return self._cache.setdefault('timestamp', timestamp)
+        self._timestamp = timestamp
+        return timestamp
 
     @property
     def pdl_strings(self):
-        if 'pdl_strings' in self._cache:
-            return self._cache['pdl_strings']
+        if self._pdl_strings is not None:
+            return self._pdl_strings
 
         pdl_strings = self._data.get('PDL')
         if pdl_strings is None:
@@ -257,7 +347,101 @@ class IRData:
 
         pdl_strings = [str(pdl_str.encode('latin-1', 'ignore').decode('latin-1')) for pdl_str in pdl_strings]
 
-        return self._cache.setdefault('pdl_strings', pdl_strings)
+        self._pdl_strings = pdl_strings
+        return pdl_strings
+
+
+# PDL strings start with zero or more dots and a space. The characters
+# in PDL_STRIP_CHARS are also stripped from either end of the string.
+PDL_START = re.compile(r'\.* [\^\\.* ]*')
+PDL_STRIP_CHARS = '^\\.* '
+
+# Parsed action tokens, such as "ActionBandDelete=5", are remembered
+# because the same tokens recur across many action logs
+ACTION_TOKENS = {}
+MAX_ACTION_TOKENS = 100000
+
+
+def parse_pdl(pdl_str):
+    """Parse a PDL string in a single pass.
+
+    Returns a tuple of (player_name, team_name, player_id, team_id,
+    action_log_str). action_log_str is None if the PDL has no action log.
+    """
+    start = PDL_START.match(pdl_str)
+    if start is None:
+        msg = 'unable to parse PDL: pdl_str="%s"'
+        raise PDLCreationError(msg % pdl_str)
+    start = start.end()
+
+    fields = pdl_str[start:].split(',', 4)
+    if len(fields) < 5:
+        fields[-1] = fields[-1].rstrip(PDL_STRIP_CHARS)
+
+    if len(fields) < 2:
+        msg = 'unable to parse PDL: pdl_str="%s"'
+        raise PDLCreationError(msg % pdl_str)
+    player_name, team_name = fields[:2]
+
+    # Assign each soloist to their own team name
+    if team_name == '[no group]':
+        team_name = '%s-%s' % (team_name, player_name)
+
+    try:
+        player_id, team_id = map(int, fields[2:4])
+    except ValueError:
+        msg = 'unable to convert player_id and team_id to ints, pdl_str="%s"'
+        raise PDLCreationError(msg % pdl_str)
+
+    action_log_str = None
+    log_start = pdl_str.find('LOG:', start)
+    if log_start != -1:
+        log_start += 4
+        log_end = pdl_str.find('LOG:', log_start)
+        if log_end == -1:
+            action_log_str = pdl_str[log_start:].rstrip(PDL_STRIP_CHARS).strip()
+        else:
+            action_log_str = pdl_str[log_start:log_end].strip()
+
+    return player_name, team_name, player_id, team_id, action_log_str
+
+
+def parse_action_log(action_str):
+    """Parse an action log into columns of action names and counts.
+
+    > names, counts = parse_action_log('|ActionBandDelete=5 |=8')
+    > names == ['ActionBandDelete', 'UnknownAction']
+    > list(counts) == [5, 8]
+    """
+    names = []
+    counts = array('q')
+    for token in action_str.replace('|', '').split():
+        action = ACTION_TOKENS.get(token)
+        if action is None:
+            action = _parse_action_token(token)
+            if len(ACTION_TOKENS) < MAX_ACTION_TOKENS:
+                ACTION_TOKENS[token] = action
+        names.append(action[0])
+        counts.append(action[1])
+    return names, counts
+
+
+def _parse_action_token(token):
+    try:
+        action_name, action_n_str = token.split('=')
+    except ValueError:
+        action_name = token
+        action_n_str = '0'
+
+    if action_name == '':
+        action_name = 'UnknownAction'
+
+    try:
+        action_n = int(action_n_str)
+    except ValueError:
+        raise PDLPropertyError('action n is not an int: action_n_str="%s"' % action_n_str)
+
+    return sys.intern(action_name), action_n
 
 
 class PDL:
@@ -269,9 +453,17 @@ class PDL:
 
     PDL data is used to create model objects for players and teams, as well as
     for the action log of moves made by each player.
+
+    PDL strings are parsed by parse_pdl, and the action log by
+    parse_action_log. The action log is only parsed when it is needed.
     """
+    __slots__ = ('player_name', 'team_name', 'player_id', 'team_id',
+                 'action_log_str', 'pdl_str', '_irdata')
+
     def __init__(self, pdl_data, irdata):
-        self._pdl_data = pdl_data
+        (self.player_name, self.team_name, self.player_id, self.team_id,
+         self.action_log_str) = pdl_data[:5]
+        self.pdl_str = pdl_data[5] if len(pdl_data) > 5 else None
         self._irdata = irdata
 
     @classmethod
@@ -282,39 +474,11 @@ class PDL:
 
     @classmethod
     def from_pdl_string(cls, pdl_str, irdata):
-        data = {}
-
-        if re.match('^\.* ', pdl_str):
-            pdl_str = pdl_str.strip('^\.* ')
-        else:
-            msg = 'unable to parse PDL: pdl_str="%s"'
-            raise PDLCreationError(msg % pdl_str)
-
-        fields = pdl_str.split(',')
-        player_name, team_name = fields[:2]
-
-        # Assign each soloist to their own team name
-        if team_name == '[no group]':
-            team_name = '%s-%s' % (team_name, player_name)
-
-        try:
-            player_id, team_id = map(int, fields[2:4])
-        except ValueError:
-            msg = 'unable to convert player_id and team_id to ints, pdl_str="%s"'
-            raise PDLCreationError(msg % pdl_str)
-
-        pdl_data = dict(
-            player_name=player_name,
-            team_name=team_name,
-            player_id=player_id,
-            team_id=team_id,
-            pdl_str=pdl_str
-        )
-        return cls(pdl_data, irdata)
+        return cls(parse_pdl(pdl_str) + (pdl_str, ), irdata)
 
     @property
     def team_type(self):
-        if self._pdl_data['team_name'] == '[no group]':
+        if self.team_name == '[no group]':
             team_type = 'soloist'
         else:
             team_type = 'evolver'
@@ -322,20 +486,24 @@ class PDL:
 
     @property
     def action_log_string(self):
-        try:
-            action_log_str = self._pdl_data['pdl_str'].split('LOG:')[1].strip()
-        except IndexError:
-            raise PDLPropertyError('pdl string has no action log: pdl_str="%s"' % self._pdl_data['pdl_str'])
-        return action_log_str
+        if self.action_log_str is None:
+            raise PDLPropertyError('pdl string has no action log: pdl_str="%s"' % self.pdl_str)
+        return self.action_log_str
+
+    def actions(self):
+        """The action log as columns of action names and counts."""
+        return parse_action_log(self.action_log_string)
 
     def action_logs(self):
         return ActionLog.from_pdl(self)
 
-    def __getattr__(self, key):
-        return self._pdl_data[key]
-
 
 class ActionLog:
+    """A view of a single action in an action log.
+
+    Action logs are parsed into columns by parse_action_log. ActionLog
+    objects are kept for code that works with one action at a time.
+    """
     def __init__(self, **kwargs):
         self._data = kwargs
 
@@ -345,25 +513,9 @@ class ActionLog:
 
     @classmethod
     def from_action_string(cls, action_str):
-        actions = []
-        for x in action_str.replace('|', '').split():
-            try:
-                action_name, action_n_str = x.split('=')
-            except ValueError:
-                action_name = x
-                action_n_str = '0'
-
-            if action_name == '':
-                action_name = 'UnknownAction'
-
-            try:
-                action_n = int(action_n_str)
-            except ValueError:
-                raise PDLPropertyError('action n is not an int: action_n_str="%s"' % action_n_str)
-
-            actions.append(cls(action_name=action_name, action_n=action_n))
-
-        return actions
+        names, counts = parse_action_log(action_str)
+        return [cls(action_name=action_name, action_n=action_n)
+                for action_name, action_n in zip(names, counts)]
 
     def __getattr__(self, key):
         return self._data[key]
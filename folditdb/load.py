@@ -1,12 +1,22 @@
 import logging
+import threading
 
 from sqlalchemy import exists
 from sqlalchemy.exc import DBAPIError
 
+from folditdb import bulk, scrape
 from folditdb.irdata import IRData, PDL, ActionLog
 from folditdb.irdata import IRDataPropertyError, IRDataCreationError, PDLCreationError, PDLPropertyError
-from folditdb.db import Session
+from folditdb.db import new_session
 from folditdb.tables import Solution, Puzzle, Team, Player, History, HistoryString, Action
+from folditdb.tables import player_solutions
+from folditdb.stats import NULL_STATS
+from folditdb.cache import TransactionCache, action_type_ids
+from folditdb.checkpoint import load_checkpoint, save_checkpoint
+from folditdb.history import stored_histories, new_history_rows
+from folditdb.query import stage_invalidations, solution_tags
+from folditdb.summary import add_to_summaries
+from folditdb.pipeline import in_background
 
 logger = logging.getLogger(__name__)
 
@@ -15,72 +25,497 @@ class DuplicateIRDataException(Exception):
     pass
 
 
-def load_top_solutions_from_file(top_solutions_file, session=None):
+def load_top_solutions_from_file(top_solutions_file, session=None, bulk_size=None,
+                                 batch_size=1, cache=None, stats=None, checkpoint=False,
+                                 resume=False, claimed=None, queue_size=None):
+    """Load each solution in a scrape file.
+
+    Solutions are committed batch_size at a time. If a batch fails to
+    commit, its solutions are loaded again one at a time, each in its
+    own savepoint, so that only the bad solutions are lost.
+
+    If bulk_size is given, solutions are written bulk_size at a time
+    with set-based inserts instead of being merged one by one.
+    See folditdb.bulk.
+
+    If a folditdb.cache.KeyCache is given, rows it already knows about
+    are not checked or written again.
+
+    If a folditdb.stats.LoadStats is given, the load is counted and
+    timed by stage.
+
+    With checkpoint=True, the position reached in the file is saved with
+    each batch. With resume=True, loading starts from the last saved
+    position and checkpoints continue to be saved. See folditdb.checkpoint.
+
+    If a set of claimed solution ids is given, solutions already claimed
+    by another file in the same run are logged as duplicates without
+    checking the DB, and the rest are claimed once they are committed.
+    Pass the same set when loading each file in a run.
+
+    With a queue_size, bulk loads parse the next batches in a background
+    thread while the current one is written. See load_in_bulk.
+    """
+    if stats is None:
+        stats = NULL_STATS
+
     local_session = (session is None)
     if local_session:
-        session = Session()
+        session = new_session(writer=True)
+
+    offset, first_line = 0, 0
+    if resume:
+        offset, first_line = load_checkpoint(session, top_solutions_file)
+
+    reader = scrape.ScrapeReader(top_solutions_file, offset=offset, line=first_line)
+    stats.track_progress(top_solutions_file, reader.fraction_read)
+    stats.begin_file(top_solutions_file)
+    irdatas = (IRData.from_json(json_bytes) for json_bytes in reader)
+    checkpoint_reader = reader if checkpoint or resume else None
 
-    for i, irdata in enumerate(IRData.from_scrape_file(top_solutions_file)):
+    if bulk_size is not None:
+        load_in_bulk(irdatas, session, bulk_size, top_solutions_file, cache, stats,
+                     checkpoint_reader, claimed, queue_size)
+        session.close()
+        stats.end_file()
+        return
+
+    batch = []
+    for i, irdata in enumerate(irdatas, first_line):
+        stats.read()
         try:
-            load_from_irdata(irdata, session)
+            load_from_irdata(irdata, session, commit=False, cache=cache, stats=stats,
+                             claimed=claimed)
         except DBAPIError as err:
+            # Replay the batch, including this solution, with savepoints
             session.rollback()
-            logger.error('%s:%s %s(%s)', top_solutions_file, i+1, err.__class__.__name__, err)
+            batch.append((i+1, irdata))
+            _load_batch_with_savepoints(batch, session, top_solutions_file, cache, stats,
+                                        _position(checkpoint_reader), claimed)
+            batch = []
+            continue
         except Exception as err:
-            logger.error('%s:%s %s(%s)', top_solutions_file, i+1, err.__class__.__name__, err)
+            _log_error(top_solutions_file, i+1, err, stats)
+            continue
+
+        batch.append((i+1, irdata))
+        if len(batch) >= batch_size:
+            _commit_batch(batch, session, top_solutions_file, cache, stats,
+                          _position(checkpoint_reader), claimed)
+            batch = []
+
+    # A checkpoint is saved at the end even if the last lines all failed
+    if batch or checkpoint_reader is not None:
+        _commit_batch(batch, session, top_solutions_file, cache, stats,
+                      _position(checkpoint_reader), claimed)
 
     session.close()
+    stats.end_file()
+
+
+def _position(reader):
+    """The (offset, line) to checkpoint for a reader, if there is one."""
+    if reader is None:
+        return None
+    return reader.offset, reader.line
+
+
+def _check_claim(claimed, solution_id):
+    if solution_id in claimed:
+        raise DuplicateIRDataException()
+
+
+# Claimed ids are added by whichever writer thread commits them
+_claims_lock = threading.Lock()
+
+
+class Claims(TransactionCache):
+    """Solution ids written in a session, claimed when it commits."""
+    def __init__(self, claimed):
+        super().__init__()
+        self.claimed = claimed
+
+    def stage(self, solution_ids):
+        self._staged.extend(solution_ids)
+
+    def _commit_entry(self, solution_id):
+        # Claims are kept in a cache.IntSet, which only holds non-negative ids
+        if solution_id >= 0:
+            with _claims_lock:
+                self.claimed.add(solution_id)
+
+    def _discard_entry(self, solution_id):
+        pass
+
+
+def stage_claims(session, claimed, solution_ids):
+    """Claim solution ids when the session commits, and not if it rolls back."""
+    claims = session.info.get('claims')
+    if claims is None or claims.claimed is not claimed:
+        claims = session.info['claims'] = Claims(claimed)
+        claims.track(session)
+    claims.stage(solution_ids)
+
+
+def _log_error(source, line, err, stats=NULL_STATS):
+    logger.error('%s:%s %s(%s)', source, line, err.__class__.__name__, err)
+    if isinstance(err, DuplicateIRDataException):
+        stats.duplicate()
+    else:
+        stats.error(err.__class__.__name__)
+
+
+def _commit_batch(batch, session, source, cache=None, stats=NULL_STATS, checkpoint=None,
+                  claimed=None):
+    start = stats.clock()
+    try:
+        if checkpoint is not None:
+            save_checkpoint(session, source, *checkpoint)
+        session.commit()
+    except DBAPIError:
+        session.rollback()
+        _load_batch_with_savepoints(batch, session, source, cache, stats, checkpoint, claimed)
+    stats.add_time('commit', start)
+
+
+def _load_batch_with_savepoints(batch, session, source, cache=None, stats=NULL_STATS,
+                                checkpoint=None, claimed=None):
+    """Load each solution in a failed batch in its own savepoint."""
+    # Objects merged before the batch failed can outlive the rollback
+    session.expunge_all()
+
+    for line, irdata in batch:
+        session.begin_nested()
+        try:
+            load_from_irdata(irdata, session, commit=False, cache=cache, claimed=claimed)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            _log_error(source, line, err, stats)
+
+    try:
+        if checkpoint is not None:
+            save_checkpoint(session, source, *checkpoint)
+        session.commit()
+    except DBAPIError as err:
+        session.rollback()
+        lines = '%s-%s' % (batch[0][0], batch[-1][0])
+        _log_error(source, lines, err, stats)
+
+
+def load_in_bulk(irdatas, session, bulk_size=1000, source='irdata', cache=None,
+                 stats=None, reader=None, claimed=None, queue_size=None):
+    """Load IRData records in batches of set-based inserts.
+
+    Records that fail to parse or that duplicate a loaded solution are
+    logged as errors and skipped. Each batch is committed on its own.
+    If a batch fails, the rows for each record are written again in
+    their own savepoint.
+
+    If the records are read from a scrape.ScrapeReader for the source
+    file, pass the reader to save a checkpoint with each batch.
+
+    Solution ids are claimed as in load_top_solutions_from_file.
+
+    With a queue_size, records are parsed in a background thread while
+    earlier batches are written, with at most queue_size batches waiting
+    to be written. See folditdb.pipeline.
+    """
+    if stats is None:
+        stats = NULL_STATS
+
+    batches = _parse_batches(irdatas, bulk_size, stats, reader)
+    if queue_size:
+        batches = in_background(batches, queue_size)
+
+    for batch, errors, position in batches:
+        # Parse errors are logged here so that they stay in line order
+        for line, err in errors:
+            _log_error(source, line, err, stats)
+        write_bulk_batch(batch, session, source, cache, stats, position, claimed)
+
+
+def _parse_batches(irdatas, bulk_size, stats=NULL_STATS, reader=None):
+    """Yield (batch, errors, position) for each bulk_size records parsed.
 
+    Batches are lists of (line, rows), errors are (line, exception) for
+    records that failed to parse, and position is the checkpoint for
+    the end of the batch. A last batch is yielded for the checkpoint
+    even if it is empty.
+    """
+    first_line = 0 if reader is None else reader.line
+
+    batch, errors = [], []
+    for i, irdata in enumerate(irdatas, first_line):
+        stats.read()
+        try:
+            start = stats.clock()
+            irdata.decode()
+            start = stats.add_time('parse', start)
+            batch.append((i+1, bulk.rows_from_irdata(irdata)))
+            stats.add_time('build', start)
+        except Exception as err:
+            errors.append((i+1, err))
+            continue
+
+        if len(batch) == bulk_size:
+            yield batch, errors, _position(reader)
+            batch, errors = [], []
+
+    if batch or errors or reader is not None:
+        yield batch, errors, _position(reader)
+
+
+def write_bulk_batch(batch, session, source, cache=None, stats=None, checkpoint=None,
+                     claimed=None):
+    """Write and commit a batch of (line, rows) records from a source.
+
+    If an (offset, line) checkpoint is given, it is saved for the
+    source in the same transaction. If a set of claimed solution ids is
+    given, records for claimed solutions are dropped before the DB is
+    checked for duplicates, and the solutions written are claimed once
+    they are committed.
+    """
+    if stats is None:
+        stats = NULL_STATS
+
+    if claimed is not None:
+        unclaimed = []
+        for line, rows in batch:
+            try:
+                _check_claim(claimed, bulk.solution_id(rows))
+            except DuplicateIRDataException as err:
+                _log_error(source, line, err, stats)
+            else:
+                unclaimed.append((line, rows))
+        batch = unclaimed
+
+    start = stats.clock()
+    solution_ids = [bulk.solution_id(rows) for _, rows in batch]
+    loaded = bulk.loaded_solution_ids(session, solution_ids, cache)
+
+    records = []
+    for line, rows in batch:
+        solution_id = bulk.solution_id(rows)
+        if solution_id in loaded:
+            _log_error(source, line, DuplicateIRDataException(), stats)
+            continue
+        loaded.add(solution_id)
+        records.append((line, rows))
+
+    try:
+        written = bulk.write_rows(session, [rows for _, rows in records], cache)
+        if claimed is not None:
+            stage_claims(session, claimed, [bulk.solution_id(rows) for _, rows in records])
+        start = stats.add_time('flush', start)
+        if checkpoint is not None:
+            save_checkpoint(session, source, *checkpoint)
+        session.commit()
+    except DBAPIError:
+        session.rollback()
+        _write_bulk_batch_with_savepoints(records, session, source, cache, stats, checkpoint,
+                                          claimed)
+    else:
+        stats.add_rows(written)
+    stats.add_time('commit', start)
+
+
+def _write_bulk_batch_with_savepoints(records, session, source, cache=None, stats=NULL_STATS,
+                                      checkpoint=None, claimed=None):
+    """Write the rows for each record in a failed batch in its own savepoint."""
+    for line, rows in records:
+        session.begin_nested()
+        try:
+            written = bulk.write_rows(session, [rows], cache)
+            if claimed is not None:
+                stage_claims(session, claimed, [bulk.solution_id(rows)])
+            session.commit()
+        except DBAPIError as err:
+            session.rollback()
+            _log_error(source, line, err, stats)
+        else:
+            stats.add_rows(written)
+
+    if checkpoint is not None:
+        save_checkpoint(session, source, *checkpoint)
+    session.commit()
+
+
+def load_from_irdata(irdata, session=None, commit=True, cache=None, stats=None, claimed=None):
+    """Load a single IRData record.
+
+    All model objects are created before any are added to the session,
+    so a record that fails to parse leaves the session untouched.
+    Pass commit=False to leave the transaction open for batching.
+
+    Rows with keys in the cache are not merged. Players in the cache
+    are linked to the solution directly in the player_solutions table.
+
+    A solution in a set of claimed ids is a duplicate, and the solution
+    is claimed when the session commits.
+    """
+    if stats is None:
+        stats = NULL_STATS
 
-def load_from_irdata(irdata, session=None):
     local_session = (session is None)
     if local_session:
-        session = Session()
+        session = new_session(writer=True)
+
+    start = stats.clock()
+    irdata.decode()
+    start = stats.add_time('parse', start)
 
     # Create model objects from IRData
     solution = Solution.from_irdata(irdata)
     puzzle = Puzzle.from_irdata(irdata)
-    last_history = History.last_from_irdata(irdata)
-    history_string = HistoryString.from_irdata(irdata)
+    history_rows = History.rows_from_irdata(irdata)
+    history_string = None
+    if not irdata.history_rebuildable:
+        history_string = HistoryString.from_irdata(irdata)
+
+    pdls = PDL.from_irdata(irdata)
+    teams = [Team.from_pdl(pdl) for pdl in pdls]
+    players = [Player.from_pdl(pdl) for pdl in pdls]
+
+    actions = []
+    if irdata.solution_type == 'top':
+        # Final actions from these players
+        for pdl in pdls:
+            actions.extend(Action.from_pdl(pdl))
+
+    start = stats.add_time('build', start)
+
+    if cache is not None:
+        cache.track(session)
 
     # Check if this solution has already been loaded
-    solution_exists = session.query(exists().where(Solution.id == solution.id)).scalar()
-    if solution_exists:
+    if claimed is not None:
+        _check_claim(claimed, solution.id)
+    if _solution_loaded(session, solution.id, cache):
         raise DuplicateIRDataException()
 
     # Add model objects to the current session
     # Order matters!
-    puzzle = session.merge(puzzle)
-    last_history = session.merge(last_history)
-    history_string = session.merge(history_string)
+    _merge(session, puzzle, cache, 'puzzle', puzzle.id)
+    if _add_histories(session, history_rows, cache) and history_string is None:
+        # The stored rows give this lineage different parents or moves
+        history_string = HistoryString.from_irdata(irdata)
+    if history_string is not None:
+        _merge(session, history_string, cache, 'history_string', history_string.hash)
     session.add(solution)
+    if cache is not None:
+        cache.stage('solution', solution.id)
+    if claimed is not None:
+        stage_claims(session, claimed, [solution.id])
+    stage_invalidations(session, solution_tags(
+        solution.puzzle_id, [player.id for player in players], [team.name for team in teams]))
 
-    pdls = PDL.from_irdata(irdata)
-
-    for pdl in pdls:
-        team = Team.from_pdl(pdl)
-        player = Player.from_pdl(pdl)
+    known_player_ids = set()
+    if cache is not None:
+        known_player_ids = {player.id for player in players if cache.known('player', player.id)}
 
-        session.merge(team)
-        player = session.merge(player)
+    linked_player_ids = []
+    for team, player in zip(teams, players):
+        _merge(session, team, cache, 'team', team.name)
+        if player.id in known_player_ids:
+            if player.id not in linked_player_ids:
+                linked_player_ids.append(player.id)
+            continue
+        if cache is not None and cache.complete and not cache.known('player', player.id):
+            session.add(player)
+        else:
+            player = session.merge(player)
         player.solutions.append(solution)
+        if cache is not None:
+            cache.stage('player', player.id)
 
-    if irdata.solution_type == 'top':
-        # Load all histories but the last one (which has already been added)
-        for history in History.from_irdata(irdata)[:-1]:
-            session.merge(history)
+    if actions:
+        type_ids = action_type_ids(session, [action.action_name for action in actions])
+        for action in actions:
+            action.action_type_id = type_ids[action.action_name]
+            session.merge(action)
 
-        # Load final actions from these players
-        for pdl in pdls:
-            actions = Action.from_pdl(pdl)
-            for action in actions:
-                session.merge(action)
+    if linked_player_ids:
+        # The solution must be written before it can be linked
+        session.flush()
+        links = [dict(player_id=player_id, solution_id=solution.id)
+                 for player_id in linked_player_ids]
+        session.execute(player_solutions.insert(), links)
 
-    session.commit()
+    # Summary rows refer to the puzzle, players and action types
+    session.flush()
+    add_to_summaries(
+        session,
+        [dict(puzzle_id=solution.puzzle_id, score=solution.score,
+              total_moves=solution.total_moves)],
+        [dict(player_id=action.player_id, puzzle_id=action.puzzle_id,
+              action_type_id=action.action_type_id, action_n=action.action_n)
+         for action in actions])
+
+    if stats.enabled:
+        stats.add_rows({'solution': 1, 'puzzle': 1, 'history': len(history_rows),
+                        'history_string': int(history_string is not None),
+                        'team': len(teams), 'player': len(players),
+                        'player_solutions': len(set(player.id for player in players)),
+                        'action': len(actions)})
+        start = stats.add_time('flush', start)
+
+    if commit:
+        session.commit()
+        stats.add_time('commit', start)
 
     if local_session:
         session.close()
 
+def _solution_loaded(session, solution_id, cache=None):
+    if cache is not None:
+        if cache.known('solution', solution_id):
+            return True
+        elif cache.complete:
+            return False
+
+    loaded = session.query(exists().where(Solution.id == solution_id)).scalar()
+    if loaded and cache is not None:
+        cache.add('solution', solution_id)
+    return loaded
+
+
+def _add_histories(session, history_rows, cache=None):
+    """Add the history rows whose ids are not stored yet.
+
+    Stored rows are kept, as they are by the bulk loader. Returns True
+    if any stored row differs from the row for its id.
+    """
+    history_ids = [row['id'] for row in history_rows]
+    if cache is not None and cache.complete:
+        # Ids a complete cache does not know are not stored
+        history_ids = [history_id for history_id in history_ids
+                       if cache.known('history', history_id)]
+    new_rows, conflict = new_history_rows(history_rows, stored_histories(session, history_ids))
+    for row in new_rows:
+        session.add(History(**row))
+        if cache is not None:
+            cache.stage('history', row['id'])
+    return conflict
+
+
+def _merge(session, instance, cache, kind, key):
+    """Merge an instance into the session unless its key is in the cache.
+
+    A complete cache knows every key in the DB, so new instances are
+    added without the SELECT that merge would issue.
+    """
+    if cache is None:
+        return session.merge(instance)
+    if cache.known(kind, key):
+        return None
+    cache.stage(kind, key)
+    if cache.complete:
+        session.add(instance)
+        return instance
+    return session.merge(instance)
+
+
 def load_single_irdata_file(solution_file, session=None):
     irdata = IRData.from_file(solution_file)
     load_from_irdata(irdata, session)
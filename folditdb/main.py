@@ -1,18 +1,397 @@
+"""The folditdb command line.
+
+    folditdb SCRAPES...                  load scrape files
+    folditdb init-db                     create the tables in a new DB
+    folditdb follow SCRAPES...           load lines as they are appended to scrape files
+    folditdb watch WATCH_DIR             load solution files as they arrive in a directory
+    folditdb dump-tsv TSV_DIR SCRAPES... write deduplicated rows to TSV files
+    folditdb load-tsv TSV_DIR            load TSV files into an empty DB
+    folditdb migrate                     upgrade a DB made by an earlier version
+    folditdb rebuild-summaries           recompute the summary tables
+    folditdb export EXPORT_DIR           export tables to Parquet for analytics
+    folditdb convert OUT_DIR SCRAPES...  write scrape files to Parquet without a DB
+
+Commands that use the DB take --db-url, which defaults to the
+MYSQL_FOLDIT_DB environment variable. Each command imports only the
+modules it needs, and nothing connects to the DB until a command does,
+so short jobs start quickly.
+"""
 import argparse
-from pathlib import Path
+import sys
+from collections import OrderedDict
 
 from folditdb import log
-from folditdb.db import DB, Session
-from folditdb.tables import Base
-from folditdb.load import load_top_solutions_from_file
 
 
-def main():
-    parser = argparse.ArgumentParser('folditdb')
-    parser.add_argument('solutions', help='file containing solution data in json')
+def main(argv=None):
+    """Run a command. Scrape files are loaded if no command is given."""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    return load_main(argv)
+
+
+def add_db_url_argument(parser):
+    parser.add_argument('--db-url',
+                        help='SQLAlchemy URL of the DB, instead of $MYSQL_FOLDIT_DB')
+
+
+def load_main(argv):
+    from folditdb.scrape import find_scrape_files
+    from folditdb.db import get_engine, new_session
+    from folditdb.cache import KeyCache, IntSet
+    from folditdb.load import load_top_solutions_from_file
+    from folditdb.stats import LoadStats
+    from folditdb.migrations import drop_indexes, create_indexes
+
+    parser = argparse.ArgumentParser('folditdb', epilog='other commands: %s' % ', '.join(COMMANDS))
+    parser.add_argument('solutions', nargs='+',
+                        help='scrape files, directories of them, or glob patterns')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='number of solutions to load per commit')
+    parser.add_argument('--bulk-size', type=int,
+                        help='write solutions in batches of set-based inserts')
+    parser.add_argument('--workers', type=int,
+                        help='parse solutions in this many processes')
+    parser.add_argument('--pipeline', type=int, metavar='QUEUE_SIZE',
+                        help='parse up to this many bulk batches in a thread while writing')
+    parser.add_argument('--shards', type=int,
+                        help='write with this many sessions in parallel, split by puzzle')
+    parser.add_argument('--shard-url', action='append', metavar='URL',
+                        help='write the puzzles of one shard to this DB; repeat for each shard')
+    parser.add_argument('--key-cache', action='store_true',
+                        help='remember loaded keys, seeded from the DB at startup')
+    parser.add_argument('--key-cache-size', type=int,
+                        help='remember only this many recently used keys of each kind')
+    parser.add_argument('--resume', action='store_true',
+                        help='start each file from the last committed checkpoint')
+    parser.add_argument('--stats',
+                        help='write counters and stage timings as json to this file, or - for stdout')
+    parser.add_argument('--progress', type=float,
+                        help='report progress to stderr every this many seconds')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='drop secondary indexes while loading and build them at the end; '
+                             'on MySQL, indexes that back a foreign key are kept')
+    parser.add_argument('--fast-load', action='store_true',
+                        help='on SQLite, skip fsync and use a large cache; implies --defer-indexes')
+    add_db_url_argument(parser)
+    parser.add_argument('--pool-size', type=int,
+                        help='connections kept open in the pool')
+    parser.add_argument('--pool-recycle', type=int,
+                        help='reconnect connections older than this many seconds')
+    parser.add_argument('--no-pre-ping', action='store_false', dest='pre_ping',
+                        help='do not test connections with a ping when they are checked out')
+
+    args = parser.parse_args(argv)
+    try:
+        scrape_filepaths = find_scrape_files(args.solutions)
+    except FileNotFoundError as err:
+        parser.error(str(err))
+
+    log.use_logging()
+
+    engine_options = dict(fast_load=args.fast_load, writer=True, pool_size=args.pool_size,
+                          pool_recycle=args.pool_recycle, pool_pre_ping=args.pre_ping)
+    db_urls = args.shard_url or [args.db_url]
+
+    defer_indexes = args.defer_indexes or args.fast_load
+    if defer_indexes:
+        for db_url in db_urls:
+            with get_engine(db_url, **engine_options).begin() as connection:
+                drop_indexes(connection)
+
+    sessions = [new_session(db_url, **engine_options) for db_url in db_urls]
+    if args.shards and not args.shard_url:
+        sessions += [new_session(args.db_url, **engine_options)
+                     for _ in range(args.shards - 1)]
+    session = sessions[0]
+
+    def new_cache(session):
+        if args.key_cache_size:
+            return KeyCache(max_size=args.key_cache_size)
+        elif args.key_cache:
+            cache = KeyCache()
+            cache.seed(session)
+            # Release the write lock the seeding queries took on SQLite
+            session.rollback()
+            return cache
+        return None
+
+    # Caches stage keys for whichever session commits next, so each
+    # session needs its own
+    caches = [new_cache(session) for session in sessions]
+    cache = caches[0]
+
+    stats = None
+    if args.stats or args.progress is not None:
+        stats = LoadStats(progress_interval=args.progress)
+
+    # Solution ids seen in earlier files are skipped without a query
+    claimed = IntSet()
+
+    if len(sessions) > 1:
+        from folditdb.shard import load_sharded
+        load_sharded(scrape_filepaths, sessions, bulk_size=args.bulk_size or 1000,
+                     caches=caches, stats=stats, checkpoint=True, resume=args.resume,
+                     claimed=claimed)
+    elif args.workers:
+        from folditdb.parallel import load_in_parallel
+        load_in_parallel(scrape_filepaths, session, workers=args.workers,
+                         bulk_size=args.bulk_size or 1000, cache=cache, stats=stats,
+                         checkpoint=True, resume=args.resume, claimed=claimed)
+    else:
+        # Only bulk loads are pipelined
+        bulk_size = args.bulk_size
+        if args.pipeline and bulk_size is None:
+            bulk_size = 1000
+        for scrape_filepath in scrape_filepaths:
+            load_top_solutions_from_file(scrape_filepath, session, bulk_size=bulk_size,
+                                         batch_size=args.batch_size, cache=cache,
+                                         stats=stats, checkpoint=True, resume=args.resume,
+                                         claimed=claimed, queue_size=args.pipeline)
+
+    for session in sessions:
+        session.close()
+
+    if defer_indexes:
+        for db_url in db_urls:
+            with get_engine(db_url, **engine_options).begin() as connection:
+                create_indexes(connection)
+
+    if args.stats:
+        stats.write_summary(args.stats)
+
+
+def init_db_main(argv):
+    from folditdb.db import init_db
+
+    parser = argparse.ArgumentParser('folditdb init-db',
+                                     description='create the tables that do not exist yet')
+    add_db_url_argument(parser)
+    args = parser.parse_args(argv)
+    init_db(args.db_url)
+
+
+def follow_main(argv):
+    import signal
+    import threading
+    from folditdb.db import new_session
+    from folditdb.cache import IntSet
+    from folditdb.follow import follow, BULK_SIZE, MAX_DELAY
+    from folditdb.stats import LoadStats
+
+    parser = argparse.ArgumentParser('folditdb follow',
+                                     description='load lines as they are appended to scrape files')
+    parser.add_argument('solutions', nargs='+',
+                        help='scrape files to follow, which need not exist yet')
+    parser.add_argument('--bulk-size', type=int, default=BULK_SIZE,
+                        help='commit once this many solutions are waiting')
+    parser.add_argument('--max-delay-ms', type=int, default=int(MAX_DELAY * 1000),
+                        help='commit solutions once they have waited this many milliseconds')
+    parser.add_argument('--stats',
+                        help='write counts and timings as json to this file on exit')
+    add_db_url_argument(parser)
+
+    args = parser.parse_args(argv)
+
+    log.use_logging()
+
+    # Stop on SIGTERM as on Ctrl-C, after committing what was read
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    session = new_session(args.db_url, writer=True)
+    stats = LoadStats() if args.stats else None
+    try:
+        follow(args.solutions, session, bulk_size=args.bulk_size,
+               max_delay=args.max_delay_ms / 1000, stats=stats, claimed=IntSet(), stop=stop)
+    except KeyboardInterrupt:
+        pass
+    session.close()
+
+    if args.stats:
+        stats.write_summary(args.stats)
+
+
+def watch_main(argv):
+    import signal
+    import threading
+    from folditdb.db import new_session
+    from folditdb.watch import watch, BATCH_SIZE, PATTERN
 
-    args = parser.parse_args()
-    assert Path(args.solutions).exists(), 'solutions file does not exist'
+    parser = argparse.ArgumentParser('folditdb watch',
+                                     description='load solution files as they arrive in a directory')
+    parser.add_argument('watch_dir', help='directory that solution json files are written to')
+    parser.add_argument('--processed-dir',
+                        help='directory to move loaded files to, defaults to WATCH_DIR/processed')
+    parser.add_argument('--failed-dir',
+                        help='directory to move files that fail to load to, '
+                             'defaults to WATCH_DIR/failed')
+    parser.add_argument('--queue',
+                        help='SQLite file to queue files in, defaults to WATCH_DIR.queue.db')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='load files with this many sessions in parallel')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='number of files to load per commit')
+    parser.add_argument('--pattern', default=PATTERN,
+                        help='glob pattern of the names of solution files')
+    parser.add_argument('--polling', action='store_true',
+                        help='scan the directory instead of using inotify')
+    add_db_url_argument(parser)
+
+    args = parser.parse_args(argv)
+
+    log.use_logging()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    sessions = [new_session(args.db_url, writer=True) for _ in range(args.workers)]
+    try:
+        watch(args.watch_dir, sessions, args.processed_dir, args.failed_dir, args.queue,
+              batch_size=args.batch_size, pattern=args.pattern, polling=args.polling, stop=stop)
+    except KeyboardInterrupt:
+        pass
+    for session in sessions:
+        session.close()
+
+
+def dump_tsv_main(argv):
+    from folditdb.scrape import find_scrape_files
+    from folditdb.stats import LoadStats
+    from folditdb.tsv import dump_tsv_files
+
+    parser = argparse.ArgumentParser('folditdb dump-tsv',
+                                     description='first pass of a backfill into an empty DB')
+    parser.add_argument('tsv_dir', help='directory to write a TSV file per table to')
+    parser.add_argument('solutions', nargs='+',
+                        help='scrape files, directories of them, or glob patterns')
+    parser.add_argument('--progress', type=float,
+                        help='report progress to stderr every this many seconds')
+
+    args = parser.parse_args(argv)
+    try:
+        scrape_filepaths = find_scrape_files(args.solutions)
+    except FileNotFoundError as err:
+        parser.error(str(err))
 
     log.use_logging()
-    load_top_solutions_from_file(args.solutions)
+
+    stats = None
+    if args.progress is not None:
+        stats = LoadStats(progress_interval=args.progress)
+    dump_tsv_files(scrape_filepaths, args.tsv_dir, stats)
+
+
+def load_tsv_main(argv):
+    from folditdb.db import new_session
+    from folditdb.tsv import load_tsv_files
+
+    parser = argparse.ArgumentParser('folditdb load-tsv',
+                                     description='second pass of a backfill into an empty DB')
+    parser.add_argument('tsv_dir', help='directory of TSV files written by dump-tsv')
+    add_db_url_argument(parser)
+
+    args = parser.parse_args(argv)
+
+    # LOAD DATA LOCAL INFILE has to be allowed by the client
+    session = new_session(args.db_url, local_infile=True, writer=True)
+    for name, n_rows in load_tsv_files(args.tsv_dir, session).items():
+        print('%s: %d rows' % (name, n_rows))
+    session.close()
+
+
+def migrate_main(argv):
+    from folditdb.db import get_engine
+    from folditdb.migrations import migrate
+
+    parser = argparse.ArgumentParser('folditdb migrate',
+                                     description='upgrade a DB made by an earlier version')
+    add_db_url_argument(parser)
+    args = parser.parse_args(argv)
+    for name in migrate(get_engine(args.db_url)):
+        print('migrated %s' % name)
+
+
+def rebuild_summaries_main(argv):
+    from folditdb.db import new_session
+    from folditdb.query import RESULTS
+    from folditdb.summary import rebuild_summaries
+
+    parser = argparse.ArgumentParser('folditdb rebuild-summaries',
+                                     description='recompute the summary tables from scratch')
+    add_db_url_argument(parser)
+    args = parser.parse_args(argv)
+    session = new_session(args.db_url, writer=True)
+    rebuild_summaries(session)
+    session.commit()
+    RESULTS.clear()
+    session.close()
+
+
+def export_main(argv):
+    from folditdb.db import new_session
+    from folditdb.parquet import export_tables, BATCH_SIZE
+
+    parser = argparse.ArgumentParser('folditdb export',
+                                     description='export tables to Parquet, partitioned by puzzle')
+    parser.add_argument('export_dir', help='directory to write Parquet files to')
+    parser.add_argument('--full', action='store_true',
+                        help='replace the last export instead of adding newer rows to it')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='number of rows to fetch and write at a time')
+    add_db_url_argument(parser)
+
+    args = parser.parse_args(argv)
+
+    session = new_session(args.db_url)
+    exported = export_tables(session, args.export_dir, full=args.full,
+                             batch_size=args.batch_size)
+    for name, n_rows in exported.items():
+        print('%s: %d rows' % (name, n_rows))
+    session.close()
+
+
+def convert_main(argv):
+    from folditdb.scrape import find_scrape_files
+    from folditdb.stats import LoadStats
+    from folditdb.parquet import convert_scrape_files, CONVERT_BATCH_SIZE
+
+    parser = argparse.ArgumentParser('folditdb convert',
+                                     description='write scrape files to Parquet without a DB')
+    parser.add_argument('out_dir', help='directory to write Parquet files to')
+    parser.add_argument('solutions', nargs='+',
+                        help='scrape files, directories of them, or glob patterns')
+    parser.add_argument('--batch-size', type=int, default=CONVERT_BATCH_SIZE,
+                        help='number of solutions to convert and write at a time')
+    parser.add_argument('--progress', type=float,
+                        help='report progress to stderr every this many seconds')
+
+    args = parser.parse_args(argv)
+    try:
+        scrape_filepaths = find_scrape_files(args.solutions)
+    except FileNotFoundError as err:
+        parser.error(str(err))
+
+    log.use_logging()
+
+    stats = None
+    if args.progress is not None:
+        stats = LoadStats(progress_interval=args.progress)
+    written = convert_scrape_files(scrape_filepaths, args.out_dir, stats,
+                                   batch_size=args.batch_size)
+    for name, n_rows in written.items():
+        print('%s: %d rows' % (name, n_rows))
+
+
+COMMANDS = OrderedDict([
+    ('init-db', init_db_main),
+    ('follow', follow_main),
+    ('watch', watch_main),
+    ('dump-tsv', dump_tsv_main),
+    ('load-tsv', load_tsv_main),
+    ('migrate', migrate_main),
+    ('rebuild-summaries', rebuild_summaries_main),
+    ('export', export_main),
+    ('convert', convert_main),
+])
@@ -0,0 +1,225 @@
+"""Upgrades for DBs created by earlier versions of folditdb.
+
+create_all() only creates the tables that are missing, so changes to
+existing tables are made by the migrations here. Each migration checks
+whether it is needed, so migrate() can be run against any DB.
+
+> migrate(engine)
+
+Secondary indexes slow down every insert, so a big load into an
+existing DB can drop them first and build them once at the end, which
+is also how the indexes migration adds them to an older DB:
+
+> with engine.begin() as connection:
+>     drop_indexes(connection)
+> ... load scrape files ...
+> with engine.begin() as connection:
+>     create_indexes(connection)
+"""
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import inspect, text
+
+from folditdb import bulk
+from folditdb.history import new_history_rows
+from folditdb.irdata import IRData
+from folditdb.summary import rebuild_summaries
+from folditdb.tables import (Base, Solution, ActionType, History, HistoryString,
+    PuzzleSummary, PlayerActionSummary, player_solutions)
+
+logger = logging.getLogger(__name__)
+
+
+def action_types(connection):
+    """Move action names from the action table to the action_type table."""
+    columns = {column['name'] for column in inspect(connection).get_columns('action')}
+    if 'action_name' not in columns:
+        return False
+
+    ActionType.__table__.create(connection, checkfirst=True)
+    connection.execute(text(
+        'INSERT INTO action_type (name) '
+        'SELECT DISTINCT action_name FROM action '
+        'WHERE action_name IS NOT NULL ORDER BY action_name'
+    ))
+    connection.execute(text('ALTER TABLE action ADD COLUMN action_type_id INTEGER'))
+
+    if connection.dialect.name == 'mysql':
+        connection.execute(text(
+            'UPDATE action JOIN action_type ON action_type.name = action.action_name '
+            'SET action.action_type_id = action_type.id'
+        ))
+        connection.execute(text(
+            'ALTER TABLE action ADD FOREIGN KEY (action_type_id) REFERENCES action_type (id)'
+        ))
+    else:
+        connection.execute(text(
+            'UPDATE action SET action_type_id = '
+            '(SELECT id FROM action_type WHERE action_type.name = action.action_name)'
+        ))
+
+    connection.execute(text('ALTER TABLE action DROP COLUMN action_name'))
+    return True
+
+
+def player_solutions_key(connection):
+    """Give player_solutions a primary key, dropping duplicate links."""
+    key = inspect(connection).get_pk_constraint('player_solutions')
+    if key.get('constrained_columns'):
+        return False
+
+    # Neither DB can add a primary key to SQLite tables, so the table is rebuilt
+    ignore = 'IGNORE' if connection.dialect.name == 'mysql' else 'OR IGNORE'
+    connection.execute(text('ALTER TABLE player_solutions RENAME TO player_solutions_old'))
+    player_solutions.create(connection)
+    connection.execute(text(
+        'INSERT %s INTO player_solutions (player_id, solution_id) '
+        'SELECT player_id, solution_id FROM player_solutions_old' % ignore
+    ))
+    connection.execute(text('DROP TABLE player_solutions_old'))
+    return True
+
+
+# History strings converted to history rows at a time
+HISTORY_BATCH_SIZE = 1000
+
+
+def history_chains(connection):
+    """Store history lineages as parent pointers instead of whole strings."""
+    inspector = inspect(connection)
+    columns = {column['name'] for column in inspector.get_columns('history')}
+    if 'parent_id' in columns:
+        return False
+
+    connection.execute(text('ALTER TABLE history ADD COLUMN parent_id VARCHAR(40)'))
+    connection.execute(text('ALTER TABLE history ADD COLUMN moves INTEGER'))
+
+    # Strings are no longer always stored, so solutions cannot refer to them
+    if connection.dialect.name == 'mysql':
+        for foreign_key in inspector.get_foreign_keys('solution'):
+            if foreign_key['referred_table'] == 'history_string':
+                connection.execute(text(
+                    'ALTER TABLE solution DROP FOREIGN KEY `%s`' % foreign_key['name']))
+
+    upsert = bulk.upsert(History.__table__, connection.dialect.name)
+    table = HistoryString.__table__
+    last_hash = ''
+    # (parent_id, moves) of the history rows written, where the first wins
+    known = {}
+    while True:
+        batch = connection.execute(
+            table.select().where(table.c.hash > last_hash)
+            .order_by(table.c.hash).limit(HISTORY_BATCH_SIZE)
+        ).fetchall()
+        if not batch:
+            break
+        last_hash = batch[-1].hash
+
+        rows, hashes, rebuildable = [], [], []
+        for history_hash, string in batch:
+            irdata = IRData(dict(HISTORY=string))
+            try:
+                new_rows, conflict = new_history_rows(History.rows_from_irdata(irdata), known)
+            except Exception:
+                continue
+            rows.extend(new_rows)
+            hashes.append(dict(history_id=irdata.history_ids[-1], history_hash=history_hash))
+            if irdata.history_rebuildable and not conflict:
+                rebuildable.append(history_hash)
+
+        if rows:
+            connection.execute(upsert, rows)
+        if hashes:
+            # Earlier versions did not record the hash of each solution's history
+            connection.execute(text(
+                'UPDATE solution SET history_hash = :history_hash '
+                'WHERE history_id = :history_id AND history_hash IS NULL'
+            ), hashes)
+        if rebuildable:
+            connection.execute(table.delete().where(table.c.hash.in_(rebuildable)))
+    return True
+
+
+def summaries(connection):
+    """Fill the summary tables for solutions loaded before they existed."""
+    for table in [PuzzleSummary.__table__, PlayerActionSummary.__table__]:
+        table.create(connection, checkfirst=True)
+    if connection.execute(PuzzleSummary.__table__.select().limit(1)).first() is not None:
+        return False
+    if connection.execute(Solution.__table__.select().limit(1)).first() is None:
+        return False
+    rebuild_summaries(connection)
+    return True
+
+
+def secondary_indexes():
+    """The indexes declared in folditdb.tables, other than primary keys."""
+    return [index for table in Base.metadata.sorted_tables for index in table.indexes]
+
+
+def backs_foreign_key(index):
+    """True if the leftmost column of an index has a foreign key."""
+    return bool(index.columns.values()[0].foreign_keys)
+
+
+def deferrable_indexes(dialect_name):
+    """The secondary indexes that can be dropped during a load.
+
+    InnoDB uses an index whose leftmost column has a foreign key for
+    that key, in place of the index it made for the key itself, and
+    then refuses to drop it. So on MySQL those indexes are kept.
+    """
+    if dialect_name == 'mysql':
+        return [index for index in secondary_indexes() if not backs_foreign_key(index)]
+    return secondary_indexes()
+
+
+def drop_indexes(connection):
+    """Drop the deferrable indexes that exist. Returns the names of those dropped."""
+    dropped = []
+    for index in deferrable_indexes(connection.dialect.name):
+        if index.name in _index_names(connection, index.table.name):
+            index.drop(connection)
+            dropped.append(index.name)
+    return dropped
+
+
+def create_indexes(connection):
+    """Build the secondary indexes that are missing. Returns the names of those built."""
+    created = []
+    for index in secondary_indexes():
+        if index.name not in _index_names(connection, index.table.name):
+            index.create(connection)
+            created.append(index.name)
+    return created
+
+
+def _index_names(connection, table_name):
+    return {index['name'] for index in inspect(connection).get_indexes(table_name)}
+
+
+def indexes(connection):
+    """Build the secondary indexes, after any bulk loads."""
+    return bool(create_indexes(connection))
+
+
+# Migrations in the order they must be run
+MIGRATIONS = OrderedDict([
+    ('action_types', action_types),
+    ('player_solutions_key', player_solutions_key),
+    ('history_chains', history_chains),
+    ('summaries', summaries),
+    ('indexes', indexes),
+])
+
+
+def migrate(engine):
+    """Run each migration the DB needs. Returns the names of those that ran."""
+    migrated = []
+    for name, migration in MIGRATIONS.items():
+        with engine.begin() as connection:
+            if migration(connection):
+                logger.info('migrated %s', name)
+                migrated.append(name)
+    return migrated
@@ -0,0 +1,225 @@
+"""Parallel parsing of scrape files.
+
+JSON decoding, PDL parsing and row construction all hold the GIL, so a
+single process is bound by parsing well before it is bound by the DB.
+load_in_parallel splits scrape files into chunks at line boundaries,
+parses the chunks into rows in a pool of worker processes, and writes
+the rows from the parent process with the bulk loader.
+
+Chunks are written in file order, so the DB ends up the same as it
+would after loading each file serially with folditdb.load.load_in_bulk,
+and checkpoints are saved the same way. See folditdb.checkpoint.
+
+Only CHUNKS_PER_WORKER chunks per worker are handed to the pool ahead
+of the writer, so when the DB is slower than parsing, the workers wait
+instead of parsed rows piling up in the parent.
+
+> load_in_parallel(['scrape1.json', 'scrape2.json'], session, workers=8)
+"""
+import logging
+import os
+import time
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from folditdb import bulk, scrape
+from folditdb.irdata import IRData
+from folditdb.load import write_bulk_batch
+from folditdb.checkpoint import load_checkpoint
+from folditdb.stats import NULL_STATS
+
+logger = logging.getLogger(__name__)
+
+# Bytes of scrape file to parse per task
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Chunks parsing or parsed but not yet written, per worker
+CHUNKS_PER_WORKER = 2
+
+
+def split_scrape_file(scrape_filepath, chunk_size=CHUNK_SIZE, start=0):
+    """Split a scrape file into (start, end) byte ranges at line boundaries.
+
+    Compressed scrape files cannot be split, and are returned as a
+    single chunk with an end of None. Chunks begin at the start offset,
+    which must be at a line boundary.
+    """
+    if scrape.is_compressed(scrape_filepath):
+        return [(start, None)]
+
+    size = os.path.getsize(scrape_filepath)
+    chunks = []
+    with open(scrape_filepath, 'rb') as scrape_file:
+        while start < size:
+            scrape_file.seek(min(start + chunk_size, size))
+            scrape_file.readline()
+            end = scrape_file.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_chunk(chunk):
+    """Parse the lines in a byte range of a scrape file into packed rows.
+
+    Returns the number of lines in the chunk, the offset of its end, a
+    list of (line, offset, rows) for each record that parsed, a list of
+    (line, error name, error message) for each record that did not,
+    and the seconds spent decoding json and building rows. Line numbers
+    are relative to the start of the chunk, and offsets are those of
+    the end of each line.
+    """
+    scrape_filepath, start, end = chunk
+    records, errors = [], []
+    parse_seconds = build_seconds = 0.0
+    clock = time.perf_counter
+
+    line, offset = 0, start
+    for offset, json_bytes in _iter_chunk_lines(scrape_filepath, start, end):
+        line += 1
+        try:
+            t0 = clock()
+            irdata = IRData.from_json(json_bytes)
+            irdata.decode()
+            t1 = clock()
+            rows = bulk.rows_from_irdata(irdata)
+            t2 = clock()
+        except Exception as err:
+            errors.append((line, err.__class__.__name__, str(err)))
+        else:
+            records.append((line, offset, bulk.pack_rows(rows)))
+            parse_seconds += t1 - t0
+            build_seconds += t2 - t1
+
+    return line, offset, records, errors, (parse_seconds, build_seconds)
+
+
+def _iter_chunk_lines(scrape_filepath, start, end):
+    """Yield the offset of the end of each line in a chunk, and the line."""
+    if end is None:
+        reader = scrape.ScrapeReader(scrape_filepath, offset=start)
+        for json_bytes in reader:
+            yield reader.offset, json_bytes
+        return
+
+    with open(scrape_filepath, 'rb') as scrape_file:
+        scrape_file.seek(start)
+        offset = start
+        while offset < end:
+            json_bytes = scrape_file.readline()
+            if not json_bytes:
+                # The file was truncated after it was split
+                break
+            offset += len(json_bytes)
+            yield offset, json_bytes
+
+
+def parse_in_order(pool, chunks, window):
+    """Parse chunks in a pool and yield the results in order.
+
+    At most window chunks are handed to the pool ahead of the result
+    being used, and the next one is handed over as each result is taken.
+    """
+    chunks = iter(chunks)
+    pending = deque(pool.apply_async(parse_chunk, (chunk, ))
+                    for chunk in islice(chunks, window))
+    while pending:
+        result = pending.popleft().get()
+        for chunk in islice(chunks, 1):
+            pending.append(pool.apply_async(parse_chunk, (chunk, )))
+        yield result
+
+
+def load_in_parallel(scrape_filepaths, session, workers=None, bulk_size=1000,
+                     chunk_size=CHUNK_SIZE, cache=None, stats=None, checkpoint=False,
+                     resume=False, claimed=None):
+    """Load scrape files by parsing chunks of them in worker processes.
+
+    Rows are written bulk_size records at a time by a single writer
+    using the session. If workers is None, one worker per CPU is used.
+
+    Files are scheduled largest first, with compressed files ahead of
+    the rest because each one is parsed whole by a single worker.
+
+    Parse and build times in the stats are summed over the workers.
+    Checkpoints and claimed solution ids work as in
+    folditdb.load.load_top_solutions_from_file.
+    """
+    if stats is None:
+        stats = NULL_STATS
+
+    scrape_filepaths = sorted(scrape_filepaths, reverse=True, key=lambda scrape_filepath: (
+        scrape.is_compressed(scrape_filepath), os.path.getsize(scrape_filepath)))
+
+    # The (offset, line) reached in each file
+    positions = {scrape_filepath: (0, 0) for scrape_filepath in scrape_filepaths}
+    if resume:
+        positions = {scrape_filepath: load_checkpoint(session, scrape_filepath)
+                     for scrape_filepath in scrape_filepaths}
+    checkpointing = checkpoint or resume
+
+    chunks = [(scrape_filepath, start, end)
+              for scrape_filepath in scrape_filepaths
+              for start, end in split_scrape_file(scrape_filepath, chunk_size,
+                                                  positions[scrape_filepath][0])]
+
+    # Progress is measured in bytes of the chunks that have been parsed
+    sizes = {scrape_filepath: os.path.getsize(scrape_filepath)
+             for scrape_filepath in scrape_filepaths}
+    chunk_bytes = [(sizes[scrape_filepath] if end is None else end - start)
+                   for scrape_filepath, start, end in chunks]
+    total_bytes = sum(chunk_bytes)
+    bytes_read = 0
+    stats.track_progress('%d scrape files' % len(scrape_filepaths),
+                         lambda: bytes_read / total_bytes if total_bytes else 1.0)
+
+    lines_read = {scrape_filepath: line for scrape_filepath, (_, line) in positions.items()}
+    batch, batch_source = [], None
+
+    def write_batch(position):
+        write_bulk_batch(batch, session, batch_source, cache, stats,
+                         position if checkpointing else None, claimed)
+        del batch[:]
+
+    def end_file():
+        if batch or checkpointing:
+            write_batch(positions[batch_source])
+        stats.end_file()
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with Pool(workers) as pool:
+        results = parse_in_order(pool, chunks, workers * CHUNKS_PER_WORKER)
+        for chunk, n_bytes, result in zip(chunks, chunk_bytes, results):
+            scrape_filepath, start, end = chunk
+            n_lines, end_offset, records, errors, (parse_seconds, build_seconds) = result
+
+            # Batches are logged and checkpointed against a single file
+            if scrape_filepath != batch_source:
+                if batch_source is not None:
+                    end_file()
+                stats.begin_file(scrape_filepath)
+            batch_source = scrape_filepath
+
+            stats.add_seconds('parse', parse_seconds)
+            stats.add_seconds('build', build_seconds)
+            bytes_read += n_bytes
+
+            first_line = lines_read[scrape_filepath]
+            for line, error_name, error_msg in errors:
+                logger.error('%s:%s %s(%s)', scrape_filepath, first_line+line,
+                             error_name, error_msg)
+                stats.error(error_name)
+
+            for line, offset, packed in records:
+                batch.append((first_line+line, bulk.unpack_rows(packed)))
+                if len(batch) == bulk_size:
+                    write_batch((offset, first_line+line))
+
+            lines_read[scrape_filepath] += n_lines
+            positions[scrape_filepath] = (end_offset, lines_read[scrape_filepath])
+            stats.read(n_lines)
+
+    if batch_source is not None:
+        end_file()
@@ -0,0 +1,416 @@
+"""Parquet files for analytics.
+
+Full table scans for analysis are better run against Parquet files
+than against the production DB. export_tables writes each table to a
+directory of Parquet files under an export directory. The solution,
+player_solutions and action tables are partitioned by puzzle_id, in
+hive style directories like solution/puzzle_id=2002990/. Actions are
+exported with their action names.
+
+> export_tables(session, 'export/')
+
+Rows are streamed from the DB batch_size at a time with yield_per,
+which uses a server-side cursor on MySQL, so memory use is bounded by
+the batch size.
+
+Exports are incremental. After an export, the newest solution timestamp,
+the ids of the solutions exported with that timestamp, and the highest
+action id exported are saved in the export directory. The next export
+only appends solutions from that timestamp on, other than the ones
+already exported, their player_solutions links, and actions with higher
+ids. Timestamps only have one second resolution, so solutions loaded
+after an export can share the newest timestamp it saw. A solution
+loaded after an export with an older timestamp is not exported until
+the next full export.
+
+The other tables are exported in full every time. Puzzles, players,
+teams, action types and the summaries are small next to the rest.
+Histories grow with the solutions, but their ids are strings in no
+order and they have no timestamp, so the rows added since an export
+cannot be told apart from the rest without one. A lineage is also
+shared by solutions from many exports, so the histories of the new
+solutions alone would repeat rows that were exported before.
+
+Scrape files can also be converted to Parquet without a DB in between,
+with the same IRData and PDL parsing as the loaders:
+
+> convert_scrape_files(['scrape1.json', 'scrape2.json'], 'features/')
+
+This writes a solution table, a player_solution table with a row for
+each PDL, and an action table with a row for each action in the action
+logs of top solutions, all partitioned by puzzle_id. Each table is built
+a column at a time for batch_size solutions before it is written, and
+action and team names are dictionary encoded. Solutions that fail to
+parse or repeat an earlier solution id are logged and skipped.
+
+Parquet files need pyarrow, which is installed with the export extra.
+"""
+import json
+import logging
+import os
+import shutil
+from array import array
+from datetime import datetime
+
+from sqlalchemy import func, or_
+
+from folditdb import scrape
+from folditdb.cache import IntSet
+from folditdb.irdata import IRData, PDL
+from folditdb.stats import NULL_STATS
+from folditdb.tables import (Solution, Puzzle, Team, Player, History, HistoryString,
+    ActionType, Action, PuzzleSummary, PlayerActionSummary, player_solutions)
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from the DB and written to Parquet at a time
+BATCH_SIZE = 100000
+
+# Solutions converted from scrape files and written to Parquet at a time
+CONVERT_BATCH_SIZE = 10000
+
+# Saved in the export directory after each export. Files that start
+# with an underscore are skipped by Parquet readers.
+STATE_FILENAME = '_folditdb_export.json'
+
+PARTITION_COLUMN = 'puzzle_id'
+
+# Tables exported in full each time
+DIMENSION_TABLES = [Puzzle, Team, Player, History, HistoryString, ActionType,
+                    PuzzleSummary, PlayerActionSummary]
+
+# Partitions written in one call, up to one per puzzle in a batch
+MAX_PARTITIONS = 1024 * 1024
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImportError('Parquet files need pyarrow: pip install folditdb[export]')
+
+
+def arrow_schema(columns):
+    """An arrow schema for SQLAlchemy columns, from their python types."""
+    arrow_types = {
+        int: pyarrow.int64(),
+        float: pyarrow.float64(),
+        str: pyarrow.string(),
+        datetime: pyarrow.timestamp('us'),
+    }
+    return pyarrow.schema([(column.name, arrow_types[column.type.python_type])
+                           for column in columns])
+
+
+def export_tables(session, export_dir, full=False, batch_size=BATCH_SIZE):
+    """Export the DB to Parquet files, appending to an earlier export.
+
+    With full=True, or if there is no earlier export in export_dir,
+    every row is exported and any earlier export is replaced. Returns a
+    dict of the number of rows exported from each table.
+    """
+    require_pyarrow()
+
+    state = None if full else read_state(export_dir)
+    if state is None:
+        for name in os.listdir(export_dir) if os.path.isdir(export_dir) else []:
+            path = os.path.join(export_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        since_timestamp, since_solution_ids, since_action_id = None, None, None
+    else:
+        since_timestamp, since_action_id = state['solution_timestamp'], state['action_id']
+        # Exports by earlier versions did not save the ids
+        since_solution_ids = state.get('solution_ids')
+        if since_timestamp is not None:
+            since_timestamp = datetime.strptime(since_timestamp, '%Y-%m-%d %H:%M:%S.%f')
+
+    # Rows loaded during the export are left for the next one
+    until_timestamp = session.query(func.max(Solution.timestamp)).scalar()
+    until_action_id = session.query(func.max(Action.id)).scalar()
+    # The session reads from one transaction throughout, so these are
+    # the solutions with the newest timestamp that are exported
+    until_solution_ids = []
+    if until_timestamp is not None:
+        until_solution_ids = [sid for (sid, ) in session.query(Solution.id)
+                              .filter(Solution.timestamp == until_timestamp)]
+
+    export_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    exported = {}
+
+    solutions = session.query(*Solution.__table__.columns)
+    solutions = _filter_solutions(solutions, since_timestamp, since_solution_ids,
+                                  until_timestamp)
+    exported['solution'] = write_partitioned(
+        solutions, os.path.join(export_dir, 'solution'), export_id, batch_size)
+
+    links = (session.query(player_solutions.c.player_id, player_solutions.c.solution_id,
+                           Solution.puzzle_id)
+                    .join(Solution, Solution.id == player_solutions.c.solution_id))
+    links = _filter_solutions(links, since_timestamp, since_solution_ids, until_timestamp)
+    exported['player_solutions'] = write_partitioned(
+        links, os.path.join(export_dir, 'player_solutions'), export_id, batch_size)
+
+    actions = (session.query(Action.id, ActionType.name.label('action_name'), Action.action_n,
+                             Action.player_id, Action.puzzle_id)
+                      .outerjoin(ActionType, ActionType.id == Action.action_type_id))
+    actions = _filter_range(actions, Action.id, since_action_id, until_action_id)
+    exported['action'] = write_partitioned(
+        actions, os.path.join(export_dir, 'action'), export_id, batch_size)
+
+    for model in DIMENSION_TABLES:
+        table = model.__table__
+        exported[table.name] = write_table(
+            session.query(*table.columns), os.path.join(export_dir, table.name),
+            export_id, batch_size)
+
+    if state is not None and until_timestamp is None:
+        until_timestamp, until_solution_ids = since_timestamp, since_solution_ids
+    if state is not None and until_action_id is None:
+        until_action_id = since_action_id
+    write_state(export_dir, until_timestamp, until_solution_ids, until_action_id)
+    return exported
+
+
+def _filter_solutions(query, since_timestamp, since_solution_ids, until_timestamp):
+    """Filter a query to the solutions that are new since an export.
+
+    Solutions with the timestamp of the last export are included unless
+    they were exported then.
+    """
+    if since_timestamp is not None and since_solution_ids is not None:
+        query = query.filter(Solution.timestamp >= since_timestamp)
+        if since_solution_ids:
+            query = query.filter(or_(Solution.timestamp > since_timestamp,
+                                     Solution.id.notin_(since_solution_ids)))
+        since_timestamp = None
+    return _filter_range(query, Solution.timestamp, since_timestamp, until_timestamp)
+
+
+def _filter_range(query, column, since, until):
+    if since is not None:
+        query = query.filter(column > since)
+    if until is not None:
+        query = query.filter(column <= until)
+    return query
+
+
+def _iter_batches(query, batch_size):
+    """Yield lists of rows from a query, streamed batch_size at a time."""
+    batch = []
+    for row in query.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _to_arrow(rows, schema):
+    columns = list(zip(*rows))
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def write_partitioned(query, table_dir, export_id, batch_size=BATCH_SIZE):
+    """Write the rows of a query to Parquet files partitioned by puzzle_id.
+
+    Files are added to the partitions, so rows from earlier exports are
+    kept. Returns the number of rows written.
+    """
+    schema = arrow_schema(query.statement.columns)
+    n_rows = 0
+    for i, rows in enumerate(_iter_batches(query, batch_size)):
+        write_partitions(_to_arrow(rows, schema), table_dir, '%s-%d' % (export_id, i))
+        n_rows += len(rows)
+    return n_rows
+
+
+def write_partitions(arrow_table, table_dir, basename):
+    """Add an arrow table to the puzzle_id partitions in a directory."""
+    partitioning = pyarrow.dataset.partitioning(
+        pyarrow.schema([arrow_table.schema.field(PARTITION_COLUMN)]), flavor='hive')
+    pyarrow.dataset.write_dataset(
+        arrow_table, table_dir, format='parquet', partitioning=partitioning,
+        basename_template=basename + '-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore', max_partitions=MAX_PARTITIONS,
+    )
+
+
+def write_table(query, table_dir, export_id, batch_size=BATCH_SIZE):
+    """Write the rows of a query to a single Parquet file, replacing the last one.
+
+    Returns the number of rows written.
+    """
+    schema = arrow_schema(query.statement.columns)
+    os.makedirs(table_dir, exist_ok=True)
+    filepath = os.path.join(table_dir, '%s.parquet' % export_id)
+
+    n_rows = 0
+    with pyarrow.parquet.ParquetWriter(filepath, schema) as writer:
+        for rows in _iter_batches(query, batch_size):
+            writer.write_table(_to_arrow(rows, schema))
+            n_rows += len(rows)
+
+    for filename in os.listdir(table_dir):
+        if filename != os.path.basename(filepath):
+            os.remove(os.path.join(table_dir, filename))
+    return n_rows
+
+
+def read_state(export_dir):
+    """The state saved by the last export to a directory, or None."""
+    state_filepath = os.path.join(export_dir, STATE_FILENAME)
+    if not os.path.exists(state_filepath):
+        return None
+    with open(state_filepath) as state_file:
+        return json.load(state_file)
+
+
+def write_state(export_dir, solution_timestamp, solution_ids, action_id):
+    os.makedirs(export_dir, exist_ok=True)
+    if solution_timestamp is not None:
+        solution_timestamp = solution_timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+    with open(os.path.join(export_dir, STATE_FILENAME), 'w') as state_file:
+        json.dump(dict(solution_timestamp=solution_timestamp, solution_ids=solution_ids,
+                       action_id=action_id),
+                  state_file, indent=2)
+
+
+class SolutionColumns:
+    """Columns of solution, player and action data for a batch of solutions.
+
+    Values for each solution are gathered before they are added to the
+    columns, so a solution that fails to parse adds nothing. Action logs
+    are added a column at a time, as parse_action_log returns them.
+    """
+    def __init__(self):
+        self.solution = dict(id=array('q'), puzzle_id=array('q'), history_id=[],
+                             history_hash=[], solution_type=[], total_moves=array('q'), score=array('d'),
+                             timestamp=[], n_players=array('q'))
+        self.player_solution = dict(solution_id=array('q'), puzzle_id=array('q'),
+                                    player_id=array('q'), player_name=[], team_name=[])
+        self.action = dict(solution_id=array('q'), puzzle_id=array('q'), player_id=array('q'),
+                           action_name=[], action_n=array('q'))
+        self.n_solutions = 0
+
+    def add(self, irdata):
+        solution = Solution.row_from_irdata(irdata)
+        pdls = PDL.from_irdata(irdata)
+        actions = []
+        if irdata.solution_type == 'top':
+            actions = [(pdl.player_id, pdl.actions()) for pdl in pdls]
+
+        solution['n_players'] = len(pdls)
+        for name, column in self.solution.items():
+            column.append(solution[name])
+
+        n_pdls = len(pdls)
+        sid, puzzle_id = solution['id'], solution['puzzle_id']
+        columns = self.player_solution
+        columns['solution_id'].extend([sid] * n_pdls)
+        columns['puzzle_id'].extend([puzzle_id] * n_pdls)
+        columns['player_id'].extend([pdl.player_id for pdl in pdls])
+        columns['player_name'].extend([pdl.player_name for pdl in pdls])
+        columns['team_name'].extend([pdl.team_name for pdl in pdls])
+
+        columns = self.action
+        for player_id, (action_names, action_ns) in actions:
+            n_actions = len(action_names)
+            columns['solution_id'].extend([sid] * n_actions)
+            columns['puzzle_id'].extend([puzzle_id] * n_actions)
+            columns['player_id'].extend([player_id] * n_actions)
+            columns['action_name'].extend(action_names)
+            columns['action_n'].extend(action_ns)
+
+        self.n_solutions += 1
+
+    def tables(self):
+        """The columns as an arrow table for each of the three tables."""
+        timestamp = pyarrow.timestamp('us')
+        dictionary = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        types = dict(history_id=pyarrow.string(), history_hash=pyarrow.string(),
+                     solution_type=pyarrow.string(),
+                     timestamp=timestamp, score=pyarrow.float64(),
+                     player_name=pyarrow.string(), team_name=dictionary, action_name=dictionary)
+        return {name: pyarrow.Table.from_arrays(
+                    [pyarrow.array(column, type=types.get(column_name, pyarrow.int64()))
+                     for column_name, column in columns.items()],
+                    names=list(columns))
+                for name, columns in [('solution', self.solution),
+                                      ('player_solution', self.player_solution),
+                                      ('action', self.action)]}
+
+
+def convert_scrape_files(scrape_filepaths, out_dir, stats=None, batch_size=CONVERT_BATCH_SIZE):
+    """Write the solutions in scrape files to Parquet tables.
+
+    Returns a dict of the number of rows written to each table.
+    """
+    require_pyarrow()
+    if stats is None:
+        stats = NULL_STATS
+
+    convert_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    seen = IntSet()
+    written = dict(solution=0, player_solution=0, action=0)
+    n_batches = 0
+
+    def write_batch(columns):
+        nonlocal n_batches
+        start = stats.clock()
+        for name, arrow_table in columns.tables().items():
+            if arrow_table.num_rows:
+                write_partitions(arrow_table, os.path.join(out_dir, name),
+                                 '%s-%d' % (convert_id, n_batches))
+                written[name] += arrow_table.num_rows
+                stats.add_rows({name: arrow_table.num_rows})
+        n_batches += 1
+        stats.add_time('flush', start)
+
+    columns = SolutionColumns()
+    for scrape_filepath in scrape_filepaths:
+        reader = scrape.ScrapeReader(scrape_filepath)
+        stats.track_progress(scrape_filepath, reader.fraction_read)
+        stats.begin_file(scrape_filepath)
+        for json_bytes in reader:
+            stats.read()
+            try:
+                start = stats.clock()
+                irdata = IRData.from_json(json_bytes)
+                irdata.decode()
+                start = stats.add_time('parse', start)
+
+                solution_id = irdata.solution_id
+                if solution_id in seen:
+                    logger.error('%s:%s DuplicateIRDataException()', scrape_filepath, reader.line)
+                    stats.duplicate()
+                    continue
+                columns.add(irdata)
+                stats.add_time('build', start)
+            except Exception as err:
+                logger.error('%s:%s %s(%s)', scrape_filepath, reader.line,
+                             err.__class__.__name__, err)
+                stats.error(err.__class__.__name__)
+                continue
+
+            # cache.IntSet only holds non-negative ids
+            if solution_id >= 0:
+                seen.add(solution_id)
+
+            if columns.n_solutions == batch_size:
+                write_batch(columns)
+                columns = SolutionColumns()
+        stats.end_file()
+
+    if columns.n_solutions:
+        write_batch(columns)
+    return written
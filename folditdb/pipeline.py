@@ -0,0 +1,73 @@
+"""Overlap parsing with writing to the DB.
+
+The loaders alternate between parsing a batch of records and writing
+it, so the CPU sits idle while the DB works and the DB waits while
+the next batch is parsed. in_background runs the parsing side in a
+thread and passes batches to the writing side through a bounded queue.
+PyMySQL releases the GIL while it waits on the DB, so the next batch is
+parsed during the round trips for the last one.
+
+> batches = in_background(parse_batches(irdatas), queue_size=4)
+> for batch in batches:
+>     write(batch)
+
+The parsing thread blocks when queue_size batches are waiting, so at
+most queue_size + 2 batches are held in memory however far the DB
+falls behind. An exception raised while parsing is raised again in the
+writing thread, and the parsing thread stops as soon as the writing
+side stops asking for batches.
+"""
+import queue
+import threading
+
+# Batches parsed ahead of the one being written
+QUEUE_SIZE = 4
+
+# Seconds between checks that the consumer is still waiting
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Raised:
+    def __init__(self, err):
+        self.err = err
+
+
+def in_background(items, queue_size=QUEUE_SIZE):
+    """Iterate over items in a thread, yielding them through a bounded queue."""
+    pending = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as err:
+            put(_Raised(err))
+        else:
+            put(_DONE)
+
+    thread = threading.Thread(target=produce, name='folditdb-parse', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Raised):
+                raise item.err
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
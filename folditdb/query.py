@@ -0,0 +1,205 @@
+"""Read queries for the aggregates that dashboards ask for over and over.
+
+Each query is computed in SQL and returns plain dicts, never model
+objects. Per-puzzle and per-player totals are read from the summary
+tables in folditdb.summary.
+
+> top_solutions(session, 2002990, n=10)
+> player_action_totals(session, 123)
+> team_players(session, 'Contenders')
+
+Results are kept in RESULTS, a QueryCache that forgets them after a
+time to live, or when it is full and they are the least recently used.
+Each result is also tagged with the puzzle, player or team it is about.
+The loaders stage a tag for the puzzle, players and teams of every
+solution they write, and when the session commits, the cached results
+with those tags are dropped. Backfills and summary rebuilds, which
+rewrite whole tables, clear every result when they commit. Solutions
+loaded by another process are only seen once the results expire.
+"""
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from sqlalchemy import func, select
+
+from folditdb.cache import TransactionCache
+from folditdb.tables import (Solution, Player, ActionType, PuzzleSummary, PlayerActionSummary,
+    player_solutions)
+
+# Seconds a result is kept for
+TTL = 300
+
+# Results kept at most
+MAX_SIZE = 1024
+
+
+class QueryCache:
+    """Query results by key, tagged with the rows they depend on.
+
+    The cache can be shared by threads.
+    """
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = time.monotonic
+        self._results = OrderedDict()
+        self._tagged = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+    def get(self, key):
+        """The result for a key, or None if it is not cached or has expired."""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return None
+            result, tag, expires = entry
+            if self.clock() >= expires:
+                self._remove(key)
+                return None
+            self._results.move_to_end(key)
+            return result
+
+    def set(self, key, result, tag):
+        with self._lock:
+            if key in self._results:
+                self._remove(key)
+            self._results[key] = (result, tag, self.clock() + self.ttl)
+            self._tagged.setdefault(tag, set()).add(key)
+            while len(self._results) > self.max_size:
+                self._remove(next(iter(self._results)))
+
+    def invalidate(self, tag):
+        """Forget every result with a tag, like ('puzzle', 2002990)."""
+        with self._lock:
+            for key in self._tagged.pop(tag, ()):
+                del self._results[key]
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._tagged.clear()
+
+    def _remove(self, key):
+        _, tag, _ = self._results.pop(key)
+        keys = self._tagged[tag]
+        keys.discard(key)
+        if not keys:
+            del self._tagged[tag]
+
+
+RESULTS = QueryCache()
+
+
+class Invalidations(TransactionCache):
+    """Tags of rows written in a session, invalidated when it commits."""
+    def __init__(self, results):
+        super().__init__()
+        self.results = results
+
+    def stage(self, tags):
+        self._staged.extend(tags)
+
+    def _commit_entry(self, tag):
+        self.results.invalidate(tag)
+
+    def _discard_entry(self, tag):
+        pass
+
+
+def stage_invalidations(session, tags):
+    """Invalidate cached results with these tags when the session commits."""
+    invalidations = session.info.get('query_invalidations')
+    if invalidations is None:
+        invalidations = session.info['query_invalidations'] = Invalidations(RESULTS)
+        invalidations.track(session)
+    invalidations.stage(tags)
+
+
+def solution_tags(puzzle_id, player_ids=(), team_names=()):
+    """Tags for the results that change when a solution is loaded."""
+    return ([('puzzle', puzzle_id)] + [('player', player_id) for player_id in player_ids] +
+            [('team', team_name) for team_name in team_names])
+
+
+def cached(kind):
+    """Cache a query's results, tagged with its first argument after the session.
+
+    Arguments are bound to the query's signature, with defaults applied,
+    so calls that pass the same values by position or by keyword share
+    a result.
+    """
+    def decorator(query):
+        signature = inspect.signature(query)
+
+        @wraps(query)
+        def cached_query(session, *args, **kwargs):
+            bound = signature.bind(session, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = list(bound.arguments.items())[1:]
+            cache_key = (str(session.bind.url), query.__name__, tuple(arguments))
+            result = RESULTS.get(cache_key)
+            if result is None:
+                result = query(*bound.args, **bound.kwargs)
+                RESULTS.set(cache_key, result, (kind, arguments[0][1]))
+            return result
+        return cached_query
+    return decorator
+
+
+@cached('puzzle')
+def top_solutions(session, puzzle_id, n=10):
+    """The n highest scoring solutions to a puzzle, best first."""
+    query = (select([Solution.id, Solution.score, Solution.total_moves, Solution.solution_type,
+                     Solution.timestamp])
+             .where(Solution.puzzle_id == puzzle_id)
+             .order_by(Solution.score.desc(), Solution.id)
+             .limit(n))
+    return [dict(row) for row in session.execute(query)]
+
+
+@cached('puzzle')
+def puzzle_summary(session, puzzle_id):
+    """Counts of solutions, players, moves and actions, and the best score, for a puzzle."""
+    summary = PuzzleSummary.__table__
+    row = session.execute(summary.select().where(summary.c.puzzle_id == puzzle_id)).first()
+    result = dict(solutions=0, best_score=None, total_moves=0, action_n=0)
+    if row is not None:
+        result.update((column, row[column]) for column in result)
+    players = (select([func.count(player_solutions.c.player_id.distinct())])
+               .select_from(player_solutions.join(
+                   Solution, Solution.id == player_solutions.c.solution_id))
+               .where(Solution.puzzle_id == puzzle_id))
+    result['players'] = session.execute(players).scalar()
+    return result
+
+
+@cached('player')
+def player_action_totals(session, player_id):
+    """The total count of each action used by a player, most used first."""
+    summary = PlayerActionSummary.__table__
+    query = (select([ActionType.name, summary.c.action_n])
+             .select_from(summary.join(ActionType.__table__,
+                                       ActionType.id == summary.c.action_type_id))
+             .where(summary.c.player_id == player_id)
+             .order_by(summary.c.action_n.desc(), ActionType.name))
+    return OrderedDict((name, int(n)) for name, n in session.execute(query))
+
+
+@cached('team')
+def team_players(session, team_name):
+    """The players in a team, with the number of solutions each contributed to."""
+    n_solutions = func.count(player_solutions.c.solution_id)
+    query = (select([Player.id, Player.name, n_solutions.label('solutions')])
+             .select_from(Player.__table__.outerjoin(
+                 player_solutions, player_solutions.c.player_id == Player.id))
+             .where(Player.team_name == team_name)
+             .group_by(Player.id, Player.name)
+             .order_by(n_solutions.desc(), Player.id))
+    return [dict(row) for row in session.execute(query)]
@@ -0,0 +1,160 @@
+"""Streaming reads of scrape files.
+
+A scrape file is the output of the foldit-go command 'scrape', with
+one json object per line. Scrape files are read in large binary chunks
+and split into lines without decoding the file to str. The json on each
+line is decoded with orjson when it is installed, and with the json
+module otherwise.
+
+Scrape files ending in .gz, .bz2 or .xz are decompressed on the fly.
+Directories and glob patterns are expanded to the scrape files they
+contain by find_scrape_files.
+
+> for json_bytes in iter_lines('scrape.json.gz'):
+>     data = loads(json_bytes)
+"""
+import bz2
+import glob
+import gzip
+import json
+import lzma
+import os
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Bytes to read from a scrape file at a time
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Files in directories that are taken to be scrape files
+SCRAPE_FILE_PATTERNS = ('*.json', '*.json.gz', '*.json.bz2', '*.json.xz')
+
+OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+if orjson is not None:
+    loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+else:
+    loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+
+def is_compressed(scrape_filepath):
+    return str(scrape_filepath).endswith(tuple(OPENERS))
+
+
+def find_scrape_files(paths):
+    """Expand paths to directories and glob patterns into scrape files.
+
+    Directories are searched recursively for files matching
+    SCRAPE_FILE_PATTERNS. Each file is listed once, in the order the
+    paths are given. Raises FileNotFoundError if a path matches nothing.
+    """
+    scrape_filepaths = []
+    for path in paths:
+        matches = []
+        for match in sorted(glob.glob(str(path), recursive=True)):
+            if os.path.isdir(match):
+                matches.extend(sorted(
+                    filepath
+                    for pattern in SCRAPE_FILE_PATTERNS
+                    for filepath in glob.glob(os.path.join(match, '**', pattern),
+                                              recursive=True)
+                ))
+            else:
+                matches.append(match)
+
+        if not matches:
+            raise FileNotFoundError('no scrape files found: %s' % path)
+        scrape_filepaths.extend(matches)
+
+    return list(OrderedDict.fromkeys(scrape_filepaths))
+
+
+def open_scrape_file(scrape_filepath, mode='rb'):
+    """Open a scrape file in binary mode, through gzip, bz2 or lzma by suffix."""
+    for suffix, opener in OPENERS.items():
+        if str(scrape_filepath).endswith(suffix):
+            return opener(scrape_filepath, mode)
+    return open(scrape_filepath, mode)
+
+
+def iter_lines(scrape_filepath, chunk_size=CHUNK_SIZE):
+    """Yield each line in a scrape file as bytes, without the newline."""
+    yield from ScrapeReader(scrape_filepath, chunk_size)
+
+
+class ScrapeReader:
+    """Read the lines of a scrape file while keeping track of position.
+
+    After each line is yielded, offset is the number of bytes of scrape
+    data read through the end of that line, after decompression, and
+    line is its line number. fraction_read() is how far the reader is
+    through the file on disk, for estimating the time remaining.
+
+    To resume reading where an earlier reader stopped, pass its offset
+    and line. Compressed files are decompressed up to the offset.
+
+    > reader = ScrapeReader('scrape.json.gz')
+    > for json_bytes in reader:
+    >     print(reader.line, reader.fraction_read())
+    """
+    def __init__(self, scrape_filepath, chunk_size=CHUNK_SIZE, offset=0, line=0):
+        self.scrape_filepath = scrape_filepath
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(scrape_filepath)
+        self.offset = offset
+        self.line = line
+        self._raw = None
+
+    def fraction_read(self):
+        if self._raw is None:
+            return 0.0
+        if self._raw.closed or not self.size:
+            return 1.0
+        return min(self._raw.tell() / self.size, 1.0)
+
+    def __iter__(self):
+        with open(self.scrape_filepath, 'rb') as raw:
+            self._raw = raw
+            with _decompressed(raw, self.scrape_filepath) as scrape_file:
+                if self.offset:
+                    scrape_file.seek(self.offset)
+                yield from self._iter_lines(scrape_file)
+
+    def _iter_lines(self, scrape_file):
+        remainder = b''
+        while True:
+            chunk = scrape_file.read(self.chunk_size)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for json_bytes in lines:
+                self.offset += len(json_bytes) + 1
+                self.line += 1
+                yield json_bytes
+
+        if remainder:
+            self.offset += len(remainder)
+            self.line += 1
+            yield remainder
+
+
+def _decompressed(raw, scrape_filepath):
+    """Wrap an open scrape file in a decompressor chosen by suffix."""
+    scrape_filepath = str(scrape_filepath)
+    if scrape_filepath.endswith('.gz'):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    elif scrape_filepath.endswith('.bz2'):
+        return bz2.BZ2File(raw)
+    elif scrape_filepath.endswith('.xz'):
+        return lzma.LZMAFile(raw)
+    return raw
@@ -0,0 +1,162 @@
+"""Write to several sessions at once, partitioned by puzzle.
+
+A single writer spends most of its time waiting on the DB. The sharded
+loader parses scrape files in one thread and routes each record to one
+of N writer threads by its puzzle_id, and each writer commits bulk
+batches through its own session:
+
+> sessions = [new_session(url, writer=True) for url in ['sqlite:///a.db', 'sqlite:///b.db']]
+> load_sharded(['scrape.json'], sessions)
+
+The sessions can share one DB, so that N connections write to it in
+parallel, or each can be bound to a different DB, so that each DB holds
+the puzzles of one shard. Every solution to a puzzle goes to the same
+shard, along with its histories and actions. Players, teams and action
+types are written to each shard that uses them.
+
+Each writer has a bounded queue of batches, so the parser waits when a
+writer falls behind. Errors are logged with the file:line format of
+folditdb.load. Row counts and timings from the writers go to the same
+stats, and may lose an update when two writers report at once.
+
+A checkpoint for each file is saved through the first session once
+every writer has committed the whole file, so a resumed load skips the
+files that were finished.
+"""
+import logging
+import queue
+import threading
+
+from folditdb import bulk, scrape
+from folditdb.checkpoint import load_checkpoint, save_checkpoint
+from folditdb.irdata import IRData
+from folditdb.load import write_bulk_batch, _check_claim, _log_error
+from folditdb.stats import NULL_STATS
+
+logger = logging.getLogger(__name__)
+
+# Batches waiting for each writer
+QUEUE_SIZE = 2
+
+
+def shard_for(puzzle_id, n_shards):
+    """The shard that holds a puzzle."""
+    return puzzle_id % n_shards
+
+
+class ShardWriter(threading.Thread):
+    """Commit the batches for one shard through its own session."""
+    def __init__(self, session, cache=None, stats=NULL_STATS, queue_size=QUEUE_SIZE,
+                 claimed=None):
+        super().__init__(daemon=True)
+        self.session = session
+        self.cache = cache
+        self.stats = stats
+        self.claimed = claimed
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+                batch, source = item
+                # After an unexpected error, batches are dropped until it is raised
+                if self.error is None:
+                    write_bulk_batch(batch, self.session, source, self.cache, self.stats,
+                                     claimed=self.claimed)
+            except BaseException as err:
+                self.error = err
+            finally:
+                self.pending.task_done()
+
+    def write(self, batch, source):
+        self.raise_error()
+        self.pending.put((batch, source))
+
+    def wait(self):
+        """Wait until every batch given to the writer is committed."""
+        self.pending.join()
+        self.raise_error()
+
+    def stop(self):
+        self.pending.put(None)
+        self.join()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+def load_sharded(scrape_filepaths, sessions, bulk_size=1000, caches=None, stats=None,
+                 checkpoint=False, resume=False, claimed=None, queue_size=QUEUE_SIZE):
+    """Load scrape files through a writer thread for each session.
+
+    caches is a list of folditdb.cache.KeyCache, one for each session,
+    or None. Claimed solution ids and checkpoints work as in
+    folditdb.load.load_top_solutions_from_file, except that checkpoints
+    are only saved at the end of each file.
+    """
+    if stats is None:
+        stats = NULL_STATS
+    if caches is None:
+        caches = [None] * len(sessions)
+
+    writers = [ShardWriter(session, cache, stats, queue_size, claimed)
+               for session, cache in zip(sessions, caches)]
+    for writer in writers:
+        writer.start()
+
+    try:
+        for scrape_filepath in scrape_filepaths:
+            offset, line = 0, 0
+            if resume:
+                offset, line = load_checkpoint(sessions[0], scrape_filepath)
+            reader = scrape.ScrapeReader(scrape_filepath, offset=offset, line=line)
+            stats.track_progress(scrape_filepath, reader.fraction_read)
+            stats.begin_file(scrape_filepath)
+
+            _route(reader, scrape_filepath, writers, bulk_size, stats, claimed)
+            for writer in writers:
+                writer.wait()
+
+            if checkpoint or resume:
+                save_checkpoint(sessions[0], scrape_filepath, reader.offset, reader.line)
+                sessions[0].commit()
+            stats.end_file()
+    finally:
+        for writer in writers:
+            writer.stop()
+
+
+def _route(reader, source, writers, bulk_size, stats=NULL_STATS, claimed=None):
+    """Parse the records from a reader and send them to their shard's writer."""
+    batches = [[] for _ in writers]
+    for json_bytes in reader:
+        stats.read()
+        line = reader.line
+        try:
+            start = stats.clock()
+            irdata = IRData.from_json(json_bytes)
+            irdata.decode()
+            start = stats.add_time('parse', start)
+            rows = bulk.rows_from_irdata(irdata)
+            stats.add_time('build', start)
+            if claimed is not None:
+                _check_claim(claimed, bulk.solution_id(rows))
+        except Exception as err:
+            _log_error(source, line, err, stats)
+            continue
+
+        shard = shard_for(irdata.puzzle_id, len(writers))
+        batches[shard].append((line, rows))
+        if len(batches[shard]) == bulk_size:
+            writers[shard].write(batches[shard], source)
+            batches[shard] = []
+
+    for writer, batch in zip(writers, batches):
+        if batch:
+            writer.write(batch, source)
@@ -0,0 +1,77 @@
+"""SQLite as a local target, without a DB server.
+
+Every table in folditdb.tables, and the INSERT OR IGNORE, INSERT OR
+REPLACE and ON CONFLICT upserts the loaders use, work on SQLite:
+
+> folditdb init-db --db-url sqlite:///foldit.db
+> folditdb --db-url sqlite:///foldit.db --bulk-size 1000 scrape.json
+
+Engines made by folditdb.db for SQLite URLs are configured when each
+connection is opened:
+
+- The DB is put in WAL mode, so queries can read while a loader writes,
+  and commits only append to the log.
+- synchronous=NORMAL, which is durable across process crashes in WAL
+  mode and skips an fsync on every commit.
+- Transactions are begun by SQLAlchemy instead of the sqlite3 module,
+  which would otherwise only begin them before an INSERT and so break
+  the SAVEPOINTs used to skip a bad solution.
+- On engines for writers, made with writer=True, transactions take the
+  write lock when they begin, with BEGIN IMMEDIATE. A loader's
+  transaction reads before it writes, and could fail with "database is
+  locked" as soon as it tried to write after another connection had.
+  Writers instead wait their turn, for up to BUSY_TIMEOUT seconds.
+  Other engines begin transactions with a deferred BEGIN, so queries
+  never wait for the write lock.
+
+A fast-load profile for bulk loads into a DB that can be rebuilt if
+the machine goes down mid-load turns off fsync, uses a large page
+cache, and keeps temporary tables in memory. folditdb load uses it with
+--fast-load, along with --defer-indexes:
+
+> folditdb --db-url sqlite:///foldit.db --bulk-size 1000 --fast-load scrape.json
+"""
+from sqlalchemy import event
+
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+)
+
+FAST_LOAD_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'OFF'),
+    # Negative sizes are in KiB: 256 MiB of pages
+    ('cache_size', -262144),
+    ('temp_store', 'MEMORY'),
+)
+
+# Seconds to wait for another connection to finish writing
+BUSY_TIMEOUT = 30
+
+
+def configure(engine, fast_load=False, writer=False):
+    """Set the pragmas on each connection an engine opens, and begin transactions."""
+    pragmas = FAST_LOAD_PRAGMAS if fast_load else PRAGMAS
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        # Stop the sqlite3 module from beginning and committing transactions itself
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    begin = 'BEGIN IMMEDIATE' if writer else 'BEGIN'
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(connection):
+        connection.execute(begin)
+
+    return engine
+
+
+def pragma(connection, name):
+    """The current value of a pragma on a connection."""
+    return connection.execute('PRAGMA %s' % name).scalar()
@@ -0,0 +1,191 @@
+"""Counters and timers for loading scrape files.
+
+The loaders accept a LoadStats object and report to it as they go:
+records read, duplicates skipped, errors by exception class, rows sent
+to the DB per table, and the time spent in each stage of loading.
+
+    parse   decoding the json for each record
+    build   parsing IRData and PDL fields into model objects or rows
+    flush   adding objects to the session, or executing bulk inserts
+    commit  committing, including anything left to flush
+
+> stats = LoadStats(progress_interval=10)
+> load_top_solutions_from_file('scrape.json', session, stats=stats)
+> stats.write_summary('stats.json')
+
+With a progress_interval, a progress line with the records per second
+and an estimate of the time remaining is written every so many seconds,
+and a line with the throughput for each file when it is done.
+
+When no stats are wanted, the loaders report to NULL_STATS, whose
+methods do nothing and whose clock never reads the time.
+"""
+import json
+import sys
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+
+STAGES = ('parse', 'build', 'flush', 'commit')
+
+
+class LoadStats:
+    enabled = True
+
+    def __init__(self, progress_interval=None, progress_file=None):
+        self.progress_interval = progress_interval
+        self.progress_file = progress_file
+        self.records = 0
+        self.duplicates = 0
+        self.errors = Counter()
+        self.rows = Counter()
+        self.seconds = OrderedDict((stage, 0.0) for stage in STAGES)
+        self.files = OrderedDict()
+        self.clock = time.perf_counter
+        self.start = self.clock()
+        self._source = None
+        self._fraction_read = None
+        self._source_start = self._last_progress = self.start
+        self._file = None
+
+    def add_time(self, stage, start):
+        """Add the time since start to a stage and return the current time."""
+        now = self.clock()
+        self.seconds[stage] += now - start
+        return now
+
+    def add_seconds(self, stage, seconds):
+        self.seconds[stage] += seconds
+
+    def read(self, n_records=1):
+        self.records += n_records
+        if self.progress_interval is not None:
+            now = self.clock()
+            if now - self._last_progress >= self.progress_interval:
+                self._last_progress = now
+                self.write_progress(now)
+
+    def duplicate(self):
+        self.duplicates += 1
+
+    def error(self, error_name):
+        self.errors[error_name] += 1
+
+    def add_rows(self, table_rows):
+        """Count rows sent to the DB from a dict of table names to row counts."""
+        self.rows.update(table_rows)
+
+    def track_progress(self, source, fraction_read):
+        """Estimate time remaining from a function returning the fraction read."""
+        self._source = source
+        self._fraction_read = fraction_read
+        self._source_start = self.clock()
+
+    def begin_file(self, scrape_filepath):
+        self._file = (scrape_filepath, self.clock(), self.records)
+
+    def end_file(self):
+        """Record the throughput for the file passed to begin_file."""
+        scrape_filepath, start, records = self._file
+        self._file = None
+        seconds = self.clock() - start
+        n_records = self.records - records
+        rate = n_records / seconds if seconds else None
+        self.files[scrape_filepath] = OrderedDict([
+            ('records', n_records),
+            ('seconds', round(seconds, 6)),
+            ('records_per_second', round(rate, 1) if rate is not None else None),
+        ])
+
+        if self.progress_interval is not None:
+            progress_file = self.progress_file or sys.stderr
+            progress_file.write('%s: done, %d records in %.1fs, %.1f records/s\n' % (
+                scrape_filepath, n_records, seconds, rate or 0.0))
+            progress_file.flush()
+
+    def progress(self, now=None):
+        """A line describing the progress of the load so far."""
+        now = self.clock() if now is None else now
+        elapsed = now - self.start
+        rate = self.records / elapsed if elapsed else 0.0
+        line = '%d records, %.1f records/s' % (self.records, rate)
+
+        if self._fraction_read is not None:
+            fraction = self._fraction_read()
+            line = '%s: %s, %.1f%% read' % (self._source, line, 100 * fraction)
+            if fraction > 0:
+                source_elapsed = now - self._source_start
+                remaining = source_elapsed * (1 - fraction) / fraction
+                line += ', ETA %s' % timedelta(seconds=round(remaining))
+        return line
+
+    def write_progress(self, now=None):
+        progress_file = self.progress_file or sys.stderr
+        progress_file.write(self.progress(now) + '\n')
+        progress_file.flush()
+
+    def summary(self):
+        """The counters and timers as a dict that can be dumped to json."""
+        elapsed = self.clock() - self.start
+        return OrderedDict([
+            ('records', self.records),
+            ('duplicates', self.duplicates),
+            ('errors', OrderedDict(sorted(self.errors.items()))),
+            ('rows', OrderedDict(sorted(self.rows.items()))),
+            ('seconds', round(elapsed, 6)),
+            ('records_per_second', round(self.records / elapsed, 1) if elapsed else None),
+            ('stages', OrderedDict(
+                (stage, round(seconds, 6)) for stage, seconds in self.seconds.items()
+            )),
+            ('files', self.files),
+        ])
+
+    def write_summary(self, summary_filepath):
+        """Write the summary as json to a file, or to stdout if the path is '-'."""
+        if summary_filepath == '-':
+            json.dump(self.summary(), sys.stdout, indent=2)
+            print()
+        else:
+            with open(summary_filepath, 'w') as summary_file:
+                json.dump(self.summary(), summary_file, indent=2)
+
+
+class NullStats(LoadStats):
+    """Stats that are not kept."""
+    enabled = False
+
+    def __init__(self):
+        pass
+
+    def clock(self):
+        return 0
+
+    def add_time(self, stage, start):
+        return 0
+
+    def add_seconds(self, stage, seconds):
+        pass
+
+    def read(self, n_records=1):
+        pass
+
+    def duplicate(self):
+        pass
+
+    def error(self, error_name):
+        pass
+
+    def add_rows(self, table_rows):
+        pass
+
+    def track_progress(self, source, fraction_read):
+        pass
+
+    def begin_file(self, scrape_filepath):
+        pass
+
+    def end_file(self):
+        pass
+
+
+NULL_STATS = NullStats()
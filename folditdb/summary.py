@@ -0,0 +1,146 @@
+"""Summary tables maintained as solutions are loaded.
+
+Dashboards read per-puzzle and per-player totals from the puzzle_summary
+and player_action_summary tables instead of scanning the solution and
+action tables. The loaders add the solutions and actions they write to
+the summaries in the same transaction:
+
+> add_to_summaries(session, solution_rows, action_rows)
+
+Each batch is totalled in python and then applied to the summary tables
+with one upsert per table, which adds the counts to any existing rows
+and keeps the best score.
+
+The summaries can be recomputed from the raw tables at any time, for
+example after a backfill that bypassed the loaders:
+
+> rebuild_summaries(session)
+"""
+from collections import OrderedDict
+
+from sqlalchemy import func, select, text
+
+from folditdb.tables import Solution, Action, PuzzleSummary, PlayerActionSummary
+
+PUZZLE_COLUMNS = ('puzzle_id', 'solutions', 'best_score', 'total_moves', 'action_n')
+PLAYER_ACTION_COLUMNS = ('player_id', 'action_type_id', 'solutions', 'action_n')
+
+
+def puzzle_totals(solution_rows, action_rows):
+    """Rows for puzzle_summary totalling solution and action rows."""
+    totals = OrderedDict()
+    for row in solution_rows:
+        total = totals.get(row['puzzle_id'])
+        if total is None:
+            total = totals[row['puzzle_id']] = dict(
+                puzzle_id=row['puzzle_id'], solutions=0, best_score=None,
+                total_moves=0, action_n=0)
+        total['solutions'] += 1
+        if row['score'] is not None and (total['best_score'] is None or
+                                         row['score'] > total['best_score']):
+            total['best_score'] = row['score']
+        total['total_moves'] += row['total_moves'] or 0
+
+    for row in action_rows:
+        total = totals.get(row['puzzle_id'])
+        if total is None:
+            total = totals[row['puzzle_id']] = dict(
+                puzzle_id=row['puzzle_id'], solutions=0, best_score=None,
+                total_moves=0, action_n=0)
+        total['action_n'] += row['action_n']
+    return list(totals.values())
+
+
+def player_action_totals(action_rows):
+    """Rows for player_action_summary totalling action rows with type ids."""
+    totals = OrderedDict()
+    for row in action_rows:
+        key = (row['player_id'], row['action_type_id'])
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = dict(player_id=key[0], action_type_id=key[1],
+                                       solutions=0, action_n=0)
+        total['solutions'] += 1
+        total['action_n'] += row['action_n']
+    return list(totals.values())
+
+
+def add_to_summaries(session, solution_rows, action_rows):
+    """Add newly written solutions and actions to the summary tables.
+
+    Action rows must have action_type_id set. The session is not
+    committed.
+    """
+    dialect = session.bind.dialect.name
+    puzzle_rows = puzzle_totals(solution_rows, action_rows)
+    if puzzle_rows:
+        session.execute(increment(PuzzleSummary.__table__.name, PUZZLE_COLUMNS, 1,
+                                  dialect, max_columns=('best_score', )), puzzle_rows)
+    player_action_rows = player_action_totals(action_rows)
+    if player_action_rows:
+        session.execute(increment(PlayerActionSummary.__table__.name, PLAYER_ACTION_COLUMNS,
+                                  2, dialect), player_action_rows)
+
+
+def increment(table_name, columns, n_keys, dialect, max_columns=()):
+    """An upsert that adds to the values of existing rows.
+
+    The first n_keys columns are the primary key. Columns in max_columns
+    keep the larger of the existing and new values instead.
+    """
+    keys, values = columns[:n_keys], columns[n_keys:]
+    insert = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        table_name, ', '.join(columns), ', '.join(':%s' % column for column in columns))
+
+    if dialect == 'mysql':
+        new = 'VALUES(%s)'
+        greatest = 'GREATEST'
+    elif dialect == 'sqlite':
+        new = 'excluded.%s'
+        greatest = 'MAX'
+    else:
+        raise ValueError('summaries are not supported for dialect "%s"' % dialect)
+
+    updates = []
+    for column in values:
+        new_value = new % column
+        if column in max_columns:
+            updates.append('%s = %s(COALESCE(%s, %s), COALESCE(%s, %s))' % (
+                column, greatest, column, new_value, new_value, column))
+        else:
+            updates.append('%s = %s + %s' % (column, column, new_value))
+
+    if dialect == 'mysql':
+        return text('%s ON DUPLICATE KEY UPDATE %s' % (insert, ', '.join(updates)))
+    return text('%s ON CONFLICT (%s) DO UPDATE SET %s' % (
+        insert, ', '.join(keys), ', '.join(updates)))
+
+
+def rebuild_summaries(session):
+    """Recompute the summary tables from the solution and action tables.
+
+    The session is not committed.
+    """
+    puzzles = PuzzleSummary.__table__
+    player_actions = PlayerActionSummary.__table__
+    session.execute(puzzles.delete())
+    session.execute(player_actions.delete())
+
+    session.execute(puzzles.insert().from_select(
+        ['puzzle_id', 'solutions', 'best_score', 'total_moves', 'action_n'],
+        select([Solution.puzzle_id, func.count(Solution.id), func.max(Solution.score),
+                func.coalesce(func.sum(Solution.total_moves), 0), 0])
+        .group_by(Solution.puzzle_id)
+    ))
+    session.execute(puzzles.update().values(action_n=(
+        select([func.coalesce(func.sum(Action.action_n), 0)])
+        .where(Action.puzzle_id == puzzles.c.puzzle_id)
+        .as_scalar()
+    )))
+
+    session.execute(player_actions.insert().from_select(
+        ['player_id', 'action_type_id', 'solutions', 'action_n'],
+        select([Action.player_id, Action.action_type_id, func.count(Action.id),
+                func.sum(Action.action_n)])
+        .group_by(Action.player_id, Action.action_type_id)
+    ))
@@ -8,10 +8,17 @@ for the most common but idiosyncratic ways of creating model
 objects. Placing the constructors on the models, rather
 than on the objects in folditdb.irdata, allows the
 constructor logic to be closest to the model descriptions.
+
+Each constructor has a row_from_* (or rows_from_*) counterpart that
+returns the column values as plain dicts instead of model objects.
+These are used by folditdb.bulk to write rows without going through
+the ORM.
 """
-from sqlalchemy import Table, Column, String, Float, Integer, ForeignKey, Text, DateTime
+from sqlalchemy import (Table, Column, String, Float, Integer, BigInteger, ForeignKey,
+    Text, DateTime, Index, select)
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.hybrid import hybrid_property, Comparator
 
 Base = declarative_base()
 
@@ -21,24 +28,33 @@ class Solution(Base):
     id = Column(Integer, primary_key=True)
     puzzle_id = Column(Integer(), ForeignKey('puzzle.id'))
     history_id = Column(String(40), ForeignKey('history.id'))
-    history_hash = Column(String(64), ForeignKey('history_string.hash'))
+    history_hash = Column(String(64))
     solution_type = Column(String(20))
     total_moves = Column(Integer())
     score = Column(Float())
     timestamp = Column(DateTime())
 
+    # Top solutions to a puzzle
+    __table_args__ = (
+        Index('ix_solution_puzzle_id_score', 'puzzle_id', 'score'),
+    )
+
     @classmethod
     def from_irdata(cls, irdata):
-        data = dict(
+        return cls(**cls.row_from_irdata(irdata))
+
+    @classmethod
+    def row_from_irdata(cls, irdata):
+        return dict(
             id=irdata.solution_id,
             puzzle_id=irdata.puzzle_id,
             history_id=irdata.history_id,
+            history_hash=irdata.history_hash,
             solution_type=irdata.solution_type,
             total_moves=irdata.total_moves,
             score=irdata.score,
             timestamp=irdata.timestamp,
         )
-        return cls(**data)
 
 
 class Puzzle(Base):
@@ -49,36 +65,75 @@ class Puzzle(Base):
 
     @classmethod
     def from_irdata(cls, irdata):
-        return cls(id=irdata.puzzle_id)
+        return cls(**cls.row_from_irdata(irdata))
+
+    @classmethod
+    def row_from_irdata(cls, irdata):
+        return dict(id=irdata.puzzle_id)
 
 
 class History(Base):
+    """A version in a history lineage.
+
+    Each history id in a HISTORY string points to the id before it and
+    holds its own move count, so lineages that share a prefix share the
+    rows for it. HISTORY strings are rebuilt from the chain of parents
+    by folditdb.history.
+
+    parent_id is not a foreign key because the rows for a lineage are
+    written in the same statement as the rows that refer to them. The
+    first row written for an id is kept.
+    """
     __tablename__ = 'history'
     id = Column(String(40), primary_key=True)
+    parent_id = Column(String(40))
+    moves = Column(Integer())
 
     solutions = relationship('Solution')
 
     @classmethod
     def last_from_irdata(cls, irdata):
         """Create a history object for the last history in the string."""
-        last_history_id = irdata.history_string.split(',')[-1].split(':')[0]
-        return cls(id=last_history_id)
+        return cls(**cls.last_row_from_irdata(irdata))
 
     @classmethod
     def from_irdata(cls, irdata):
         """Create a list of History objects from a history string."""
-        history_ids = [x.split(':')[0] for x in irdata.history_string.split(',')]
-        return [cls(id=history_id) for history_id in history_ids]
+        return [cls(**row) for row in cls.rows_from_irdata(irdata)]
+
+    @classmethod
+    def last_row_from_irdata(cls, irdata):
+        return cls.rows_from_irdata(irdata)[-1]
+
+    @classmethod
+    def rows_from_irdata(cls, irdata):
+        """Rows for each history id, oldest first."""
+        ids = irdata.history_ids
+        moves = irdata.history.moves
+        if moves is None:
+            moves = [None] * len(ids)
+        return [dict(id=history_id, parent_id=ids[i - 1] if i else None, moves=moves[i])
+                for i, history_id in enumerate(ids)]
 
 
 class HistoryString(Base):
+    """HISTORY strings that cannot be rebuilt from the history table.
+
+    Well formed strings are not stored, unless the history rows for
+    their ids were first written with other parents or move counts; see
+    IRData.history_rebuildable and folditdb.history.new_history_rows.
+    """
     __tablename__ = 'history_string'
     hash = Column(String(64), primary_key=True)
     history_string = Column(Text)
 
     @classmethod
     def from_irdata(cls, irdata):
-        return cls(hash=irdata.history_hash, history_string=irdata.history_string)
+        return cls(**cls.row_from_irdata(irdata))
+
+    @classmethod
+    def row_from_irdata(cls, irdata):
+        return dict(hash=irdata.history_hash, history_string=irdata.history_string)
 
 
 class Team(Base):
@@ -102,16 +157,21 @@ class Team(Base):
 
     @classmethod
     def from_pdl(cls, pdl):
-        data = dict(
+        return cls(**cls.row_from_pdl(pdl))
+
+    @classmethod
+    def row_from_pdl(cls, pdl):
+        return dict(
             name=pdl.team_name,
             team_type=pdl.team_type,
         )
-        return cls(**data)
 
 
+# The primary key also serves lookups of solutions by player
 player_solutions = Table('player_solutions', Base.metadata,
-    Column('player_id', Integer, ForeignKey('player.id')),
-    Column('solution_id', Integer, ForeignKey('solution.id'))
+    Column('player_id', Integer, ForeignKey('player.id'), primary_key=True),
+    Column('solution_id', Integer, ForeignKey('solution.id'), primary_key=True),
+    Index('ix_player_solutions_solution_id', 'solution_id'),
 )
 
 class Player(Base):
@@ -128,30 +188,122 @@ class Player(Base):
 
     @classmethod
     def from_pdl(cls, pdl):
-        data = dict(
+        return cls(**cls.row_from_pdl(pdl))
+
+    @classmethod
+    def row_from_pdl(cls, pdl):
+        return dict(
             id=pdl.player_id,
             name=pdl.player_name,
             team_name=pdl.team_name
         )
-        return cls(**data)
+
+class ActionType(Base):
+    """The name of each kind of action in an action log, stored once."""
+    __tablename__ = 'action_type'
+    id = Column(Integer(), primary_key=True)
+    name = Column(String(55), unique=True)
+
+
+class ActionNameComparator(Comparator):
+    """Compare Action.action_name by looking up matching action type ids."""
+    def operate(self, op, *other, **kwargs):
+        action_type_ids = select([ActionType.id]).where(op(ActionType.name, *other, **kwargs))
+        return Action.action_type_id.in_(action_type_ids)
+
 
 class Action(Base):
+    """The number of times a player used an action in a solution.
+
+    Action names are stored in the action_type table. The action_name
+    of a new Action is kept on the object until the loader resolves it
+    to an action_type_id, and queries can filter on action_name as if
+    it were a column:
+
+    > session.query(Action).filter_by(action_name='ActionShake')
+    """
     __tablename__ = 'action'
     id = Column(Integer(), primary_key=True)
-    action_name = Column(String(55))
+    action_type_id = Column(Integer(), ForeignKey('action_type.id'))
     action_n = Column(Integer())
     player_id = Column(Integer(), ForeignKey('player.id'))
     puzzle_id = Column(Integer(), ForeignKey('puzzle.id'))
 
+    action_type = relationship('ActionType')
+
+    # Actions by player, and by player and action name
+    __table_args__ = (
+        Index('ix_action_player_id_action_type_id', 'player_id', 'action_type_id'),
+    )
+
+    @hybrid_property
+    def action_name(self):
+        if self.action_type is not None:
+            return self.action_type.name
+        return getattr(self, '_action_name', None)
+
+    @action_name.setter
+    def action_name(self, action_name):
+        self._action_name = action_name
+
+    @action_name.comparator
+    def action_name(cls):
+        return ActionNameComparator(
+            select([ActionType.name])
+            .where(ActionType.id == cls.action_type_id)
+            .as_scalar()
+        )
+
     @classmethod
     def from_pdl(cls, pdl):
-        actions = []
-        for action_log in pdl.action_logs():
-            data = dict(
-                action_name=action_log.action_name,
-                action_n=action_log.action_n,
-                player_id=pdl.player_id,
-                puzzle_id=pdl._irdata.puzzle_id
-            )
-            actions.append(cls(**data))
-        return actions
+        return [cls(**row) for row in cls.rows_from_pdl(pdl)]
+
+    @classmethod
+    def rows_from_pdl(cls, pdl):
+        """Rows with action names, which folditdb.bulk resolves to type ids."""
+        action_names, action_ns = pdl.actions()
+        player_id = pdl.player_id
+        puzzle_id = pdl._irdata.puzzle_id
+        return [dict(action_name=action_name, action_n=action_n,
+                     player_id=player_id, puzzle_id=puzzle_id)
+                for action_name, action_n in zip(action_names, action_ns)]
+
+
+class PuzzleSummary(Base):
+    """Totals for the solutions to a puzzle, kept up to date by the loaders.
+
+    See folditdb.summary.
+    """
+    __tablename__ = 'puzzle_summary'
+    puzzle_id = Column(Integer(), ForeignKey('puzzle.id'), primary_key=True)
+    solutions = Column(Integer())
+    best_score = Column(Float())
+    total_moves = Column(BigInteger())
+    action_n = Column(BigInteger())
+
+
+class PlayerActionSummary(Base):
+    """Totals for each action a player used, kept up to date by the loaders.
+
+    solutions counts the action log entries summed into action_n, one
+    for each solution in which the player used the action.
+    """
+    __tablename__ = 'player_action_summary'
+    player_id = Column(Integer(), ForeignKey('player.id'), primary_key=True)
+    action_type_id = Column(Integer(), ForeignKey('action_type.id'), primary_key=True)
+    solutions = Column(Integer())
+    action_n = Column(BigInteger())
+
+
+class Checkpoint(Base):
+    """How far a scrape file has been loaded.
+
+    The offset is in bytes of scrape data, after decompression, through
+    the end of the last line in a committed batch. Scrape files are
+    keyed by the hash of their absolute path. See folditdb.checkpoint.
+    """
+    __tablename__ = 'checkpoint'
+    hash = Column(String(64), primary_key=True)
+    scrape_file = Column(Text)
+    offset = Column(BigInteger())
+    line = Column(Integer())
@@ -0,0 +1,265 @@
+"""Two-pass backfills through tab separated files.
+
+For a cold backfill into an empty DB, it is much faster to let the DB
+load whole files than to insert rows through SQLAlchemy. The first pass
+streams scrape files through the usual IRData and PDL parsing and
+writes the rows for each table to a .tsv file, with duplicate rows
+removed. The second pass loads each file with LOAD DATA LOCAL INFILE on
+MySQL, in foreign key order.
+
+> dump_tsv_files(['scrape1.json', 'scrape2.json'], 'tsv/')
+> load_tsv_files('tsv/', session)
+
+Rows are deduplicated as the bulk loader would write them: the first
+row for a shared key wins, except for players, where the last one wins.
+Records whose history rows differ from the first rows for their ids
+keep their HISTORY strings in the history_string file.
+Players are held in memory and written at the end of the first pass.
+Action types are numbered in the order their names are first seen.
+
+Files use the MySQL defaults for LOAD DATA: tab separated fields,
+newline terminated lines, backslash escapes and \\N for NULL. The first
+line of each file names its columns. DBs without LOAD DATA, like
+SQLite, are loaded with executemany inserts from the same files.
+
+Secondary indexes are dropped before the second pass and built once
+all the tables are loaded, and then the summary tables are rebuilt.
+
+LOAD DATA LOCAL INFILE must be allowed by the server and by the client,
+which for PyMySQL means connecting with local_infile=True.
+"""
+import logging
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+
+from folditdb import bulk, scrape
+from folditdb.cache import KeyCache
+from folditdb.history import new_history_rows, history_string_row
+from folditdb.irdata import IRData
+from folditdb.migrations import drop_indexes, create_indexes
+from folditdb.query import RESULTS
+from folditdb.summary import rebuild_summaries
+from folditdb.stats import NULL_STATS
+
+logger = logging.getLogger(__name__)
+
+# Rows read from a file at a time when loading with executemany
+INSERT_BATCH_SIZE = 10000
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+NULL = '\\N'
+
+ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'}
+UNESCAPES = {escaped[1]: char for char, escaped in ESCAPES.items()}
+
+ESCAPE_RE = re.compile('[\\\\\t\n\r\0]')
+UNESCAPE_RE = re.compile(r'\\(.)')
+
+
+def tsv_filepath(tsv_dir, table_name):
+    return os.path.join(tsv_dir, '%s.tsv' % table_name)
+
+
+def format_value(value):
+    """Format a value for a TSV file."""
+    if value is None:
+        return NULL
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    return ESCAPE_RE.sub(lambda match: ESCAPES[match.group()], str(value))
+
+
+def parse_value(value_str, python_type=str):
+    """Parse a value from a TSV file into a python type."""
+    if value_str == NULL:
+        return None
+    if '\\' in value_str:
+        value_str = UNESCAPE_RE.sub(lambda match: UNESCAPES.get(match.group(1), match.group(1)),
+                                    value_str)
+    if python_type is datetime:
+        return datetime.strptime(value_str, DATETIME_FORMAT)
+    return python_type(value_str)
+
+
+class TSVWriter:
+    """Write rows of one table to a TSV file, headed by the column names."""
+    def __init__(self, tsv_filepath):
+        self.tsv_filepath = tsv_filepath
+        self.columns = None
+        self.n_rows = 0
+        self._tsv_file = None
+
+    def write(self, row):
+        if self.columns is None:
+            self.columns = tuple(row)
+            self._tsv_file = open(self.tsv_filepath, 'w', encoding='utf-8', newline='\n')
+            self._tsv_file.write('\t'.join(self.columns) + '\n')
+        self._tsv_file.write('\t'.join(format_value(row[column]) for column in self.columns) + '\n')
+        self.n_rows += 1
+
+    def close(self):
+        if self._tsv_file is not None:
+            self._tsv_file.close()
+
+
+def dump_tsv_files(scrape_filepaths, tsv_dir, stats=None):
+    """Write the deduplicated rows in scrape files to a TSV file per table.
+
+    Records that fail to parse or duplicate an earlier solution are
+    logged as errors and skipped. Returns a dict of the number of rows
+    written for each table.
+    """
+    if stats is None:
+        stats = NULL_STATS
+
+    os.makedirs(tsv_dir, exist_ok=True)
+    writers = {name: TSVWriter(tsv_filepath(tsv_dir, name)) for name in bulk.TABLES}
+    keys = KeyCache()
+    players = {}
+    action_type_ids = {}
+    # (parent_id, moves) of the history rows written
+    histories = {}
+
+    try:
+        for scrape_filepath in scrape_filepaths:
+            reader = scrape.ScrapeReader(scrape_filepath)
+            stats.track_progress(scrape_filepath, reader.fraction_read)
+            stats.begin_file(scrape_filepath)
+            for json_bytes in reader:
+                stats.read()
+                try:
+                    rows = bulk.rows_from_irdata(IRData.from_json(json_bytes))
+                except Exception as err:
+                    logger.error('%s:%s %s(%s)', scrape_filepath, reader.line,
+                                 err.__class__.__name__, err)
+                    stats.error(err.__class__.__name__)
+                    continue
+
+                solution_id = bulk.solution_id(rows)
+                if keys.known('solution', solution_id):
+                    logger.error('%s:%s DuplicateIRDataException()', scrape_filepath, reader.line)
+                    stats.duplicate()
+                    continue
+                keys.add('solution', solution_id)
+
+                new_rows, conflict = new_history_rows(rows['history'], histories)
+                if conflict and not rows['history_string']:
+                    rows['history_string'].append(history_string_row(rows['history']))
+                rows['history'] = new_rows
+                _write_rows(rows, writers, keys, players, action_type_ids)
+            stats.end_file()
+
+        for row in players.values():
+            writers['player'].write(row)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return {name: writer.n_rows for name, writer in writers.items() if writer.n_rows}
+
+
+def _write_rows(rows, writers, keys, players, action_type_ids):
+    for name, table_rows in rows.items():
+        if name == 'action':
+            for row in table_rows:
+                action_name = row['action_name']
+                if action_name not in action_type_ids:
+                    action_type_ids[action_name] = len(action_type_ids) + 1
+                    writers['action_type'].write(
+                        dict(id=action_type_ids[action_name], name=action_name))
+                writers[name].write(dict(
+                    action_type_id=action_type_ids[action_name], action_n=row['action_n'],
+                    player_id=row['player_id'], puzzle_id=row['puzzle_id']))
+        elif name == 'player':
+            for row in table_rows:
+                players[row['id']] = row
+        elif name in bulk.SHARED_KEYS:
+            key = bulk.SHARED_KEYS[name]
+            for row in table_rows:
+                if not keys.known(name, row[key]):
+                    keys.add(name, row[key])
+                    writers[name].write(row)
+        else:
+            for row in table_rows:
+                writers[name].write(row)
+
+
+def load_tsv_files(tsv_dir, session):
+    """Load the TSV files written by dump_tsv_files into an empty DB.
+
+    Tables are loaded in foreign key order and committed one at a time.
+    Returns a dict of the number of rows loaded into each table.
+    """
+    dialect = session.bind.dialect.name
+    for name, table in bulk.TABLES.items():
+        if session.execute(table.select().limit(1)).first() is not None:
+            raise ValueError('backfills must be loaded into an empty DB: '
+                             '%s has rows' % name)
+
+    drop_indexes(session.connection())
+    session.commit()
+
+    loaded = {}
+    for name, table in bulk.TABLES.items():
+        filepath = tsv_filepath(tsv_dir, name)
+        if not os.path.exists(filepath):
+            continue
+        if dialect == 'mysql':
+            loaded[name] = _load_data_infile(filepath, table, session)
+        else:
+            loaded[name] = _insert_from_tsv(filepath, table, session)
+        session.commit()
+
+    create_indexes(session.connection())
+    rebuild_summaries(session)
+    session.commit()
+    # Cached query results were computed from the tables before the backfill
+    RESULTS.clear()
+    return loaded
+
+
+def _read_header(filepath):
+    with open(filepath, encoding='utf-8', newline='\n') as tsv_file:
+        return tsv_file.readline().rstrip('\n').split('\t')
+
+
+def _load_data_infile(filepath, table, session):
+    columns = ', '.join('`%s`' % column for column in _read_header(filepath))
+    # Rows were deduplicated when they were written
+    session.execute(text('SET unique_checks = 0, foreign_key_checks = 0'))
+    result = session.execute(text(
+        "LOAD DATA LOCAL INFILE :filepath INTO TABLE `%s` "
+        "CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' "
+        "IGNORE 1 LINES (%s)" % (table.name, columns)
+    ), dict(filepath=os.path.abspath(filepath)))
+    session.execute(text('SET unique_checks = 1, foreign_key_checks = 1'))
+    return result.rowcount
+
+
+def _insert_from_tsv(filepath, table, session):
+    n_rows = 0
+    with open(filepath, encoding='utf-8', newline='\n') as tsv_file:
+        columns = tsv_file.readline().rstrip('\n').split('\t')
+        types = [table.columns[column].type.python_type for column in columns]
+        statement = table.insert()
+
+        batch = []
+        for line in tsv_file:
+            values = line.rstrip('\n').split('\t')
+            batch.append({column: parse_value(value, python_type)
+                          for column, value, python_type in zip(columns, values, types)})
+            if len(batch) == INSERT_BATCH_SIZE:
+                session.execute(statement, batch)
+                n_rows += len(batch)
+                batch = []
+
+        if batch:
+            session.execute(statement, batch)
+            n_rows += len(batch)
+    return n_rows
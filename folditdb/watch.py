@@ -0,0 +1,393 @@
+"""Load single solution files as they arrive in a directory.
+
+The watch daemon waits for solution json files to be written to a
+directory, and loads them with a pool of workers:
+
+> sessions = [new_session(writer=True) for _ in range(4)]
+> watch('incoming', sessions)
+
+New files are noticed with inotify when inotify_simple is installed,
+and by scanning the directory otherwise. A scanned file is only taken
+once its size and modification time are the same in two scans in a row,
+so that files still being written are left alone. Files already in the
+directory when the daemon starts may still be being written too, so
+with either watcher they are scanned and taken the same way.
+
+Files are put in a WorkQueue, a SQLite file next to the watched
+directory, before they are loaded. Each worker claims up to batch_size
+files from the queue and loads them in one transaction, each in its own
+savepoint so that a bad file does not fail the rest. After the
+transaction commits, loaded files are moved to the processed directory
+and files that could not be loaded to the failed directory, and only
+then are they removed from the queue. Files that fail with a DB error,
+such as when two workers add the same player at once, are queued again
+up to MAX_ATTEMPTS times before they are failed.
+
+If the daemon stops at any point, the files it had queued are loaded
+when it starts again, and a file that was loaded but not moved is found
+to be a duplicate and moved to the processed directory.
+"""
+import fnmatch
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from sqlalchemy.exc import DBAPIError
+
+from folditdb.irdata import IRData
+from folditdb.load import load_from_irdata, DuplicateIRDataException
+from folditdb.stats import NULL_STATS
+
+logger = logging.getLogger(__name__)
+
+# Files loaded in one transaction
+BATCH_SIZE = 100
+
+# Seconds between scans of the directory, and between checks of an empty queue
+POLL_INTERVAL = 1.0
+
+# Times a batch is retried after failing to commit before its files are failed
+MAX_ATTEMPTS = 3
+
+PATTERN = '*.json'
+
+
+class WorkQueue:
+    """Paths of files waiting to be loaded, kept in a SQLite file.
+
+    Paths are claimed by workers while they are being loaded, and are
+    removed from the queue once they are done. Claims left by a process
+    that stopped are released by recover. The queue can be shared by
+    threads, but not by processes.
+    """
+    def __init__(self, queue_filepath):
+        self._connection = sqlite3.connect(queue_filepath, timeout=30, isolation_level=None,
+                                           check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        with self._transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS queue ('
+                           'path TEXT PRIMARY KEY, '
+                           'claimed INTEGER NOT NULL DEFAULT 0, '
+                           'attempts INTEGER NOT NULL DEFAULT 0, '
+                           'queued_at REAL NOT NULL)')
+
+    def __len__(self):
+        with self._transaction() as cursor:
+            return cursor.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+    def put(self, paths):
+        """Queue paths that are not queued already."""
+        now = time.time()
+        with self._transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO queue (path, queued_at) VALUES (?, ?)',
+                               [(os.path.abspath(path), now) for path in paths])
+
+    def claim(self, n):
+        """Claim up to n unclaimed paths, oldest first."""
+        with self._transaction() as cursor:
+            paths = [path for path, in cursor.execute(
+                'SELECT path FROM queue WHERE claimed = 0 ORDER BY queued_at, path LIMIT ?',
+                (n, ))]
+            cursor.executemany('UPDATE queue SET claimed = 1 WHERE path = ?',
+                               [(path, ) for path in paths])
+        return paths
+
+    def done(self, paths):
+        """Remove claimed paths from the queue."""
+        with self._transaction() as cursor:
+            cursor.executemany('DELETE FROM queue WHERE path = ?', [(path, ) for path in paths])
+
+    def release(self, paths, max_attempts=MAX_ATTEMPTS):
+        """Release claimed paths to be tried again.
+
+        Returns the paths that have been tried max_attempts times, which
+        are left claimed.
+        """
+        with self._transaction() as cursor:
+            cursor.executemany('UPDATE queue SET attempts = attempts + 1 WHERE path = ?',
+                               [(path, ) for path in paths])
+            exhausted = []
+            for path in paths:
+                attempts, = cursor.execute('SELECT attempts FROM queue WHERE path = ?',
+                                           (path, )).fetchone()
+                if attempts >= max_attempts:
+                    exhausted.append(path)
+            cursor.executemany('UPDATE queue SET claimed = 0 WHERE path = ?',
+                               [(path, ) for path in paths if path not in exhausted])
+        return exhausted
+
+    def recover(self):
+        """Release the paths claimed by a process that stopped."""
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE queue SET claimed = 0')
+
+    def close(self):
+        self._connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            else:
+                cursor.execute('COMMIT')
+            finally:
+                cursor.close()
+
+
+class PollingWatcher:
+    """Find new files by scanning a directory."""
+    def __init__(self, watch_dir, pattern=PATTERN):
+        self.watch_dir = watch_dir
+        self.pattern = pattern
+        # (size, mtime) of files that are not ready, and files that were
+        self._pending = {}
+        self._ready = set()
+
+    def scan(self):
+        """Note the files in the directory, which changes returns once they settle."""
+        self._pending = _signatures(self.watch_dir, self.pattern)
+
+    def changes(self, timeout=POLL_INTERVAL):
+        """Files that are ready since the last call, after waiting timeout seconds."""
+        time.sleep(timeout)
+        files = _signatures(self.watch_dir, self.pattern)
+        ready = []
+        for path, signature in files.items():
+            if path in self._ready:
+                continue
+            if self._pending.get(path) == signature:
+                ready.append(path)
+            self._pending[path] = signature
+        self._ready.intersection_update(files)
+        self._ready.update(ready)
+        self._pending = {path: signature for path, signature in self._pending.items()
+                         if path in files and path not in self._ready}
+        return sorted(ready)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Find new files as they are closed after writing, or moved into a directory."""
+    def __init__(self, watch_dir, pattern=PATTERN):
+        if inotify_simple is None:
+            raise ImportError('watching with inotify requires inotify_simple')
+        self.watch_dir = watch_dir
+        self.pattern = pattern
+        self._inotify = inotify_simple.INotify()
+        flags = inotify_simple.flags
+        self._inotify.add_watch(watch_dir, flags.CLOSE_WRITE | flags.MOVED_TO)
+        # (size, mtime) of files that were in the directory before it was
+        # watched, and are not ready
+        self._pending = {}
+
+    def scan(self):
+        """Note the files in the directory, which changes returns once they settle."""
+        self._pending = _signatures(self.watch_dir, self.pattern)
+
+    def changes(self, timeout=POLL_INTERVAL):
+        """Files closed or moved in since the last call, waiting up to timeout seconds."""
+        events = self._inotify.read(timeout=int(timeout * 1000))
+        ready = set(os.path.join(self.watch_dir, event.name) for event in events
+                    if fnmatch.fnmatch(event.name, self.pattern))
+        if self._pending:
+            files = _signatures(self.watch_dir, self.pattern)
+            ready.update(path for path, signature in self._pending.items()
+                         if files.get(path) == signature)
+            self._pending = {path: files[path] for path in self._pending
+                             if path in files and path not in ready}
+        return sorted(ready)
+
+    def close(self):
+        self._inotify.close()
+
+
+def _signatures(watch_dir, pattern):
+    """The (size, mtime) of each file in a directory that matches a pattern."""
+    files = {}
+    with os.scandir(watch_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def new_watcher(watch_dir, pattern=PATTERN, polling=False):
+    """An InotifyWatcher if inotify_simple is installed, or else a PollingWatcher."""
+    if polling or inotify_simple is None:
+        return PollingWatcher(watch_dir, pattern)
+    return InotifyWatcher(watch_dir, pattern)
+
+
+class Worker(threading.Thread):
+    """Load batches of files claimed from a queue through a session."""
+    def __init__(self, queue, session, processed_dir, failed_dir, stop, batch_size=BATCH_SIZE,
+                 stats=NULL_STATS, poll_interval=POLL_INTERVAL):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.session = session
+        self.processed_dir = processed_dir
+        self.failed_dir = failed_dir
+        self.stop = stop
+        self.batch_size = batch_size
+        self.stats = stats
+        self.poll_interval = poll_interval
+        self.error = None
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                if not self.work():
+                    self.stop.wait(self.poll_interval)
+        except BaseException as err:
+            self.error = err
+
+    def work(self):
+        """Load a batch of files from the queue, and return the number claimed."""
+        paths = self.queue.claim(self.batch_size)
+        if not paths:
+            return 0
+
+        try:
+            processed, failed, retry = load_files(paths, self.session, self.stats)
+        except DBAPIError as err:
+            self.session.rollback()
+            logger.error('%s-%s %s(%s)', paths[0], paths[-1], err.__class__.__name__, err)
+            processed, failed, retry = [], [], paths
+        if retry:
+            failed += self.queue.release(retry)
+
+        for path in processed:
+            move_file(path, self.processed_dir)
+        for path in failed:
+            move_file(path, self.failed_dir)
+        self.queue.done(processed + failed)
+        return len(paths)
+
+
+def load_files(paths, session, stats=NULL_STATS):
+    """Load solution files in one transaction.
+
+    Returns lists of the paths that were loaded, including duplicates of
+    solutions in the DB and files that were already moved, of the paths
+    that could not be loaded, and of the paths that failed with a DB
+    error, which may succeed if they are tried again.
+    """
+    processed, failed, retry = [], [], []
+    for path in paths:
+        stats.read()
+        try:
+            irdata = IRData.from_file(path)
+        except FileNotFoundError:
+            # Moved by an earlier run that stopped before it was done
+            processed.append(path)
+            continue
+        except OSError as err:
+            # Such as a file that cannot be read, or a directory
+            logger.error('%s %s(%s)', path, err.__class__.__name__, err)
+            stats.error(err.__class__.__name__)
+            failed.append(path)
+            continue
+
+        session.begin_nested()
+        try:
+            load_from_irdata(irdata, session, commit=False, stats=stats)
+            session.commit()
+        except Exception as err:
+            session.rollback()
+            logger.error('%s %s(%s)', path, err.__class__.__name__, err)
+            if isinstance(err, DuplicateIRDataException):
+                stats.duplicate()
+                processed.append(path)
+            elif isinstance(err, DBAPIError):
+                # Such as another worker adding the same puzzle or player first
+                retry.append(path)
+            else:
+                stats.error(err.__class__.__name__)
+                failed.append(path)
+        else:
+            processed.append(path)
+
+    start = stats.clock()
+    session.commit()
+    stats.add_time('commit', start)
+    return processed, failed, retry
+
+
+def move_file(path, directory):
+    """Move a file into a directory, without replacing a file with the same name."""
+    if not os.path.exists(path):
+        return
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.basename(path)
+    destination = os.path.join(directory, name)
+    n = 0
+    while os.path.exists(destination):
+        n += 1
+        destination = os.path.join(directory, '%s.%d' % (name, n))
+    shutil.move(path, destination)
+
+
+def watch(watch_dir, sessions, processed_dir=None, failed_dir=None, queue_filepath=None,
+          batch_size=BATCH_SIZE, pattern=PATTERN, polling=False, stats=None, stop=None,
+          poll_interval=POLL_INTERVAL):
+    """Load the files written to a directory with a worker for each session, until stop is set.
+
+    processed_dir and failed_dir default to directories in watch_dir,
+    and the queue to a file beside it. stop is a threading.Event.
+    """
+    if stats is None:
+        stats = NULL_STATS
+    if stop is None:
+        stop = threading.Event()
+    watch_dir = os.path.abspath(watch_dir)
+    if processed_dir is None:
+        processed_dir = os.path.join(watch_dir, 'processed')
+    if failed_dir is None:
+        failed_dir = os.path.join(watch_dir, 'failed')
+    if queue_filepath is None:
+        queue_filepath = watch_dir.rstrip(os.sep) + '.queue.db'
+
+    queue = WorkQueue(queue_filepath)
+    queue.recover()
+    watcher = new_watcher(watch_dir, pattern, polling)
+    watcher.scan()
+
+    workers = [Worker(queue, session, processed_dir, failed_dir, stop, batch_size, stats,
+                      poll_interval)
+               for session in sessions]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while not stop.is_set():
+            paths = watcher.changes(poll_interval)
+            if paths:
+                queue.put(paths)
+            for worker in workers:
+                if worker.error is not None:
+                    raise worker.error
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+        watcher.close()
+        queue.close()
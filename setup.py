@@ -8,6 +8,11 @@ setup(
      'SQLAlchemy==1.2.0',
      'PyMySQL==0.8.0',
     ],
+    extras_require={
+        'fast': ['orjson'],
+        'export': ['pyarrow'],
+        'watch': ['inotify_simple'],
+    },
     entry_points={
         'console_scripts': [
             'folditdb=folditdb.main:main',
@@ -1,7 +1,7 @@
 import folditdb
 from folditdb import tables
 from folditdb.load import load_single_irdata_file
-from folditdb.irdata import IRData, PDL, ActionLog
+from folditdb.irdata import IRData, PDL, ActionLog, parse_pdl, parse_action_log
 from folditdb.tables import Action
 
 
@@ -29,6 +29,19 @@ def test_parse_complex_action_string():
     assert actions[-1].action_name == 'UnknownAction'
     assert actions[-1].action_n == 8
 
+def test_parse_action_log_into_columns():
+    action_str = "Pull_Mode|ACTIVATE=3 |ActionBandDelete=5 |=8 |NoCount"
+    names, counts = parse_action_log(action_str)
+    assert names == ['Pull_ModeACTIVATE', 'ActionBandDelete', 'UnknownAction', 'NoCount']
+    assert list(counts) == [3, 5, 8, 0]
+
+def test_parse_pdl_with_action_log():
+    pdl_str = ". bill1,billteam,802852,0,100.32 LOG: |Action=1 |Other=2."
+    assert parse_pdl(pdl_str) == ('bill1', 'billteam', 802852, 0, '|Action=1 |Other=2')
+
+def test_parse_pdl_without_action_log():
+    assert parse_pdl('. bill,myteam,100,200') == ('bill', 'myteam', 100, 200, None)
+
 def test_actions_are_parsed_from_solution_with_two_players(session):
     load_single_irdata_file('tests/test_data/solution_with_two_players.json', session)
     player = session.query(tables.Player).filter_by(name='Blipperman').first()
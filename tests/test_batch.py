@@ -0,0 +1,40 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from folditdb.tables import Solution
+from folditdb.load import load_top_solutions_from_file
+
+SOLUTIONS_FILE = 'tests/test_data/two_solutions_to_same_puzzle.json'
+
+@pytest.fixture
+def reject_second_solution(session):
+    """Make the DB reject any insert of the solution with id 2."""
+    def reject(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith('INSERT INTO solution'):
+            return
+        for row in (parameters if executemany else [parameters]):
+            values = row.values() if isinstance(row, dict) else row
+            if 2 in values:
+                raise IntegrityError(statement, parameters, Exception('rejected'))
+    event.listen(session.bind, 'before_cursor_execute', reject)
+    yield
+    event.remove(session.bind, 'before_cursor_execute', reject)
+
+def test_load_top_solutions_in_batches(session):
+    load_top_solutions_from_file(SOLUTIONS_FILE, session, batch_size=10)
+    assert session.query(Solution).count() == 2
+
+def test_failed_batch_keeps_good_solutions(tmp_log, session, reject_second_solution):
+    load_top_solutions_from_file(SOLUTIONS_FILE, session, batch_size=10)
+    assert [s.id for s in session.query(Solution)] == [1]
+
+    error_log = open(tmp_log).read()
+    assert '%s:2 IntegrityError' % SOLUTIONS_FILE in error_log
+
+def test_failed_bulk_batch_keeps_good_solutions(tmp_log, session, reject_second_solution):
+    load_top_solutions_from_file(SOLUTIONS_FILE, session, bulk_size=10)
+    assert [s.id for s in session.query(Solution)] == [1]
+
+    error_log = open(tmp_log).read()
+    assert '%s:2 IntegrityError' % SOLUTIONS_FILE in error_log
@@ -0,0 +1,36 @@
+import pytest
+
+from folditdb import bench
+from folditdb.irdata import IRData
+from folditdb.tables import Solution
+from folditdb.load import load_top_solutions_from_file
+
+def test_generated_solutions_are_valid_irdata():
+    for data in bench.generate_solutions(20):
+        irdata = IRData(data)
+        assert Solution.from_irdata(irdata).total_moves >= 0
+
+def test_generated_scrape_file_loads(tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json.gz'))
+    bench.generate_scrape_file(scrape_file, 20)
+    load_top_solutions_from_file(scrape_file, session, bulk_size=10)
+    assert session.query(Solution).count() == 20
+
+def test_run_benchmark_times_each_stage(tmpdir):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 20)
+    results = bench.run_benchmark(scrape_file, batch_size=7)
+    assert results['records'] == 20
+    assert results['errors'] == 0
+    assert list(results['stages']) == list(bench.STAGES)
+
+def test_run_benchmark_needs_an_empty_db_or_reset(tmpdir):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 20)
+    db_url = 'sqlite:///' + str(tmpdir.join('bench.db'))
+    bench.run_benchmark(scrape_file, db_url, batch_size=7)
+    with pytest.raises(ValueError):
+        bench.run_benchmark(scrape_file, db_url, batch_size=7)
+    results = bench.run_benchmark(scrape_file, db_url, batch_size=7, reset=True)
+    assert results['records'] == 20
+    assert results['errors'] == 0
@@ -0,0 +1,58 @@
+from folditdb import bulk
+from folditdb.irdata import IRData
+from folditdb.tables import Base, Solution, Action
+from folditdb.load import load_from_irdata, load_in_bulk, load_top_solutions_from_file
+
+SOLUTION_FILES = [
+    'tests/test_data/single_solution.json',
+    'tests/test_data/soloist_solution.json',
+    'tests/test_data/solution_with_two_players.json',
+    'tests/test_data/top_solution.json',
+    'tests/test_data/multiple_pdls_same_player.json',
+    'tests/test_data/multiple_pdls_same_player_continued.json',
+    'tests/test_data/invalid_char.json',
+    'tests/test_data/value_error.json',
+]
+
+def dump_tables(session):
+    return {name: sorted(session.execute(table.select()).fetchall(), key=repr)
+            for name, table in bulk.TABLES.items()}
+
+def reset_tables(session):
+    session.close()
+    # Forget the action type ids cached for the session
+    session.info.clear()
+    Base.metadata.drop_all(session.bind)
+    Base.metadata.create_all(session.bind)
+
+def test_rows_from_top_solution_include_all_histories():
+    irdata = IRData.from_file('tests/test_data/top_solution.json')
+    rows = bulk.rows_from_irdata(irdata)
+    assert len(rows['history']) == 4
+    assert len(rows['solution']) == 1
+    assert bulk.solution_id(rows) == 181034178
+
+def test_bulk_load_writes_same_rows_as_merge(session):
+    for solution_file in SOLUTION_FILES:
+        try:
+            load_from_irdata(IRData.from_file(solution_file), session)
+        except Exception:
+            session.rollback()
+    merged = dump_tables(session)
+
+    reset_tables(session)
+    irdatas = [IRData.from_file(solution_file) for solution_file in SOLUTION_FILES]
+    load_in_bulk(irdatas, session, bulk_size=3)
+    assert dump_tables(session) == merged
+
+def test_bulk_load_skips_loaded_solutions(session):
+    load_in_bulk([IRData.from_file('tests/test_data/top_solution.json')], session)
+    n_actions = session.query(Action).count()
+    load_in_bulk([IRData.from_file('tests/test_data/top_solution.json')], session)
+    assert session.query(Solution).count() == 1
+    assert session.query(Action).count() == n_actions
+
+def test_load_top_solutions_from_file_in_bulk(session):
+    solutions_file = 'tests/test_data/top_solutions_with_overlapping_histories.json'
+    load_top_solutions_from_file(solutions_file, session, bulk_size=10)
+    assert session.query(Solution).count() == 2
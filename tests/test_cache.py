@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import event
+
+from folditdb.cache import KeyCache, IntSet, LRUSet, TransactionCache
+from folditdb.irdata import IRData
+from folditdb.tables import Solution
+from folditdb.load import load_from_irdata, load_in_bulk, DuplicateIRDataException
+from tests.test_bulk import SOLUTION_FILES, dump_tables, reset_tables
+
+@pytest.fixture
+def statements(session):
+    """Record the SQL statements executed in the session's DB."""
+    executed = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+    event.listen(session.bind, 'before_cursor_execute', record)
+    yield executed
+    event.remove(session.bind, 'before_cursor_execute', record)
+
+def load_solution_files(session, cache=None):
+    for solution_file in SOLUTION_FILES:
+        try:
+            load_from_irdata(IRData.from_file(solution_file), session, cache=cache)
+        except DuplicateIRDataException:
+            pass
+
+def test_int_set():
+    ints = IntSet()
+    ints.add(356820465)
+    ints.add(3)
+    ints.add(3)
+    assert 3 in ints and 356820465 in ints
+    assert 4 not in ints and -3 not in ints
+    assert len(ints) == 2
+
+def test_lru_set_forgets_least_recently_used():
+    keys = LRUSet(max_size=2)
+    keys.add('V1')
+    keys.add('V2')
+    assert 'V1' in keys
+    keys.add('V3')
+    assert 'V2' not in keys
+    assert 'V1' in keys and 'V3' in keys
+
+def test_transaction_caches_must_commit_and_discard_entries():
+    class CommitOnly(TransactionCache):
+        def _commit_entry(self, entry):
+            pass
+
+    with pytest.raises(TypeError):
+        CommitOnly()
+
+def test_load_with_cache_writes_same_rows(session):
+    load_solution_files(session)
+    uncached = dump_tables(session)
+
+    reset_tables(session)
+    load_solution_files(session, cache=KeyCache())
+    assert dump_tables(session) == uncached
+
+    reset_tables(session)
+    load_solution_files(session, cache=KeyCache(max_size=10))
+    assert dump_tables(session) == uncached
+
+    reset_tables(session)
+    cache = KeyCache()
+    cache.seed(session)
+    load_solution_files(session, cache=cache)
+    assert dump_tables(session) == uncached
+
+def test_bulk_load_with_cache_writes_same_rows(session):
+    irdatas = [IRData.from_file(solution_file) for solution_file in SOLUTION_FILES]
+    load_in_bulk(irdatas, session, bulk_size=3)
+    uncached = dump_tables(session)
+
+    reset_tables(session)
+    load_in_bulk(irdatas, session, bulk_size=3, cache=KeyCache())
+    assert dump_tables(session) == uncached
+
+def test_seeded_cache_skips_existence_queries(session, statements):
+    cache = KeyCache()
+    cache.seed(session)
+    del statements[:]
+    irdata = IRData.from_file('tests/test_data/top_solution.json')
+    load_from_irdata(irdata, session, cache=cache)
+    with pytest.raises(DuplicateIRDataException):
+        load_from_irdata(irdata, session, cache=cache)
+    assert not [s for s in statements if s.startswith('SELECT')]
+
+def test_cache_forgets_keys_that_are_rolled_back(session):
+    cache = KeyCache()
+    irdata = IRData.from_file('tests/test_data/top_solution.json')
+    load_from_irdata(irdata, session, commit=False, cache=cache)
+    assert cache.known('solution', irdata.solution_id)
+    session.rollback()
+    assert not cache.known('solution', irdata.solution_id)
+    assert not cache.known('history', irdata.history_id)
+
+    load_from_irdata(irdata, session, cache=cache)
+    assert session.query(Solution).count() == 1
+    assert cache.known('history', irdata.history_id)
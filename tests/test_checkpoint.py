@@ -0,0 +1,57 @@
+import gzip
+
+import pytest
+
+from folditdb.checkpoint import load_checkpoint
+from folditdb.load import load_top_solutions_from_file
+from folditdb.parallel import load_in_parallel
+from folditdb.stats import LoadStats
+from folditdb.tables import Solution
+
+TWO_SOLUTIONS = 'tests/test_data/two_solutions_to_same_puzzle.json'
+OVERLAPPING_HISTORIES = 'tests/test_data/top_solutions_with_overlapping_histories.json'
+SOLUTIONS_WITH_ERRORS = 'tests/test_data/solutions_with_errors.json'
+
+def write_scrape_file(scrape_file, *solution_files, mode='wb'):
+    opener = gzip.open if scrape_file.endswith('.gz') else open
+    with opener(scrape_file, mode) as f:
+        for solution_file in solution_files:
+            f.write(open(solution_file, 'rb').read())
+
+@pytest.mark.parametrize('kwargs', [
+    dict(batch_size=1),
+    dict(bulk_size=10),
+])
+@pytest.mark.parametrize('suffix', ['.json', '.json.gz'])
+def test_resume_reads_only_new_lines(tmp_log, tmpdir, session, kwargs, suffix):
+    scrape_file = str(tmpdir.join('scrape' + suffix))
+    write_scrape_file(scrape_file, TWO_SOLUTIONS)
+    load_top_solutions_from_file(scrape_file, session, checkpoint=True, **kwargs)
+    assert load_checkpoint(session, scrape_file) == (len(open(TWO_SOLUTIONS, 'rb').read()), 2)
+
+    write_scrape_file(scrape_file, OVERLAPPING_HISTORIES, SOLUTIONS_WITH_ERRORS, mode='ab')
+    stats = LoadStats()
+    load_top_solutions_from_file(scrape_file, session, resume=True, stats=stats, **kwargs)
+    assert stats.records == 3
+    assert stats.duplicates == 0
+    assert session.query(Solution).count() == 4
+    assert load_checkpoint(session, scrape_file)[1] == 5
+    assert '%s:5 IRDataPropertyError' % scrape_file in open(tmp_log).read()
+
+def test_no_checkpoint_for_new_file(session):
+    assert load_checkpoint(session, 'scrape.json') == (0, 0)
+
+def test_resume_in_parallel(tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    write_scrape_file(scrape_file, TWO_SOLUTIONS)
+    load_in_parallel([scrape_file], session, workers=2, chunk_size=10, checkpoint=True)
+    assert load_checkpoint(session, scrape_file) == (len(open(TWO_SOLUTIONS, 'rb').read()), 2)
+
+    write_scrape_file(scrape_file, OVERLAPPING_HISTORIES, mode='ab')
+    stats = LoadStats()
+    load_in_parallel([scrape_file], session, workers=2, chunk_size=10, resume=True,
+                     stats=stats)
+    assert stats.records == 2
+    assert stats.duplicates == 0
+    assert session.query(Solution).count() == 4
+    assert load_checkpoint(session, scrape_file)[1] == 4
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+from sqlalchemy import event
+
+from folditdb.cache import IntSet
+from folditdb.load import load_top_solutions_from_file, stage_claims
+from folditdb.parallel import load_in_parallel
+from folditdb.stats import LoadStats
+from folditdb.tables import Solution
+
+TWO_SOLUTIONS = 'tests/test_data/two_solutions_to_same_puzzle.json'
+OVERLAPPING_HISTORIES = 'tests/test_data/top_solutions_with_overlapping_histories.json'
+
+@pytest.fixture
+def overlapping_scrapes(tmpdir):
+    """Two scrape files that share a solution."""
+    first, second = str(tmpdir.join('first.json')), str(tmpdir.join('second.json'))
+    with open(first, 'w') as f:
+        f.write(open(TWO_SOLUTIONS).read())
+    with open(second, 'w') as f:
+        f.write(open(TWO_SOLUTIONS).readlines()[1])
+        f.write(open(OVERLAPPING_HISTORIES).read())
+    return first, second
+
+def count_solution_queries(session):
+    queries = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT') and 'solution' in statement:
+            queries.append(statement)
+    event.listen(session.bind, 'before_cursor_execute', before_cursor_execute)
+    return queries
+
+@pytest.mark.parametrize('kwargs', [
+    dict(batch_size=1),
+    dict(bulk_size=10),
+])
+def test_claimed_solutions_are_skipped_without_a_query(overlapping_scrapes, session, kwargs):
+    first, second = overlapping_scrapes
+    claimed, stats = IntSet(), LoadStats()
+    load_top_solutions_from_file(first, session, claimed=claimed, **kwargs)
+
+    queries = count_solution_queries(session)
+    load_top_solutions_from_file(second, session, claimed=claimed, stats=stats, **kwargs)
+    assert stats.duplicates == 1
+    assert session.query(Solution).count() == 4
+    n_new = 2 if 'batch_size' in kwargs else 1
+    assert len(queries) == n_new + 1
+
+def test_claimed_solutions_in_parallel(overlapping_scrapes, session):
+    stats = LoadStats()
+    load_in_parallel(overlapping_scrapes, session, workers=2, claimed=IntSet(), stats=stats)
+    assert stats.duplicates == 1
+    assert session.query(Solution).count() == 4
+
+def test_parallel_loads_largest_file_first_and_reports_each_file(overlapping_scrapes, session):
+    first, second = overlapping_scrapes
+    stats = LoadStats()
+    load_in_parallel([first, second], session, workers=2, stats=stats)
+    assert list(stats.files) == [second, first]
+    assert stats.files[second]['records'] == 3
+    assert stats.summary()['files'][first]['records'] == 2
+
+@pytest.mark.parametrize('kwargs', [
+    dict(batch_size=1),
+    dict(bulk_size=10),
+])
+def test_solutions_that_fail_are_not_claimed(tmpdir, tmp_log, session, solution_data, kwargs):
+    invalid = {key: value for key, value in solution_data.items() if key != 'HISTORY'}
+    first, second = str(tmpdir.join('first.json')), str(tmpdir.join('second.json'))
+    tmpdir.join('first.json').write(json.dumps(invalid) + '\n')
+    tmpdir.join('second.json').write(json.dumps(solution_data) + '\n')
+
+    claimed = IntSet()
+    load_top_solutions_from_file(first, session, claimed=claimed, **kwargs)
+    assert 1 not in claimed
+    load_top_solutions_from_file(second, session, claimed=claimed, **kwargs)
+    assert 1 in claimed
+    assert session.query(Solution).count() == 1
+    assert 'DuplicateIRDataException' not in open(tmp_log).read()
+
+def test_claims_are_dropped_when_the_session_rolls_back(session):
+    claimed = IntSet()
+    stage_claims(session, claimed, [1])
+    session.begin_nested()
+    stage_claims(session, claimed, [2])
+    session.rollback()
+    session.commit()
+    stage_claims(session, claimed, [3])
+    session.rollback()
+    assert (1 in claimed, 2 in claimed, 3 in claimed) == (True, False, False)
@@ -1,8 +1,15 @@
+import os
+import subprocess
+import sys
+
 import pytest
+from sqlalchemy import create_engine, inspect
 
 from folditdb.irdata import IRData, PDL
 from folditdb.tables import Solution, Player
 from folditdb.load import load_from_irdata, load_single_irdata_file, load_top_solutions_from_file, DuplicateIRDataException
+from folditdb.main import main
+from folditdb import db
 
 def test_load_irdata_in_db(irdata, session):
     load_from_irdata(irdata, session)
@@ -52,3 +59,31 @@ def test_load_soloist_solution_from_file(session):
     load_single_irdata_file(solution_file, session)
     solution = session.query(Solution).first()
     assert solution.id == 356818458
+
+def test_importing_does_not_connect():
+    env = {name: value for name, value in os.environ.items() if name != 'MYSQL_FOLDIT_DB'}
+    script = '\n'.join([
+        'import sys',
+        'import folditdb.main',
+        'assert "sqlalchemy" not in sys.modules, "the CLI imports SQLAlchemy up front"',
+        'import folditdb.load',
+        'from folditdb import db',
+        'assert not db._engines',
+    ])
+    subprocess.run([sys.executable, '-c', script], env=env, check=True)
+
+def test_init_db_creates_tables(tmpdir):
+    db_url = 'sqlite:///%s' % tmpdir.join('new.db')
+    main(['init-db', '--db-url', db_url])
+    tables = inspect(create_engine(db_url)).get_table_names()
+    assert 'solution' in tables and 'player_solutions' in tables
+
+def test_engines_are_cached_by_pool_options(tmpdir):
+    url = 'sqlite:///%s' % tmpdir.join('pool.db')
+    assert db.get_engine(url) is db.get_engine(url, pool_pre_ping=True)
+    assert db.get_engine(url, pool_recycle=60) is not db.get_engine(url)
+    assert db.get_engine(url, pool_recycle=60).pool._recycle == 60
+    # local_infile only changes MySQL engines
+    assert db.get_engine(url, local_infile=True) is db.get_engine(url)
+    with pytest.raises(TypeError):
+        db.get_engine(url, pool_size_max=1)
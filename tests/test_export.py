@@ -0,0 +1,111 @@
+import json
+
+import pytest
+from sqlalchemy import func
+
+from folditdb import bench
+from folditdb.irdata import IRData
+from folditdb.load import load_top_solutions_from_file, load_from_irdata
+from folditdb.tables import Solution, Action, Player, player_solutions
+from folditdb.parquet import export_tables, convert_scrape_files
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.dataset
+
+def read_export(export_dir, name):
+    return pyarrow.dataset.dataset('%s/%s' % (export_dir, name), format='parquet',
+                                   partitioning='hive').to_table()
+
+def split_scrape_file(tmpdir, n_records):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, n_records)
+    lines = open(scrape_file).readlines()
+    first, second = str(tmpdir.join('first.json')), str(tmpdir.join('second.json'))
+    open(first, 'w').writelines(lines[:n_records // 2])
+    open(second, 'w').writelines(lines[n_records // 2:])
+    return first, second
+
+def test_export_tables_partitioned_by_puzzle(tmpdir, session):
+    first, _ = split_scrape_file(tmpdir, 100)
+    load_top_solutions_from_file(first, session, bulk_size=50)
+    export_dir = str(tmpdir.join('export'))
+
+    exported = export_tables(session, export_dir, batch_size=7)
+    assert exported['solution'] == session.query(Solution).count()
+    assert exported['action'] == session.query(Action).count()
+    assert exported['player'] == session.query(Player).count()
+
+    solutions = read_export(export_dir, 'solution')
+    assert sorted(solutions.column('id').to_pylist()) == sorted(
+        sid for (sid, ) in session.query(Solution.id))
+    assert tmpdir.join('export', 'solution', 'puzzle_id=1').check(dir=True)
+
+    actions = read_export(export_dir, 'action').to_pylist()
+    assert {row['action_name'] for row in actions} == {
+        action.action_name for action in session.query(Action)}
+
+def test_export_is_incremental(tmpdir, session):
+    first, second = split_scrape_file(tmpdir, 100)
+    export_dir = str(tmpdir.join('export'))
+
+    load_top_solutions_from_file(first, session, bulk_size=50)
+    first_export = export_tables(session, export_dir)
+    load_top_solutions_from_file(second, session, bulk_size=50)
+    second_export = export_tables(session, export_dir)
+    assert first_export['solution'] == second_export['solution'] == 50
+    assert export_tables(session, export_dir)['solution'] == 0
+
+    assert read_export(export_dir, 'solution').num_rows == session.query(Solution).count()
+    assert read_export(export_dir, 'action').num_rows == session.query(Action).count()
+    n_links = session.query(func.count()).select_from(player_solutions).scalar()
+    assert read_export(export_dir, 'player_solutions').num_rows == n_links
+    assert read_export(export_dir, 'player').num_rows == session.query(Player).count()
+
+    assert export_tables(session, export_dir, full=True)['solution'] == 100
+    assert read_export(export_dir, 'solution').num_rows == 100
+
+def test_export_includes_solutions_loaded_later_with_the_last_timestamp(tmpdir, session,
+                                                                        solution_data):
+    first, _ = split_scrape_file(tmpdir, 20)
+    export_dir = str(tmpdir.join('export'))
+    load_top_solutions_from_file(first, session)
+    assert export_tables(session, export_dir)['solution'] == 10
+
+    last_timestamp = json.loads(open(first).readlines()[-1])['TIMESTAMP']
+    load_from_irdata(IRData(dict(solution_data, SID='100000', TIMESTAMP=last_timestamp)),
+                     session)
+    exported = export_tables(session, export_dir)
+    assert exported['solution'] == exported['player_solutions'] == 1
+    assert export_tables(session, export_dir)['solution'] == 0
+    assert read_export(export_dir, 'solution').num_rows == 11
+
+def test_convert_scrape_files_matches_db(tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 100)
+    with open(scrape_file, 'a') as f:
+        f.write(open('tests/test_data/solutions_with_errors.json').read())
+        f.write(open(scrape_file).readline())
+    load_top_solutions_from_file(scrape_file, session, bulk_size=50)
+
+    out_dir = str(tmpdir.join('parquet'))
+    written = convert_scrape_files([scrape_file], out_dir, batch_size=30)
+    assert written['solution'] == session.query(Solution).count()
+    assert written['action'] == session.query(Action).count()
+    n_links = session.query(func.count()).select_from(player_solutions).scalar()
+    assert written['player_solution'] >= n_links
+
+    solutions = read_export(out_dir, 'solution').to_pylist()
+    scores = {row['id']: row['score'] for row in solutions}
+    assert scores == dict(session.query(Solution.id, Solution.score))
+
+    actions = read_export(out_dir, 'action')
+    assert pyarrow.types.is_dictionary(actions.schema.field('action_name').type)
+    totals = {}
+    for row in actions.to_pylist():
+        key = (row['player_id'], str(row['action_name']))
+        totals[key] = totals.get(key, 0) + row['action_n']
+    db_totals = {}
+    for action in session.query(Action):
+        key = (action.player_id, action.action_name)
+        db_totals[key] = db_totals.get(key, 0) + action.action_n
+    assert totals == db_totals
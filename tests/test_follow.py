@@ -0,0 +1,149 @@
+import json
+import os
+
+import pytest
+
+from folditdb import bench
+from folditdb.checkpoint import load_checkpoint
+from folditdb.db import new_session
+from folditdb.follow import FileTail, Follower
+from folditdb.tables import Puzzle, Solution
+
+@pytest.fixture
+def scrape_lines():
+    return [json.dumps(data).encode('utf-8') + b'\n'
+            for data in bench.generate_solutions(12)]
+
+def append(filepath, *lines):
+    with open(filepath, 'ab') as scrape_file:
+        scrape_file.write(b''.join(lines))
+
+def loaded_ids(session):
+    return sorted(solution_id for solution_id, in session.query(Solution.id))
+
+def test_tail_only_reads_finished_lines(tmpdir):
+    filepath = str(tmpdir.join('scrape.json'))
+    tail = FileTail(filepath)
+    assert tail.read_lines() == []
+
+    append(filepath, b'{"a": 1}\n{"b"')
+    assert tail.read_lines() == [(1, 9, b'{"a": 1}')]
+    append(filepath, b': 2}\n')
+    assert tail.read_lines() == [(2, 18, b'{"b": 2}')]
+    assert tail.read_lines() == []
+    tail.close()
+
+def test_tail_reads_at_most_max_lines(tmpdir):
+    filepath = str(tmpdir.join('scrape.json'))
+    append(filepath, b'1\n22\n333\n4444\n5')
+    tail = FileTail(filepath, chunk_size=4)
+    assert tail.read_lines(max_lines=1) == [(1, 2, b'1')]
+    assert tail.read_lines(max_lines=2) == [(2, 5, b'22'), (3, 9, b'333')]
+    assert tail.read_lines(max_lines=2) == [(4, 14, b'4444')]
+    assert not tail.rotated()
+    assert tail.read_lines(final=True, max_lines=2) == [(5, 15, b'5')]
+    tail.close()
+
+def test_follower_polls_bulk_size_lines_at_a_time(tmpdir, session, scrape_lines):
+    filepath = str(tmpdir.join('scrape.json'))
+    append(filepath, *scrape_lines)
+    follower = Follower([filepath], session, bulk_size=5, max_delay=60)
+    assert [follower.poll() for _ in range(4)] == [5, 5, 2, 0]
+    follower.close()
+    assert len(loaded_ids(session)) == len(scrape_lines)
+
+def test_follower_commits_every_bulk_size_records(tmpdir, session, scrape_lines):
+    filepath = str(tmpdir.join('scrape.json'))
+    follower = Follower([filepath], session, bulk_size=2, max_delay=60)
+
+    append(filepath, *scrape_lines[:3])
+    append(filepath, scrape_lines[3][:10])
+    assert follower.poll() == 2
+    assert follower.poll() == 1
+    assert loaded_ids(session) == [1, 2]
+
+    follower.flush()
+    assert loaded_ids(session) == [1, 2, 3]
+    assert load_checkpoint(session, filepath) == (sum(map(len, scrape_lines[:3])), 3)
+
+    append(filepath, scrape_lines[3][10:])
+    follower.poll()
+    follower.close()
+    assert loaded_ids(session) == [1, 2, 3, 4]
+
+def test_follower_commits_after_max_delay(tmpdir, session, scrape_lines):
+    filepath = str(tmpdir.join('scrape.json'))
+    follower = Follower([filepath], session, bulk_size=100, max_delay=0)
+    append(filepath, scrape_lines[0])
+    follower.poll()
+    assert loaded_ids(session) == [1]
+    follower.close()
+
+def test_follower_resumes_from_checkpoint(tmpdir, tmp_log, session, scrape_lines):
+    filepath = str(tmpdir.join('scrape.json'))
+    append(filepath, *scrape_lines[:2])
+    follower = Follower([filepath], session)
+    follower.poll()
+    follower.close()
+
+    append(filepath, *scrape_lines[2:4])
+    follower = Follower([filepath], session)
+    follower.poll()
+    follower.close()
+    assert loaded_ids(session) == [1, 2, 3, 4]
+    assert 'DuplicateIRDataException' not in open(tmp_log).read()
+
+def test_follower_reads_rotated_files_to_the_end(tmpdir, tmp_log, session, scrape_lines):
+    filepath = str(tmpdir.join('scrape.json'))
+    append(filepath, *scrape_lines[:2])
+    follower = Follower([filepath], session)
+    follower.poll()
+
+    # The scraper finishes a line in the old file before it is replaced
+    append(filepath, scrape_lines[2])
+    os.rename(filepath, filepath + '.1')
+    append(filepath + '.1', scrape_lines[3])
+    append(filepath, *scrape_lines[4:6])
+    follower.poll()
+    follower.close()
+
+    assert loaded_ids(session) == [1, 2, 3, 4, 5, 6]
+    assert load_checkpoint(session, filepath) == (sum(map(len, scrape_lines[4:6])), 2)
+    assert 'DuplicateIRDataException' not in open(tmp_log).read()
+
+def test_follower_restarts_truncated_files(tmpdir, session, scrape_lines):
+    filepath = str(tmpdir.join('scrape.json'))
+    append(filepath, *scrape_lines[:3])
+    follower = Follower([filepath], session)
+    follower.poll()
+
+    with open(filepath, 'wb') as scrape_file:
+        scrape_file.write(scrape_lines[3])
+    follower.poll()
+    follower.close()
+    assert loaded_ids(session) == [1, 2, 3, 4]
+
+def test_checkpoints_that_do_not_fit_are_ignored(tmpdir, session, scrape_lines):
+    filepath = str(tmpdir.join('scrape.json'))
+    append(filepath, *scrape_lines[:3])
+    follower = Follower([filepath], session)
+    follower.poll()
+    follower.close()
+
+    # Rotated while nothing was following it
+    os.remove(filepath)
+    append(filepath, *scrape_lines[5:12])
+    follower = Follower([filepath], session)
+    follower.poll()
+    follower.close()
+    assert loaded_ids(session) == [1, 2, 3, 6, 7, 8, 9, 10, 11, 12]
+
+def test_follower_does_not_hold_a_transaction_open(tmpdir, session):
+    follower = Follower([str(tmpdir.join('scrape.json'))], session)
+    other = new_session(session.bind.url)
+    other.add(Puzzle(id=1))
+    other.commit()
+    other.close()
+    # A transaction left open would still read from before the commit
+    assert session.query(Puzzle).count() == 1
+    follower.close()
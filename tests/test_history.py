@@ -0,0 +1,66 @@
+import pytest
+from sqlalchemy import text
+
+from folditdb import bench
+from folditdb.history import history_string, lineage, HistoryRebuildError
+from folditdb.irdata import IRData
+from folditdb.load import load_from_irdata, load_in_bulk, load_top_solutions_from_file
+from folditdb.migrations import migrate
+from folditdb.tables import Solution, History, HistoryString
+
+def test_histories_point_to_their_parents(irdata, session):
+    load_from_irdata(irdata, session)
+    assert lineage(session, 'V3') == [('V0', 0), ('V1', 10), ('V2', 5), ('V3', 4)]
+    assert session.query(HistoryString).count() == 0
+
+def test_history_strings_are_rebuilt(tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 200)
+    load_top_solutions_from_file(scrape_file, session, bulk_size=50)
+
+    strings = {irdata.solution_id: irdata.history_string
+               for irdata in IRData.from_scrape_file(scrape_file)}
+    for solution in session.query(Solution):
+        assert history_string(session, solution) == strings[solution.id]
+    assert session.query(HistoryString).count() == 0
+
+def test_history_strings_that_cannot_be_rebuilt_are_stored(solution_data, session):
+    load_from_irdata(IRData(dict(solution_data, HISTORY='V0:0,V1:10,V1:5')), session)
+    solution = session.query(Solution).one()
+    assert history_string(session, solution) == 'V0:0,V1:10,V1:5'
+
+@pytest.mark.parametrize('load', [
+    lambda irdatas, session: [load_from_irdata(irdata, session) for irdata in irdatas],
+    lambda irdatas, session: load_in_bulk(irdatas, session, bulk_size=2),
+    lambda irdatas, session: load_in_bulk(irdatas, session, bulk_size=1),
+])
+def test_history_strings_with_conflicting_parents_are_stored(load, solution_data, session):
+    strings = {1000: 'V0:0,V1:10,V2:5,V3:6', 1001: 'V9:0,V1:10,V2:5,V7:3'}
+    load([IRData(dict(solution_data, SID=str(solution_id), HISTORY=string))
+          for solution_id, string in sorted(strings.items())], session)
+
+    for solution in session.query(Solution):
+        assert history_string(session, solution) == strings[solution.id]
+    assert session.query(History).filter_by(id='V1').one().parent_id == 'V0'
+    assert session.query(HistoryString).count() == 1
+
+def test_rebuilt_history_is_checked_against_hash(irdata, session):
+    load_from_irdata(irdata, session)
+    session.query(History).filter_by(id='V1').update(dict(moves=11))
+    with pytest.raises(HistoryRebuildError):
+        history_string(session, session.query(Solution).one())
+
+def test_history_strings_migrate_to_chains(irdata, session):
+    load_from_irdata(irdata, session)
+    engine = session.bind
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE history'))
+        connection.execute(text('CREATE TABLE history (id VARCHAR(40) PRIMARY KEY)'))
+        connection.execute(text("INSERT INTO history (id) VALUES ('V3')"))
+        connection.execute(text(
+            "INSERT INTO history_string (hash, history_string) VALUES (:hash, :string)"),
+            dict(hash=irdata.history_hash, string=irdata.history_string))
+
+    assert migrate(engine) == ['history_chains']
+    assert session.query(HistoryString).count() == 0
+    assert history_string(session, session.query(Solution).one()) == irdata.history_string
@@ -29,3 +29,23 @@ def test_error_when_solution_without_history():
     irdata = IRData.from_file('tests/test_data/solution_without_history.json')
     with pytest.raises(IRDataPropertyError):
         tables.Solution.from_irdata(irdata)
+
+def test_irdata_history_is_parsed_once(irdata):
+    assert irdata.history is irdata.history
+    assert irdata.history_ids == ['V0', 'V1', 'V2', 'V3']
+    assert list(irdata.history.moves) == [0, 10, 5, 4]
+
+def test_irdata_has_no_instance_dict(irdata):
+    assert not hasattr(irdata, '__dict__')
+
+def test_unparseable_moves_only_fail_total_moves():
+    irdata = IRData(dict(HISTORY='V1:10,V2:x,V3:4', FILEPATH='/all/solution.pdb'))
+    assert irdata.history_id == 'V3'
+    with pytest.raises(IRDataPropertyError):
+        irdata.total_moves
+
+def test_unparseable_last_history_id():
+    irdata = IRData(dict(HISTORY='V1:10,V2', FILEPATH='/all/solution.pdb'))
+    assert irdata.history_ids == ['V1', 'V2']
+    with pytest.raises(IRDataPropertyError):
+        irdata.history_id
@@ -0,0 +1,49 @@
+from sqlalchemy import text
+
+from folditdb.migrations import (migrate, drop_indexes, create_indexes, secondary_indexes,
+    deferrable_indexes)
+from folditdb.tables import Action, player_solutions
+
+def test_action_names_move_to_action_types(session):
+    engine = session.bind
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE action'))
+        connection.execute(text(
+            'CREATE TABLE action (id INTEGER PRIMARY KEY, action_name VARCHAR(55), '
+            'action_n INTEGER, player_id INTEGER, puzzle_id INTEGER)'))
+        connection.execute(text(
+            "INSERT INTO action (action_name, action_n, player_id, puzzle_id) VALUES "
+            "('ActionShake', 3, 1, 1), ('ActionTweak', 5, 1, 1), ('ActionShake', 7, 2, 1)"))
+
+    # The recreated action table is also missing its index
+    assert migrate(engine) == ['action_types', 'indexes']
+    assert migrate(engine) == []
+
+    shakes = session.query(Action).filter_by(action_name='ActionShake').all()
+    assert sorted(action.action_n for action in shakes) == [3, 7]
+    assert shakes[0].action_name == 'ActionShake'
+
+def test_player_solutions_get_a_key_and_indexes(session):
+    engine = session.bind
+    with engine.begin() as connection:
+        connection.execute(text('DROP TABLE player_solutions'))
+        connection.execute(text(
+            'CREATE TABLE player_solutions (player_id INTEGER, solution_id INTEGER)'))
+        connection.execute(text(
+            'INSERT INTO player_solutions (player_id, solution_id) VALUES (1, 1), (1, 1), (2, 1)'))
+
+    assert migrate(engine) == ['player_solutions_key']
+    assert migrate(engine) == []
+    assert len(session.execute(player_solutions.select()).fetchall()) == 2
+
+def test_indexes_can_be_built_after_loading(session):
+    names = sorted(index.name for index in secondary_indexes())
+    with session.bind.begin() as connection:
+        assert sorted(drop_indexes(connection)) == names
+        assert drop_indexes(connection) == []
+        assert sorted(create_indexes(connection)) == names
+
+def test_indexes_that_back_foreign_keys_are_kept_on_mysql():
+    # InnoDB would refuse to drop these with error 1553
+    assert deferrable_indexes('mysql') == []
+    assert deferrable_indexes('sqlite') == secondary_indexes()
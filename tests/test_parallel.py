@@ -0,0 +1,84 @@
+from folditdb.tables import Solution, History
+from folditdb.parallel import split_scrape_file, parse_chunk, parse_in_order, load_in_parallel
+from folditdb.load import load_top_solutions_from_file
+from tests.test_bulk import dump_tables, reset_tables
+
+OVERLAPPING_HISTORIES = 'tests/test_data/top_solutions_with_overlapping_histories.json'
+TWO_SOLUTIONS = 'tests/test_data/two_solutions_to_same_puzzle.json'
+
+def test_split_scrape_file_at_line_boundaries():
+    chunks = split_scrape_file(TWO_SOLUTIONS, chunk_size=10)
+    assert len(chunks) == 2
+    assert chunks[0][0] == 0
+    assert chunks[0][1] == chunks[1][0]
+
+    data = open(TWO_SOLUTIONS, 'rb').read()
+    assert chunks[-1][1] == len(data)
+    assert data[chunks[0][1]-1:chunks[0][1]] == b'\n'
+
+def test_parse_chunk():
+    start, end = split_scrape_file(OVERLAPPING_HISTORIES)[0]
+    n_lines, end_offset, records, errors, _ = parse_chunk((OVERLAPPING_HISTORIES, start, end))
+    assert n_lines == 2
+    assert end_offset == end
+    assert [line for line, _, _ in records] == [1, 2]
+    assert records[-1][1] == end
+    assert errors == []
+
+def test_parse_chunk_stops_at_the_end_of_a_truncated_file(tmpdir):
+    scrape_file = tmpdir.join('scrape.json')
+    scrape_file.write_binary(open(TWO_SOLUTIONS, 'rb').read())
+    start, end = split_scrape_file(str(scrape_file))[0]
+    first_line = open(TWO_SOLUTIONS, 'rb').readline()
+    scrape_file.write_binary(first_line)
+    n_lines, end_offset, records, _, _ = parse_chunk((str(scrape_file), start, end))
+    assert (n_lines, end_offset, len(records)) == (1, len(first_line), 1)
+
+class InlinePool:
+    """Runs tasks when their results are asked for, counting the tasks handed over."""
+    def __init__(self):
+        self.submitted = self.taken = self.most_ahead = 0
+
+    def apply_async(self, func, args):
+        self.submitted += 1
+        self.most_ahead = max(self.most_ahead, self.submitted - self.taken)
+        pool = self
+
+        class Result:
+            def get(self):
+                pool.taken += 1
+                return func(*args)
+        return Result()
+
+def test_parse_in_order_hands_over_a_window_of_chunks():
+    chunks = [(TWO_SOLUTIONS, start, end)
+              for start, end in split_scrape_file(TWO_SOLUTIONS, chunk_size=10)] * 5
+    pool = InlinePool()
+    results = list(parse_in_order(pool, chunks, 3))
+    assert [end_offset for _, end_offset, _, _, _ in results] == [end for _, _, end in chunks]
+    assert pool.submitted == len(chunks)
+    assert pool.most_ahead == 3
+
+def test_load_in_parallel_matches_serial_load(session):
+    load_top_solutions_from_file(OVERLAPPING_HISTORIES, session, bulk_size=10)
+    load_top_solutions_from_file(TWO_SOLUTIONS, session, bulk_size=10)
+    serial = dump_tables(session)
+
+    reset_tables(session)
+    load_in_parallel([OVERLAPPING_HISTORIES, TWO_SOLUTIONS], session,
+                     workers=2, chunk_size=10)
+    assert dump_tables(session) == serial
+    assert session.query(Solution).count() == 4
+    assert session.query(History).count() == 5
+
+def test_load_in_parallel_logs_errors_with_file_line(tmp_log, tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    with open(scrape_file, 'w') as f:
+        f.write(open(TWO_SOLUTIONS).read())
+        f.write(open('tests/test_data/solutions_with_errors.json').read())
+
+    load_in_parallel([scrape_file], session, workers=2, chunk_size=10)
+    assert session.query(Solution).count() == 2
+
+    error_log = open(tmp_log).read()
+    assert '%s:3 IRDataPropertyError(solution has no HISTORY' % scrape_file in error_log
@@ -0,0 +1,59 @@
+import re
+import threading
+
+import pytest
+
+from folditdb import bench
+from folditdb.load import load_top_solutions_from_file
+from folditdb.pipeline import in_background
+from tests.test_bulk import dump_tables, reset_tables
+
+def log_messages(log_filepath):
+    """Logged lines without their timestamps."""
+    return re.sub(r'^\[[^]]*\] ', '', open(log_filepath).read(), flags=re.M)
+
+def test_in_background_yields_items_in_order():
+    assert list(in_background(iter(range(100)), queue_size=2)) == list(range(100))
+
+def test_in_background_holds_at_most_queue_size_items():
+    produced = []
+    def items():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    batches = in_background(items(), queue_size=3)
+    assert next(batches) == 0
+    threading.Event().wait(0.2)
+    # One being written, queue_size waiting, and one blocked on the queue
+    assert len(produced) <= 5
+    batches.close()
+
+def test_in_background_raises_parse_errors():
+    def items():
+        yield 1
+        raise ValueError('bad chunk')
+
+    batches = in_background(items())
+    assert next(batches) == 1
+    with pytest.raises(ValueError):
+        next(batches)
+
+def test_pipelined_load_matches_bulk_load(tmpdir, tmp_log, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 200)
+    with open(scrape_file, 'a') as f:
+        f.write(open('tests/test_data/solutions_with_errors.json').read())
+        f.write(open(scrape_file).readline())
+
+    load_top_solutions_from_file(scrape_file, session, bulk_size=30)
+    bulk_loaded = dump_tables(session)
+    bulk_log = log_messages(tmp_log)
+    open(tmp_log, 'w').close()
+
+    reset_tables(session)
+    load_top_solutions_from_file(scrape_file, session, bulk_size=30, queue_size=2,
+                                 checkpoint=True)
+    assert dump_tables(session) == bulk_loaded
+    assert log_messages(tmp_log) == bulk_log
+    assert '%s:201 ' % scrape_file in bulk_log
@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+from folditdb import bench, query
+from folditdb.load import load_top_solutions_from_file, load_from_irdata
+from folditdb.irdata import IRData
+from folditdb.tables import Solution, Action
+from folditdb.tsv import dump_tsv_files, load_tsv_files
+
+@pytest.fixture(autouse=True)
+def empty_results():
+    query.RESULTS.clear()
+    yield
+    query.RESULTS.clear()
+
+@pytest.fixture
+def loaded(tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 200)
+    load_top_solutions_from_file(scrape_file, session, bulk_size=50)
+    return session
+
+def test_top_solutions(loaded):
+    top = query.top_solutions(loaded, 1, n=5)
+    scores = sorted((score for (score, ) in
+                     loaded.query(Solution.score).filter_by(puzzle_id=1)), reverse=True)
+    assert [row['score'] for row in top] == scores[:5]
+
+def test_player_action_totals(loaded):
+    player_id = loaded.query(Action.player_id).first()[0]
+    totals = {}
+    for action in loaded.query(Action).filter_by(player_id=player_id):
+        totals[action.action_name] = totals.get(action.action_name, 0) + action.action_n
+    assert dict(query.player_action_totals(loaded, player_id)) == totals
+
+def test_puzzle_summary_and_team_players(irdata_with_multiple_players, session):
+    load_from_irdata(irdata_with_multiple_players, session)
+    summary = query.puzzle_summary(session, irdata_with_multiple_players.puzzle_id)
+    assert summary['solutions'] == 1
+    assert summary['players'] == 2
+    team_name = session.query(Solution).one().players[0].team_name
+    assert all(row['solutions'] == 1 for row in query.team_players(session, team_name))
+
+def test_results_are_cached_until_the_loader_commits(loaded, solution_data):
+    top = query.top_solutions(loaded, 1, n=1)
+    loaded.query(Solution).filter_by(id=top[0]['id']).update(dict(score=-1))
+    loaded.commit()
+    assert query.top_solutions(loaded, 1, n=1) == top
+
+    # Loading a solution to another puzzle leaves the results cached
+    load_from_irdata(IRData(dict(solution_data, SID='100000', PID='2')), loaded)
+    assert query.top_solutions(loaded, 1, n=1) == top
+
+    load_from_irdata(IRData(dict(solution_data, SID='100001', PID='1', SCORE='-2')), loaded)
+    assert query.top_solutions(loaded, 1, n=1) != top
+
+def test_queries_can_be_called_with_keywords(loaded):
+    top = query.top_solutions(loaded, 1, 5)
+    assert query.top_solutions(loaded, puzzle_id=1, n=5) == top
+    assert query.top_solutions(loaded, 1, n=5) == top
+    assert len(query.RESULTS) == 1
+    assert query.top_solutions(loaded, 1) == query.top_solutions(loaded, 1, n=10)
+    assert len(query.RESULTS) == 2
+
+    player_id = loaded.query(Action.player_id).first()[0]
+    assert (query.player_action_totals(loaded, player_id=player_id) ==
+            query.player_action_totals(loaded, player_id))
+    assert query.puzzle_summary(loaded, puzzle_id=1) == query.puzzle_summary(loaded, 1)
+    assert query.team_players(loaded, team_name='none') == []
+
+    # A load that tags the puzzle drops results cached from keyword calls
+    query.RESULTS.invalidate(('puzzle', 1))
+    assert len(query.RESULTS) == 2
+
+def test_rolled_back_loads_do_not_invalidate(loaded, solution_data):
+    top = query.top_solutions(loaded, 1, n=1)
+    loaded.query(Solution).filter_by(id=top[0]['id']).update(dict(score=-1))
+    loaded.commit()
+    load_from_irdata(IRData(dict(solution_data, SID='100001', PID='1')), loaded, commit=False)
+    loaded.rollback()
+    assert query.top_solutions(loaded, 1, n=1) == top
+
+def test_query_cache_expires_and_evicts():
+    cache = query.QueryCache(max_size=2, ttl=10)
+    now = [0]
+    cache.clock = lambda: now[0]
+    cache.set('a', 1, ('puzzle', 1))
+    cache.set('b', 2, ('puzzle', 2))
+    assert cache.get('a') == 1
+    cache.set('c', 3, ('puzzle', 1))
+    assert cache.get('b') is None
+    cache.invalidate(('puzzle', 1))
+    assert len(cache) == 0
+    cache.set('d', 4, ('player', 1))
+    now[0] = 10
+    assert cache.get('d') is None
+
+def test_backfills_clear_cached_results(tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 20)
+    tsv_dir = str(tmpdir.join('tsv'))
+    dump_tsv_files([scrape_file], tsv_dir)
+
+    assert query.top_solutions(session, 1) == []
+    load_tsv_files(tsv_dir, session)
+    assert query.top_solutions(session, 1) != []
+
+def test_query_cache_can_be_shared_by_threads():
+    cache = query.QueryCache(max_size=8)
+
+    def use_cache(n):
+        for i in range(2000):
+            key = (n, i % 16)
+            cache.set(key, i, ('puzzle', i % 4))
+            cache.get(key)
+            cache.invalidate(('puzzle', (i + n) % 4))
+
+    threads = [threading.Thread(target=use_cache, args=(n, )) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) <= 8
+    assert sum(len(keys) for keys in cache._tagged.values()) == len(cache)
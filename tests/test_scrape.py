@@ -0,0 +1,62 @@
+import bz2
+import gzip
+import lzma
+
+import pytest
+
+from folditdb.scrape import iter_lines, find_scrape_files, ScrapeReader
+from folditdb.irdata import IRData, IRDataCreationError
+from folditdb.tables import Solution
+from folditdb.load import load_top_solutions_from_file
+
+TWO_SOLUTIONS = 'tests/test_data/two_solutions_to_same_puzzle.json'
+
+def test_iter_lines_across_chunks():
+    lines = list(iter_lines(TWO_SOLUTIONS, chunk_size=7))
+    assert lines == open(TWO_SOLUTIONS, 'rb').read().splitlines()
+
+@pytest.mark.parametrize('suffix, opener', [
+    ('.gz', gzip.open),
+    ('.bz2', bz2.open),
+    ('.xz', lzma.open),
+])
+def test_iter_lines_from_compressed_file(tmpdir, suffix, opener):
+    scrape_file = str(tmpdir.join('scrape.json' + suffix))
+    with opener(scrape_file, 'wb') as f:
+        f.write(open(TWO_SOLUTIONS, 'rb').read())
+    assert len(list(iter_lines(scrape_file))) == 2
+
+def test_bad_json_raises_on_first_property():
+    irdata = IRData.from_json(b'{"SID": ')
+    with pytest.raises(IRDataCreationError):
+        irdata.solution_id
+
+def test_bad_json_line_does_not_stop_load(tmp_log, tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json.gz'))
+    with gzip.open(scrape_file, 'wb') as f:
+        f.write(b'{"SID": \n')
+        f.write(open(TWO_SOLUTIONS, 'rb').read())
+
+    load_top_solutions_from_file(scrape_file, session)
+    assert session.query(Solution).count() == 2
+    assert '%s:1 IRDataCreationError' % scrape_file in open(tmp_log).read()
+
+def test_scrape_reader_tracks_offset_and_line():
+    reader = ScrapeReader(TWO_SOLUTIONS, chunk_size=7)
+    data = open(TWO_SOLUTIONS, 'rb').read()
+    offsets = []
+    for json_bytes in reader:
+        offsets.append((reader.line, reader.offset))
+    first_line = data.index(b'\n') + 1
+    assert offsets == [(1, first_line), (2, len(data))]
+    assert reader.fraction_read() == 1.0
+
+def test_find_scrape_files_in_directories_and_globs(tmpdir):
+    for name in ['a.json', 'b.json.gz', 'notes.txt', 'sub/c.json']:
+        tmpdir.join(name).ensure()
+    found = find_scrape_files([str(tmpdir), str(tmpdir.join('*.json'))])
+    assert found == [str(tmpdir.join(name)) for name in ['a.json', 'b.json.gz', 'sub/c.json']]
+
+def test_find_scrape_files_raises_for_missing_path(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        find_scrape_files([str(tmpdir.join('*.json'))])
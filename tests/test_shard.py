@@ -0,0 +1,86 @@
+import json
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from folditdb import bench
+from folditdb.cache import IntSet, KeyCache
+from folditdb.db import new_session, init_db
+from folditdb.load import load_top_solutions_from_file
+from folditdb.shard import load_sharded, shard_for
+from folditdb.tables import Base, Solution, Action
+
+def shard_sessions(tmpdir, n_shards):
+    sessions = []
+    for i in range(n_shards):
+        engine = create_engine('sqlite:///%s' % tmpdir.join('shard%d.db' % i))
+        Base.metadata.create_all(engine)
+        sessions.append(sessionmaker(bind=engine)())
+    return sessions
+
+def test_sharded_load_splits_puzzles_across_dbs(tmpdir, tmp_log, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 200)
+    with open(scrape_file, 'a') as f:
+        f.write(open('tests/test_data/solutions_with_errors.json').read())
+        f.write(open(scrape_file).readline())
+
+    load_top_solutions_from_file(scrape_file, session, bulk_size=50)
+    solutions = set(session.query(Solution.id, Solution.puzzle_id, Solution.score))
+    n_actions = session.query(Action).count()
+
+    shards = shard_sessions(tmpdir, 3)
+    load_sharded([scrape_file], shards, bulk_size=20)
+
+    sharded = set()
+    for i, shard in enumerate(shards):
+        rows = set(shard.query(Solution.id, Solution.puzzle_id, Solution.score))
+        assert rows
+        assert all(shard_for(puzzle_id, 3) == i for _, puzzle_id, _ in rows)
+        sharded |= rows
+    assert sharded == solutions
+    assert sum(shard.query(Action).count() for shard in shards) == n_actions
+
+    error_log = open(tmp_log).read()
+    assert '%s:201 IRDataPropertyError(solution has no HISTORY' % scrape_file in error_log
+    assert '%s:202 DuplicateIRDataException()' % scrape_file in error_log
+
+def test_sharded_load_resumes_after_finished_files(tmpdir):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 50)
+    shards = shard_sessions(tmpdir, 2)
+    load_sharded([scrape_file], shards, bulk_size=20, checkpoint=True)
+    load_sharded([scrape_file], shards, bulk_size=20, resume=True)
+    assert sum(shard.query(Solution).count() for shard in shards) == 50
+
+def test_sharded_load_only_claims_written_solutions(tmpdir, solution_data):
+    invalid = {key: value for key, value in solution_data.items() if key != 'HISTORY'}
+    tmpdir.join('first.json').write(json.dumps(invalid) + '\n')
+    tmpdir.join('second.json').write(json.dumps(solution_data) + '\n')
+
+    shards = shard_sessions(tmpdir, 2)
+    claimed = IntSet()
+    load_sharded([str(tmpdir.join('first.json')), str(tmpdir.join('second.json'))], shards,
+                 claimed=claimed)
+    assert 1 in claimed
+    assert sum(shard.query(Solution).count() for shard in shards) == 1
+
+def test_shards_on_one_db_add_the_same_new_action_types(tmpdir, tmp_log):
+    url = 'sqlite:///%s' % tmpdir.join('shared.db')
+    init_db(url)
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 40)
+
+    sessions = [new_session(url, writer=True) for _ in range(2)]
+    caches = []
+    for session in sessions:
+        cache = KeyCache()
+        cache.seed(session)
+        session.commit()
+        caches.append(cache)
+    load_sharded([scrape_file], sessions, bulk_size=5, caches=caches)
+
+    assert sessions[0].query(Solution).count() == 40
+    assert 'IntegrityError' not in open(tmp_log).read()
+    for session in sessions:
+        session.close()
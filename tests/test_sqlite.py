@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import inspect
+
+from folditdb import bench, db, sqlite
+from folditdb.main import main
+from folditdb.tables import Puzzle, Solution
+
+def test_sqlite_connections_use_wal(tmpdir):
+    url = 'sqlite:///%s' % tmpdir.join('wal.db')
+    with db.get_engine(url).connect() as connection:
+        assert sqlite.pragma(connection, 'journal_mode') == 'wal'
+        assert sqlite.pragma(connection, 'synchronous') == 1
+    with db.get_engine(url, fast_load=True).connect() as connection:
+        assert sqlite.pragma(connection, 'synchronous') == 0
+        assert sqlite.pragma(connection, 'cache_size') == -262144
+
+def test_sqlite_savepoints_roll_back(tmpdir):
+    session = db.new_session('sqlite:///%s' % tmpdir.join('savepoint.db'))
+    db.init_db(session.bind.url)
+    # A SAVEPOINT that begins a transaction must not commit it when released
+    session.begin_nested()
+    session.add(Puzzle(id=1))
+    session.commit()
+    session.rollback()
+    assert session.query(Puzzle).count() == 0
+
+    session.add(Puzzle(id=1))
+    session.begin_nested()
+    session.add(Puzzle(id=2))
+    session.flush()
+    session.rollback()
+    session.commit()
+    assert [puzzle.id for puzzle in session.query(Puzzle)] == [1]
+    session.close()
+
+def test_queries_read_while_a_writer_writes(tmpdir):
+    url = 'sqlite:///%s' % tmpdir.join('lock.db')
+    db.init_db(url)
+    writer = db.new_session(url, writer=True)
+    reader = db.new_session(url)
+
+    # A writer takes the write lock when its transaction begins
+    assert writer.query(Puzzle).count() == 0
+    other = sqlite3.connect(str(tmpdir.join('lock.db')), timeout=0, isolation_level=None)
+    with pytest.raises(sqlite3.OperationalError):
+        other.execute('BEGIN IMMEDIATE')
+    other.close()
+
+    writer.add(Puzzle(id=1))
+    writer.flush()
+    assert reader.query(Puzzle).count() == 0
+    reader.commit()
+    writer.commit()
+    assert reader.query(Puzzle).count() == 1
+    reader.close()
+    writer.close()
+
+def test_fast_load_builds_indexes_at_the_end(tmpdir, tmp_log):
+    url = 'sqlite:///%s' % tmpdir.join('fast.db')
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 100)
+    main(['init-db', '--db-url', url])
+    main(['--db-url', url, '--bulk-size', '30', '--fast-load', scrape_file])
+
+    session = db.new_session(url)
+    assert session.query(Solution).count() == 100
+    indexes = [index['name'] for index in inspect(session.bind).get_indexes('solution')]
+    assert 'ix_solution_puzzle_id_score' in indexes
+    session.close()
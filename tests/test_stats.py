@@ -0,0 +1,43 @@
+import io
+import json
+
+from folditdb.stats import LoadStats, STAGES
+from folditdb.load import load_top_solutions_from_file
+
+TWO_SOLUTIONS = 'tests/test_data/two_solutions_to_same_puzzle.json'
+
+def test_stats_count_records_and_rows(session):
+    stats = LoadStats()
+    load_top_solutions_from_file(TWO_SOLUTIONS, session, stats=stats)
+    summary = stats.summary()
+    assert summary['records'] == 2
+    assert summary['duplicates'] == 0
+    assert summary['rows']['solution'] == 2
+    assert list(summary['stages']) == list(STAGES)
+    assert all(seconds > 0 for seconds in summary['stages'].values())
+
+def test_stats_count_duplicates_and_errors_in_bulk(session):
+    stats = LoadStats()
+    load_top_solutions_from_file(TWO_SOLUTIONS, session, bulk_size=10, stats=stats)
+    load_top_solutions_from_file(TWO_SOLUTIONS, session, bulk_size=10, stats=stats)
+    load_top_solutions_from_file('tests/test_data/solutions_with_errors.json', session,
+                                 bulk_size=10, stats=stats)
+    assert stats.records == 5
+    assert stats.duplicates == 2
+    assert sum(stats.errors.values()) == 1
+    assert stats.rows['solution'] == 2
+
+def test_progress_line_estimates_time_remaining():
+    stats = LoadStats(progress_interval=0, progress_file=io.StringIO())
+    stats.track_progress('scrape.json', lambda: 0.25)
+    stats.read(100)
+    line = stats.progress_file.getvalue()
+    assert line.startswith('scrape.json: 100 records')
+    assert '25.0% read' in line and 'ETA' in line
+
+def test_write_summary(tmpdir):
+    stats = LoadStats()
+    stats.error('IRDataPropertyError')
+    summary_file = str(tmpdir.join('stats.json'))
+    stats.write_summary(summary_file)
+    assert json.load(open(summary_file))['errors'] == {'IRDataPropertyError': 1}
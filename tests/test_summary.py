@@ -0,0 +1,39 @@
+from folditdb import bench
+from folditdb.load import load_top_solutions_from_file
+from folditdb.migrations import migrate
+from folditdb.summary import rebuild_summaries
+from folditdb.tables import PuzzleSummary, PlayerActionSummary
+
+def dump_summaries(session):
+    return {table.name: sorted(session.execute(table.select()).fetchall())
+            for table in [PuzzleSummary.__table__, PlayerActionSummary.__table__]}
+
+def test_summaries_match_rebuild(tmpdir, session):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 200)
+    with open(scrape_file, 'a') as f:
+        f.write(open(scrape_file).readline())
+    lines = open(scrape_file).readlines()
+    first, second = str(tmpdir.join('first.json')), str(tmpdir.join('second.json'))
+    open(first, 'w').writelines(lines[:120])
+    open(second, 'w').writelines(lines[120:])
+
+    # Maintained by the ORM loader and the bulk loader, across batches
+    load_top_solutions_from_file(first, session, batch_size=10)
+    load_top_solutions_from_file(second, session, bulk_size=25)
+    maintained = dump_summaries(session)
+    assert len(maintained['puzzle_summary']) == 10
+
+    rebuild_summaries(session)
+    session.commit()
+    assert dump_summaries(session) == maintained
+
+def test_summaries_migration_fills_empty_summaries(session):
+    load_top_solutions_from_file('tests/test_data/two_solutions_to_same_puzzle.json', session)
+    loaded = dump_summaries(session)
+    session.execute(PuzzleSummary.__table__.delete())
+    session.execute(PlayerActionSummary.__table__.delete())
+    session.commit()
+
+    assert migrate(session.bind) == ['summaries']
+    assert dump_summaries(session) == loaded
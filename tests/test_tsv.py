@@ -0,0 +1,47 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from folditdb import bench
+from folditdb.load import load_top_solutions_from_file
+from folditdb.tsv import format_value, parse_value, dump_tsv_files, load_tsv_files
+from tests.test_bulk import dump_tables, reset_tables
+
+def test_values_round_trip():
+    for value in ['tab\\there', 'line\nbreak\r\n', 'back\\slash\\N', '[no group]']:
+        assert parse_value(format_value(value)) == value
+    assert '\t' not in format_value('a\tb')
+    assert parse_value(format_value(None)) is None
+    assert parse_value(format_value(1.5), float) == 1.5
+    timestamp = datetime(2017, 1, 2, 3, 4, 5)
+    assert parse_value(format_value(timestamp), datetime) == timestamp
+
+def test_backfill_writes_same_rows_as_bulk_load(tmpdir, session, solution_data):
+    scrape_file = str(tmpdir.join('scrape.json'))
+    bench.generate_scrape_file(scrape_file, 200)
+    with open(scrape_file, 'a') as f:
+        f.write(open('tests/test_data/solutions_with_errors.json').read())
+        f.write(open(scrape_file).readline())
+        # History rows that conflict with each other
+        for solution_id, history in [('1000', 'V0:0,V1:10,V2:5,V3:6'),
+                                     ('1001', 'V9:0,V1:10,V2:5,V7:3')]:
+            f.write(json.dumps(dict(solution_data, SID=solution_id, HISTORY=history)) + '\n')
+
+    load_top_solutions_from_file(scrape_file, session, bulk_size=50)
+    bulk_loaded = dump_tables(session)
+
+    reset_tables(session)
+    tsv_dir = str(tmpdir.join('tsv'))
+    written = dump_tsv_files([scrape_file], tsv_dir)
+    assert written['solution'] == 202
+    assert written['history_string'] == 1
+    assert load_tsv_files(tsv_dir, session) == written
+    assert dump_tables(session) == bulk_loaded
+
+def test_backfill_requires_empty_db(tmpdir, session):
+    load_top_solutions_from_file('tests/test_data/two_solutions_to_same_puzzle.json', session)
+    tsv_dir = str(tmpdir.join('tsv'))
+    dump_tsv_files(['tests/test_data/two_solutions_to_same_puzzle.json'], tsv_dir)
+    with pytest.raises(ValueError):
+        load_tsv_files(tsv_dir, session)
@@ -0,0 +1,127 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from folditdb.tables import Solution
+from folditdb.watch import (WorkQueue, PollingWatcher, InotifyWatcher, Worker, load_files,
+    move_file, watch)
+
+def test_work_queue_claims_each_path_once(tmpdir):
+    queue = WorkQueue(str(tmpdir.join('queue.db')))
+    queue.put(['/a.json', '/b.json', '/c.json'])
+    queue.put(['/a.json'])
+    assert len(queue) == 3
+
+    assert queue.claim(2) == ['/a.json', '/b.json']
+    assert queue.claim(2) == ['/c.json']
+    assert queue.claim(2) == []
+
+    queue.done(['/a.json'])
+    assert queue.release(['/b.json'], max_attempts=2) == []
+    assert queue.claim(2) == ['/b.json']
+    assert queue.release(['/b.json'], max_attempts=2) == ['/b.json']
+    queue.close()
+
+    # Claims do not outlive the process that made them
+    queue = WorkQueue(str(tmpdir.join('queue.db')))
+    queue.recover()
+    assert queue.claim(5) == ['/b.json', '/c.json']
+    queue.close()
+
+def test_polling_watcher_waits_for_files_to_settle(tmpdir):
+    old_file = tmpdir.join('old.json')
+    old_file.write('{')
+    tmpdir.join('done.json').write('{}')
+    watcher = PollingWatcher(str(tmpdir))
+    watcher.scan()
+    # Files in the directory at startup may still be being written
+    old_file.write('{}')
+    assert watcher.changes(0) == [str(tmpdir.join('done.json'))]
+    assert watcher.changes(0) == [str(old_file)]
+
+    new_file = tmpdir.join('new.json')
+    new_file.write('{')
+    tmpdir.join('notes.txt').write('')
+    assert watcher.changes(0) == []
+    new_file.write('{}')
+    assert watcher.changes(0) == []
+    assert watcher.changes(0) == [str(new_file)]
+    assert watcher.changes(0) == []
+
+def test_inotify_watcher_waits_for_files_at_startup_to_settle(tmpdir):
+    pytest.importorskip('inotify_simple')
+    old_file = tmpdir.join('old.json')
+    old_file.write('{')
+    watcher = InotifyWatcher(str(tmpdir))
+    watcher.scan()
+    with open(str(old_file), 'a') as f:
+        f.write('}')
+        f.flush()
+        assert watcher.changes(0) == []
+        assert watcher.changes(0) == [str(old_file)]
+    watcher.close()
+
+def test_load_files_in_one_transaction(tmpdir, tmp_log, session):
+    paths = [str(tmpdir.join(name)) for name in
+             ('single_solution.json', 'solution_without_history.json', 'top_solution.json')]
+    for path in paths:
+        shutil.copy(os.path.join('tests/test_data', os.path.basename(path)), path)
+
+    processed, failed, retry = load_files(paths + [str(tmpdir.join('moved.json'))], session)
+    assert processed == [paths[0], paths[2], str(tmpdir.join('moved.json'))]
+    assert failed == [paths[1]]
+    assert retry == []
+    assert session.query(Solution).count() == 2
+
+    # Solutions loaded before a crash are moved to processed when they are seen again
+    assert load_files(paths[:1], session) == (paths[:1], [], [])
+    assert 'DuplicateIRDataException' in open(tmp_log).read()
+
+def test_files_that_cannot_be_read_are_failed(tmpdir, tmp_log, session):
+    watch_dir = tmpdir.mkdir('incoming')
+    watch_dir.mkdir('directory.json')
+    shutil.copy('tests/test_data/single_solution.json', str(watch_dir))
+    queue = WorkQueue(str(tmpdir.join('queue.db')))
+    queue.put([str(watch_dir.join(name)) for name in ('directory.json', 'single_solution.json')])
+
+    worker = Worker(queue, session, str(tmpdir.join('processed')), str(tmpdir.join('failed')),
+                    threading.Event())
+    assert worker.work() == 2
+    assert os.listdir(str(tmpdir.join('failed'))) == ['directory.json']
+    assert os.listdir(str(tmpdir.join('processed'))) == ['single_solution.json']
+    assert len(queue) == 0
+    assert 'IsADirectoryError' in open(tmp_log).read()
+    queue.close()
+
+def test_move_file_keeps_files_with_the_same_name(tmpdir):
+    for n in range(2):
+        tmpdir.join('solution.json').write(str(n))
+        move_file(str(tmpdir.join('solution.json')), str(tmpdir.join('processed')))
+    assert sorted(os.listdir(str(tmpdir.join('processed')))) == ['solution.json',
+                                                                  'solution.json.1']
+
+def test_watch_loads_files_as_they_arrive(tmpdir, tmp_log, session):
+    watch_dir = tmpdir.mkdir('incoming')
+    shutil.copy('tests/test_data/single_solution.json', str(watch_dir))
+
+    stop = threading.Event()
+    daemon = threading.Thread(target=watch, args=(str(watch_dir), [session]),
+                              kwargs=dict(polling=True, stop=stop, poll_interval=0.01))
+    daemon.start()
+    shutil.copy('tests/test_data/top_solution.json', str(watch_dir))
+    shutil.copy('tests/test_data/solution_without_history.json', str(watch_dir))
+    for _ in range(500):
+        if len(os.listdir(str(watch_dir))) == 2:
+            break
+        threading.Event().wait(0.01)
+    stop.set()
+    daemon.join()
+
+    assert sorted(os.listdir(str(watch_dir))) == ['failed', 'processed']
+    assert sorted(os.listdir(str(watch_dir.join('processed')))) == [
+        'single_solution.json', 'top_solution.json']
+    assert os.listdir(str(watch_dir.join('failed'))) == ['solution_without_history.json']
+    assert session.query(Solution).count() == 2
+    assert len(WorkQueue(str(tmpdir.join('incoming.queue.db')))) == 0